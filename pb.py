@@ -4,28 +4,119 @@ import json
 import math
 import copy
 import os
+import time
+import bisect
+import heapq
+import struct
+import zlib
+import zipfile
+import hashlib
+import mmap
+import gzip
+import codecs
+import base64
+import argparse
+import glob
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import threading
+from collections import Counter, OrderedDict, deque
 from PyQt6.QtWidgets import *
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 from PyQt6.QtPrintSupport import QPrinter
 
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖，缺失时退回逐条计算
+    np = None
+
 # --- Configuration & Constants ---
 DEFAULT_FONT = "SimSun"
 DEFAULT_FONT_SIZE = 24
 COLUMN_SPACING = 10
 LINE_HEIGHT_RATIO = 1.2
+CONNECTION_SNAP_RADIUS = 30  # 拖拽连线时吸附连接点的半径（像素）
+VIRTUAL_MARGIN = 400  # 虚拟化显示时，可见区域外预先实例化的范围（场景坐标）
+VIRTUAL_EVICT_DELAY = 10  # 虚拟化显示时，元素离开可见区域多少秒后释放字形/图片
 ASSETS_DIR = "assets"  # 素材库目录
 DEFAULT_LINE_WIDTH = 3  # 默认连接线粗细（像素）
 CONFIG_FILE = "config.json"  # 配置文件
+BINARY_PROJECT_EXT = ".vlayoutb"  # 二进制工程文件扩展名
+BUNDLE_PROJECT_EXT = ".vlayoutz"  # 自包含工程包扩展名（zip，内含图片）
+PROJECT_EXTENSIONS = (".vlayout", ".vlayoutb", ".vlayoutz", ".vlayout.gz")  # 可打开的工程文件
+PREVIEW_SIZE = 192  # 工程预览缩略图的最大边长（像素）
+AUTOSAVE_FILE = "autosave.vlayout.gz"  # 自动保存文件（gzip压缩的JSON）
+BUNDLE_IMAGE_PREFIX = "vlbundle:"  # 工程包内图片的虚拟路径前缀：vlbundle:<工程包路径>::<条目名>
+BUNDLE_PIXMAP_CACHE_BYTES = 64 * 1024 * 1024  # 工程包图片解码缓存上限，超出后释放最久未用的图片
+LOAD_ROUTE_BATCH = 256  # 加载工程时每批计算贝塞尔路径的连接线数
 
 # Vertically sensitive characters (Simple Heuristic for demo)
 ROTATE_CHARS = {'—', '…', '(', ')', '[', ']', '{', '}', '《', '》', '-', '_'}
 OFFSET_CHARS = {'，', '。', '、', '：', '；', '！', '？', ',', '.', '!', '?'}
 
+# --- Connector Curve Routing ---
+# 曲线样式: (距离系数, 偏移上限, 方向模式)
+# 距离系数为None时偏移量固定为上限；方向模式:
+#   'dominant' - 按水平/垂直主方向弯曲, 'vertical' - 按上下关系垂直弯曲, 'down' - 始终向下弯曲
+CURVE_STYLE_GENERIC = (0.3, 80, 'dominant')
+CURVE_STYLE_IMAGE_TEXT = (0.3, 100, 'vertical')
+CURVE_STYLE_PARENT_CHILD = (None, 50, 'down')
+
+def curve_controls(x1, y1, x2, y2, ratio, cap, mode):
+    """计算单条连接线的两个控制点"""
+    dx = x2 - x1
+    dy = y2 - y1
+    if ratio is None:
+        offset = cap
+    else:
+        offset = min((abs(dx) + abs(dy)) * ratio, cap)
+
+    if mode == 'dominant' and abs(dx) > abs(dy):  # 水平方向为主
+        ox = offset if dx > 0 else -offset
+        return (x1 + ox, y1), (x2 - ox, y2)
+
+    if mode == 'down':
+        oy = offset
+    else:
+        oy = offset if dy > 0 else -offset
+    return (x1, y1 + oy), (x2, y2 - oy)
+
+def compute_curve_controls(starts, ends, ratio, cap, mode):
+    """批量计算连接线控制点
+    starts/ends为[(x, y), ...]，返回[((c1x, c1y), (c2x, c2y)), ...]
+    """
+    if not starts:
+        return []
+    if np is None:
+        return [curve_controls(x1, y1, x2, y2, ratio, cap, mode)
+                for (x1, y1), (x2, y2) in zip(starts, ends)]
+
+    p1 = np.asarray(starts, dtype=float)
+    p2 = np.asarray(ends, dtype=float)
+    d = p2 - p1
+    if ratio is None:
+        offset = np.full(len(p1), float(cap))
+    else:
+        offset = np.minimum(np.abs(d).sum(axis=1) * ratio, cap)
+
+    if mode == 'dominant':
+        horizontal = np.abs(d[:, 0]) > np.abs(d[:, 1])
+    else:
+        horizontal = np.zeros(len(p1), dtype=bool)
+    sign_x = np.where(d[:, 0] > 0, 1.0, -1.0)
+    sign_y = np.ones(len(p1)) if mode == 'down' else np.where(d[:, 1] > 0, 1.0, -1.0)
+
+    shift = np.zeros_like(p1)
+    shift[:, 0] = np.where(horizontal, sign_x * offset, 0.0)
+    shift[:, 1] = np.where(horizontal, 0.0, sign_y * offset)
+    c1 = p1 + shift
+    c2 = p2 - shift
+    return [((a[0], a[1]), (b[0], b[1])) for a, b in zip(c1.tolist(), c2.tolist())]
+
 class ConfigManager:
     """配置管理器"""
     def __init__(self):
-        self.config_file = CONFIG_FILE
+        self.config_file = os.path.abspath(CONFIG_FILE)  # 启动时确定，之后不随当前工作目录变化
         self.config = self.load_config()
     
     def load_config(self):
@@ -50,7 +141,14 @@ class ConfigManager:
             'background_opacity': 0.3,  # 背景图片透明度 (0.0-1.0)
             'background_scale_mode': 'fit',  # 缩放模式: 'fit', 'fill', 'stretch', 'tile'
             'default_font_family': DEFAULT_FONT,  # 默认字体
-            'default_font_size': DEFAULT_FONT_SIZE  # 默认字体大小
+            'default_font_size': DEFAULT_FONT_SIZE,  # 默认字体大小
+            'auto_connect_max_distance': 300,  # 就近连接的最大距离（像素）
+            'auto_connect_direction': 'below',  # 就近连接方向: 'below'(文字在图片下方), 'above', 'any'
+            'autosave_interval': 60,  # 自动保存间隔（秒），0 表示关闭
+            'autosave_path': AUTOSAVE_FILE,  # 自动保存文件路径
+            'undo_budget_mb': 64,  # 撤销历史的内存预算（MB）
+            'export_dpi': 300,  # 导出图片的DPI（画布按300dpi设计，300即1:1）
+            'export_regions': {}  # 命名导出区域: 名称 -> [x, y, 宽, 高]（场景坐标）
         }
     
     def save_config(self):
@@ -140,8 +238,7 @@ class AssetManager:
         
         try:
             # 复制文件
-            import shutil
-            shutil.copy2(original_path, asset_path)
+            ProjectBundle.copy_image(original_path, asset_path)
             print(f"图片已复制到: {asset_path}")
             
             asset_data = {
@@ -208,8 +305,7 @@ class AssetManager:
                 asset_path = os.path.join(ASSETS_DIR, f"group_{len(self.assets['groups'])}_{idx}_{filename}")
                 
                 try:
-                    import shutil
-                    shutil.copy2(original_path, asset_path)
+                    ProjectBundle.copy_image(original_path, asset_path)
                     
                     # 保存连接点可见性状态
                     connection_point_visible = item.connection_point.isVisible() if item.connection_point else True
@@ -527,94 +623,99 @@ class AssetLibraryDockWidget(QDockWidget):
         """使用组合素材"""
         asset = item.data(Qt.ItemDataRole.UserRole)
         if asset:
-            # 获取粘贴位置
-            center = self.main_window.view.mapToScene(self.main_window.view.viewport().rect().center())
-            
-            # 计算所有项目的边界框，用于确定粘贴位置
-            if asset['items']:
-                min_x = min(item_data['scene_pos'][0] for item_data in asset['items'])
-                min_y = min(item_data['scene_pos'][1] for item_data in asset['items'])
-            else:
-                min_x = min_y = 0
-            
-            base_x, base_y = center.x(), center.y()
-            new_items = []
+            # 整个组合素材作为一步撤销，连接线在结束时统一计算路径
+            scene = self.main_window.scene
+            scene.undo_stack.begin_macro(scene)
+            try:
+                self.place_group_asset(asset)
+            finally:
+                scene.undo_stack.end_macro()
+    
+    def place_group_asset(self, asset):
+        """在画布中央创建组合素材的元素、父子关系和图文连接（在组合命令中调用）"""
+        # 获取粘贴位置
+        center = self.main_window.view.mapToScene(self.main_window.view.viewport().rect().center())
+        
+        # 计算所有项目的边界框，用于确定粘贴位置
+        if asset['items']:
+            min_x = min(item_data['scene_pos'][0] for item_data in asset['items'])
+            min_y = min(item_data['scene_pos'][1] for item_data in asset['items'])
+        else:
+            min_x = min_y = 0
+        
+        base_x, base_y = center.x(), center.y()
+        new_items = []
+        
+        # 第一步：创建所有项目
+        for idx, item_data in enumerate(asset['items']):
+            new_item = None
             
-            # 第一步：创建所有项目
-            for idx, item_data in enumerate(asset['items']):
-                new_item = None
+            if item_data['type'] == 'VTextItem':
+                new_item = VTextItem(
+                    item_data['text'],
+                    item_data['font_size'],
+                    item_data['box_height']
+                )
+                new_item.font_family = item_data['font_family']
+                new_item.text_color = QColor(item_data['text_color'])
                 
-                if item_data['type'] == 'VTextItem':
-                    new_item = VTextItem(
-                        item_data['text'],
-                        item_data['font_size'],
-                        item_data['box_height']
-                    )
-                    new_item.font_family = item_data['font_family']
-                    new_item.text_color = QColor(item_data['text_color'])
-                    
-                    # 恢复其他属性
-                    if 'chars_per_column' in item_data:
-                        new_item.chars_per_column = item_data['chars_per_column']
-                    if 'column_spacing' in item_data:
-                        new_item.column_spacing = item_data['column_spacing']
-                    if 'auto_height' in item_data:
-                        new_item.auto_height = item_data['auto_height']
-                    if 'manual_line_break' in item_data:
-                        new_item.manual_line_break = item_data['manual_line_break']
-                    
-                    new_item.rebuild()
-                        
-                elif item_data['type'] == 'VImageItem':
-                    if os.path.exists(item_data['path']):
-                        new_item = VImageItem(item_data['path'], item_data['width'])
+                # 恢复其他属性
+                if 'chars_per_column' in item_data:
+                    new_item.chars_per_column = item_data['chars_per_column']
+                if 'column_spacing' in item_data:
+                    new_item.column_spacing = item_data['column_spacing']
+                if 'auto_height' in item_data:
+                    new_item.auto_height = item_data['auto_height']
+                if 'manual_line_break' in item_data:
+                    new_item.manual_line_break = item_data['manual_line_break']
                 
-                if new_item:
-                    # 计算相对于原始组合的偏移量，然后应用到新的基准位置
-                    offset_x = item_data['scene_pos'][0] - min_x
-                    offset_y = item_data['scene_pos'][1] - min_y
-                    new_item.setPos(base_x + offset_x, base_y + offset_y)
-                    
-                    # 使用撤销系统添加元素
-                    command = AddItemCommand(self.main_window.scene, new_item)
-                    self.main_window.scene.undo_stack.push(command)
-                    
-                    # 在AddItemCommand执行后，重新设置连接点可见性
-                    # 因为AddItemCommand.execute()会使用场景的全局设置覆盖个别设置
-                    if 'connection_point_visible' in item_data and new_item.connection_point:
-                        new_item.connection_point.setVisible(item_data['connection_point_visible'])
-                    
-                    new_items.append(new_item)
-            
-            # 第二步：恢复父子关系
-            for idx, item_data in enumerate(asset['items']):
-                if item_data['parent_index'] != -1 and item_data['parent_index'] < len(new_items):
-                    child_item = new_items[idx]
-                    parent_item = new_items[item_data['parent_index']]
-                    
-                    # 保存当前场景坐标
-                    current_scene_pos = child_item.scenePos()
-                    # 设置父子关系
-                    child_item.setParentItem(parent_item)
-                    # 将场景坐标转换为父级的本地坐标
-                    local_pos = parent_item.mapFromScene(current_scene_pos)
-                    child_item.setPos(local_pos)
+                new_item.rebuild()
                     
-                    # 创建父子连接线
-                    self.main_window.scene.add_connector(parent_item, child_item)
-            
-            # 第三步：恢复图文连接
-            for img_idx, text_idx in asset['image_text_connections']:
-                if img_idx < len(new_items) and text_idx < len(new_items):
-                    img_item = new_items[img_idx]
-                    text_item = new_items[text_idx]
-                    # 确保是正确的类型
-                    if isinstance(img_item, VImageItem) and isinstance(text_item, VTextItem):
-                        self.main_window.scene.add_image_text_connector(img_item, text_item)
-                    elif isinstance(img_item, VTextItem) and isinstance(text_item, VImageItem):
-                        self.main_window.scene.add_image_text_connector(text_item, img_item)
+            elif item_data['type'] == 'VImageItem':
+                if os.path.exists(item_data['path']):
+                    new_item = VImageItem(item_data['path'], item_data['width'])
             
-            print(f"已添加组合素材 {asset['name']} ({len(new_items)} 个元素)")
+            if new_item:
+                # 计算相对于原始组合的偏移量，然后应用到新的基准位置
+                offset_x = item_data['scene_pos'][0] - min_x
+                offset_y = item_data['scene_pos'][1] - min_y
+                new_item.setPos(base_x + offset_x, base_y + offset_y)
+                
+                # 使用撤销系统添加元素
+                command = AddItemCommand(self.main_window.scene, new_item)
+                self.main_window.scene.undo_stack.push(command)
+                
+                # 在AddItemCommand执行后，重新设置连接点可见性
+                # 因为AddItemCommand.execute()会使用场景的全局设置覆盖个别设置
+                if 'connection_point_visible' in item_data and new_item.connection_point:
+                    new_item.connection_point.setVisible(item_data['connection_point_visible'])
+                
+                new_items.append(new_item)
+        
+        # 第二步：恢复父子关系
+        for idx, item_data in enumerate(asset['items']):
+            if item_data['parent_index'] != -1 and item_data['parent_index'] < len(new_items):
+                child_item = new_items[idx]
+                parent_item = new_items[item_data['parent_index']]
+                
+                # 设置父子关系并创建连接线（记录为命令，撤销/重做时一并恢复）
+                command = SetParentCommand(self.main_window.scene, child_item, parent_item)
+                self.main_window.scene.undo_stack.push(command)
+        
+        # 第三步：恢复图文连接（统一去重并计算路径）
+        pairs = []
+        for img_idx, text_idx in asset['image_text_connections']:
+            if img_idx < len(new_items) and text_idx < len(new_items):
+                img_item = new_items[img_idx]
+                text_item = new_items[text_idx]
+                # 确保是正确的类型
+                if isinstance(img_item, VImageItem) and isinstance(text_item, VTextItem):
+                    pairs.append((img_item, text_item))
+                elif isinstance(img_item, VTextItem) and isinstance(text_item, VImageItem):
+                    pairs.append((text_item, img_item))
+        self.main_window.scene.add_image_text_connectors_bulk(pairs)
+        
+        print(f"已添加组合素材 {asset['name']} ({len(new_items)} 个元素)")
     
     def delete_text_asset(self):
         """删除选中的文字素材"""
@@ -836,94 +937,99 @@ class AssetLibraryWidget(QWidget):
         """使用组合素材"""
         asset = item.data(Qt.ItemDataRole.UserRole)
         if asset:
-            # 获取粘贴位置
-            center = self.main_window.view.mapToScene(self.main_window.view.viewport().rect().center())
-            
-            # 计算所有项目的边界框，用于确定粘贴位置
-            if asset['items']:
-                min_x = min(item_data['scene_pos'][0] for item_data in asset['items'])
-                min_y = min(item_data['scene_pos'][1] for item_data in asset['items'])
-            else:
-                min_x = min_y = 0
-            
-            base_x, base_y = center.x(), center.y()
-            new_items = []
+            # 整个组合素材作为一步撤销，连接线在结束时统一计算路径
+            scene = self.main_window.scene
+            scene.undo_stack.begin_macro(scene)
+            try:
+                self.place_group_asset(asset)
+            finally:
+                scene.undo_stack.end_macro()
+    
+    def place_group_asset(self, asset):
+        """在画布中央创建组合素材的元素、父子关系和图文连接（在组合命令中调用）"""
+        # 获取粘贴位置
+        center = self.main_window.view.mapToScene(self.main_window.view.viewport().rect().center())
+        
+        # 计算所有项目的边界框，用于确定粘贴位置
+        if asset['items']:
+            min_x = min(item_data['scene_pos'][0] for item_data in asset['items'])
+            min_y = min(item_data['scene_pos'][1] for item_data in asset['items'])
+        else:
+            min_x = min_y = 0
+        
+        base_x, base_y = center.x(), center.y()
+        new_items = []
+        
+        # 第一步：创建所有项目
+        for idx, item_data in enumerate(asset['items']):
+            new_item = None
             
-            # 第一步：创建所有项目
-            for idx, item_data in enumerate(asset['items']):
-                new_item = None
+            if item_data['type'] == 'VTextItem':
+                new_item = VTextItem(
+                    item_data['text'],
+                    item_data['font_size'],
+                    item_data['box_height']
+                )
+                new_item.font_family = item_data['font_family']
+                new_item.text_color = QColor(item_data['text_color'])
                 
-                if item_data['type'] == 'VTextItem':
-                    new_item = VTextItem(
-                        item_data['text'],
-                        item_data['font_size'],
-                        item_data['box_height']
-                    )
-                    new_item.font_family = item_data['font_family']
-                    new_item.text_color = QColor(item_data['text_color'])
-                    
-                    # 恢复其他属性
-                    if 'chars_per_column' in item_data:
-                        new_item.chars_per_column = item_data['chars_per_column']
-                    if 'column_spacing' in item_data:
-                        new_item.column_spacing = item_data['column_spacing']
-                    if 'auto_height' in item_data:
-                        new_item.auto_height = item_data['auto_height']
-                    if 'manual_line_break' in item_data:
-                        new_item.manual_line_break = item_data['manual_line_break']
-                    
-                    new_item.rebuild()
-                        
-                elif item_data['type'] == 'VImageItem':
-                    if os.path.exists(item_data['path']):
-                        new_item = VImageItem(item_data['path'], item_data['width'])
+                # 恢复其他属性
+                if 'chars_per_column' in item_data:
+                    new_item.chars_per_column = item_data['chars_per_column']
+                if 'column_spacing' in item_data:
+                    new_item.column_spacing = item_data['column_spacing']
+                if 'auto_height' in item_data:
+                    new_item.auto_height = item_data['auto_height']
+                if 'manual_line_break' in item_data:
+                    new_item.manual_line_break = item_data['manual_line_break']
                 
-                if new_item:
-                    # 计算相对于原始组合的偏移量，然后应用到新的基准位置
-                    offset_x = item_data['scene_pos'][0] - min_x
-                    offset_y = item_data['scene_pos'][1] - min_y
-                    new_item.setPos(base_x + offset_x, base_y + offset_y)
-                    
-                    # 使用撤销系统添加元素
-                    command = AddItemCommand(self.main_window.scene, new_item)
-                    self.main_window.scene.undo_stack.push(command)
-                    
-                    # 在AddItemCommand执行后，重新设置连接点可见性
-                    # 因为AddItemCommand.execute()会使用场景的全局设置覆盖个别设置
-                    if 'connection_point_visible' in item_data and new_item.connection_point:
-                        new_item.connection_point.setVisible(item_data['connection_point_visible'])
-                    
-                    new_items.append(new_item)
-            
-            # 第二步：恢复父子关系
-            for idx, item_data in enumerate(asset['items']):
-                if item_data['parent_index'] != -1 and item_data['parent_index'] < len(new_items):
-                    child_item = new_items[idx]
-                    parent_item = new_items[item_data['parent_index']]
-                    
-                    # 保存当前场景坐标
-                    current_scene_pos = child_item.scenePos()
-                    # 设置父子关系
-                    child_item.setParentItem(parent_item)
-                    # 将场景坐标转换为父级的本地坐标
-                    local_pos = parent_item.mapFromScene(current_scene_pos)
-                    child_item.setPos(local_pos)
+                new_item.rebuild()
                     
-                    # 创建父子连接线
-                    self.main_window.scene.add_connector(parent_item, child_item)
-            
-            # 第三步：恢复图文连接
-            for img_idx, text_idx in asset['image_text_connections']:
-                if img_idx < len(new_items) and text_idx < len(new_items):
-                    img_item = new_items[img_idx]
-                    text_item = new_items[text_idx]
-                    # 确保是正确的类型
-                    if isinstance(img_item, VImageItem) and isinstance(text_item, VTextItem):
-                        self.main_window.scene.add_image_text_connector(img_item, text_item)
-                    elif isinstance(img_item, VTextItem) and isinstance(text_item, VImageItem):
-                        self.main_window.scene.add_image_text_connector(text_item, img_item)
+            elif item_data['type'] == 'VImageItem':
+                if os.path.exists(item_data['path']):
+                    new_item = VImageItem(item_data['path'], item_data['width'])
             
-            print(f"已添加组合素材 {asset['name']} ({len(new_items)} 个元素)")
+            if new_item:
+                # 计算相对于原始组合的偏移量，然后应用到新的基准位置
+                offset_x = item_data['scene_pos'][0] - min_x
+                offset_y = item_data['scene_pos'][1] - min_y
+                new_item.setPos(base_x + offset_x, base_y + offset_y)
+                
+                # 使用撤销系统添加元素
+                command = AddItemCommand(self.main_window.scene, new_item)
+                self.main_window.scene.undo_stack.push(command)
+                
+                # 在AddItemCommand执行后，重新设置连接点可见性
+                # 因为AddItemCommand.execute()会使用场景的全局设置覆盖个别设置
+                if 'connection_point_visible' in item_data and new_item.connection_point:
+                    new_item.connection_point.setVisible(item_data['connection_point_visible'])
+                
+                new_items.append(new_item)
+        
+        # 第二步：恢复父子关系
+        for idx, item_data in enumerate(asset['items']):
+            if item_data['parent_index'] != -1 and item_data['parent_index'] < len(new_items):
+                child_item = new_items[idx]
+                parent_item = new_items[item_data['parent_index']]
+                
+                # 设置父子关系并创建连接线（记录为命令，撤销/重做时一并恢复）
+                command = SetParentCommand(self.main_window.scene, child_item, parent_item)
+                self.main_window.scene.undo_stack.push(command)
+        
+        # 第三步：恢复图文连接（统一去重并计算路径）
+        pairs = []
+        for img_idx, text_idx in asset['image_text_connections']:
+            if img_idx < len(new_items) and text_idx < len(new_items):
+                img_item = new_items[img_idx]
+                text_item = new_items[text_idx]
+                # 确保是正确的类型
+                if isinstance(img_item, VImageItem) and isinstance(text_item, VTextItem):
+                    pairs.append((img_item, text_item))
+                elif isinstance(img_item, VTextItem) and isinstance(text_item, VImageItem):
+                    pairs.append((text_item, img_item))
+        self.main_window.scene.add_image_text_connectors_bulk(pairs)
+        
+        print(f"已添加组合素材 {asset['name']} ({len(new_items)} 个元素)")
     
     def delete_text_asset(self):
         """删除选中的文字素材"""
@@ -955,12 +1061,848 @@ class AssetLibraryWidget(QWidget):
                 self.asset_manager.remove_group_asset(asset['id'])
                 self.refresh_assets()
 
+class BinaryProjectCodec:
+    """二进制工程格式编解码，与JSON工程数据可无损互转
+    
+    文件结构（小端）：
+        头部     magic 'VLYB' | 格式版本 u16 | 保留 u16
+        元数据   u32长度 + UTF-8 JSON（items等列表以外的顶层字段）
+        字符串表 u32数量 + 每项 u32长度 + UTF-8（字体、颜色、路径等重复字符串）
+        三个段   items / connectors / image_text_connectors，每段 u32数量 + 记录
+    
+    段内先连续存放所有记录的定长部分，再按记录顺序存放变长部分：
+        定长：存在位 u32 | 整数位 u32 | 布尔值位 u32 | 每个数值字段 f64 | 每个字符串字段 u32（字符串表下标）
+        变长：每个存在的文本字段 u32长度 + UTF-8 | 额外字段 u32长度 + UTF-8 JSON（不在字段表中或类型不符的键）
+    """
+    MAGIC = b'VLYB'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHH')
+    U32 = struct.Struct('<I')
+    SECTIONS = ('items', 'connectors', 'image_text_connectors')
+    # 字段表：(键, 类型)；类型为 num / str / bool / text
+    FIELDS = {
+        'items': (
+            ('id', 'num'), ('type', 'str'), ('x', 'num'), ('y', 'num'),
+            ('scene_x', 'num'), ('scene_y', 'num'), ('parent_id', 'num'), ('z', 'num'),
+            ('font_size', 'num'), ('box_height', 'num'), ('chars_per_column', 'num'),
+            ('column_spacing', 'num'), ('width', 'num'), ('font_family', 'str'),
+            ('text_color', 'str'), ('path', 'str'), ('auto_height', 'bool'),
+            ('manual_line_break', 'bool'), ('connection_point_visible', 'bool'), ('text', 'text'),
+        ),
+        'connectors': (
+            ('parent_id', 'num'), ('child_id', 'num'),
+        ),
+        'image_text_connectors': (
+            ('type', 'str'), ('image_id', 'num'), ('text_id', 'num'), ('item1_id', 'num'),
+            ('item2_id', 'num'), ('connection_type', 'str'), ('line_width', 'num'),
+        ),
+    }
+    
+    @staticmethod
+    def is_binary(head):
+        return head[:4] == BinaryProjectCodec.MAGIC
+    
+    @classmethod
+    def record_struct(cls, section):
+        fields = cls.FIELDS[section]
+        nums = sum(1 for _, kind in fields if kind == 'num')
+        strs = sum(1 for _, kind in fields if kind == 'str')
+        return struct.Struct('<III' + 'd' * nums + 'I' * strs), nums
+    
+    @classmethod
+    def encode(cls, project_data):
+        """工程数据（dict）编码为bytes"""
+        meta = {k: v for k, v in project_data.items() if k not in cls.SECTIONS}
+        strings = {}  # str -> 下标
+        sections = []
+        for section in cls.SECTIONS:
+            fields = cls.FIELDS[section]
+            record, _ = cls.record_struct(section)
+            entries = project_data.get(section, [])
+            fixed, tails = [], []
+            for entry in entries:
+                present = int_mask = bool_mask = 0
+                stored = 0
+                nums, refs = [], []
+                for bit, (key, kind) in enumerate(fields):
+                    value = entry.get(key, cls)  # cls作为缺失标记
+                    t = type(value)
+                    if kind == 'num':
+                        if t is float and value == value:  # 排除NaN
+                            present |= 1 << bit
+                            nums.append(value)
+                            stored += 1
+                        elif t is int and abs(value) <= 2 ** 53:
+                            present |= 1 << bit
+                            int_mask |= 1 << bit
+                            nums.append(float(value))
+                            stored += 1
+                        else:
+                            nums.append(0.0)
+                    elif kind == 'str':
+                        if t is str:
+                            present |= 1 << bit
+                            refs.append(strings.setdefault(value, len(strings)))
+                            stored += 1
+                        else:
+                            refs.append(0)
+                    elif kind == 'bool':
+                        if t is bool:
+                            present |= 1 << bit
+                            if value:
+                                bool_mask |= 1 << bit
+                            stored += 1
+                    elif t is str:
+                        present |= 1 << bit
+                        data = value.encode('utf-8')
+                        tails.append(cls.U32.pack(len(data)))
+                        tails.append(data)
+                        stored += 1
+                
+                # 不在字段表中或类型不符的键放入额外字段
+                if stored < len(entry):
+                    known = {key for bit, (key, _) in enumerate(fields) if present >> bit & 1}
+                    extra = {k: v for k, v in entry.items() if k not in known}
+                    data = json.dumps(extra, ensure_ascii=False).encode('utf-8')
+                    tails.append(cls.U32.pack(len(data)))
+                    tails.append(data)
+                else:
+                    tails.append(cls.U32.pack(0))
+                fixed.append(record.pack(present, int_mask, bool_mask, *nums, *refs))
+            sections.append(cls.U32.pack(len(entries)) + b''.join(fixed) + b''.join(tails))
+        
+        meta_data = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        out = [cls.HEADER.pack(cls.MAGIC, cls.VERSION, 0), cls.U32.pack(len(meta_data)), meta_data,
+               cls.U32.pack(len(strings))]
+        for text in strings:  # dict保持插入顺序，即下标顺序
+            data = text.encode('utf-8')
+            out.append(cls.U32.pack(len(data)) + data)
+        out.extend(sections)
+        return b''.join(out)
+    
+    @classmethod
+    def decode_meta(cls, head, f):
+        """只读取头部之后的元数据块（统计信息、预览图等）"""
+        magic, version, _ = cls.HEADER.unpack_from(head, 0)
+        if version > cls.VERSION:
+            raise ValueError(f"不支持的二进制工程版本: {version}")
+        (length,) = cls.U32.unpack_from(head, cls.HEADER.size)
+        return json.loads(f.read(length).decode('utf-8'))
+    
+    @classmethod
+    def decode_plan(cls, fields, num_count, present, int_mask, bool_mask):
+        """按字段表生成记录的解码步骤：(键, 操作, 参数)，同一组掩码的记录共用"""
+        plan = []
+        num_index = 3
+        str_index = 3 + num_count
+        for bit, (key, kind) in enumerate(fields):
+            ok = present >> bit & 1
+            if kind == 'num':
+                if ok:
+                    plan.append((key, 'int' if int_mask >> bit & 1 else 'num', num_index))
+                num_index += 1
+            elif kind == 'str':
+                if ok:
+                    plan.append((key, 'str', str_index))
+                str_index += 1
+            elif ok:
+                plan.append((key, kind, bool(bool_mask >> bit & 1)))
+        return plan
+    
+    @classmethod
+    def decode(cls, buf):
+        """bytes（或memoryview）解码为工程数据（dict）"""
+        buf = memoryview(buf)
+        magic, version, _ = cls.HEADER.unpack_from(buf, 0)
+        if magic != cls.MAGIC:
+            raise ValueError("不是二进制工程文件")
+        if version > cls.VERSION:
+            raise ValueError(f"不支持的二进制工程版本: {version}")
+        offset = cls.HEADER.size
+        
+        def read_bytes():
+            nonlocal offset
+            (length,) = cls.U32.unpack_from(buf, offset)
+            offset += 4
+            data = bytes(buf[offset:offset + length])
+            offset += length
+            return data
+        
+        project_data = json.loads(read_bytes().decode('utf-8'))
+        (count,) = cls.U32.unpack_from(buf, offset)
+        offset += 4
+        strings = [read_bytes().decode('utf-8') for _ in range(count)]
+        
+        for section in cls.SECTIONS:
+            fields = cls.FIELDS[section]
+            record, num_count = cls.record_struct(section)
+            (count,) = cls.U32.unpack_from(buf, offset)
+            offset += 4
+            block = buf[offset:offset + count * record.size]
+            offset += count * record.size
+            plans = {}
+            entries = []
+            for values in record.iter_unpack(block):
+                masks = values[:3]
+                plan = plans.get(masks)
+                if plan is None:
+                    plan = plans[masks] = cls.decode_plan(fields, num_count, *masks)
+                entry = {}
+                for key, op, arg in plan:
+                    if op == 'num':
+                        entry[key] = values[arg]
+                    elif op == 'int':
+                        entry[key] = int(values[arg])
+                    elif op == 'str':
+                        entry[key] = strings[values[arg]]
+                    elif op == 'bool':
+                        entry[key] = arg
+                    else:
+                        entry[key] = read_bytes().decode('utf-8')
+                extra = read_bytes()
+                if extra:
+                    entry.update(json.loads(extra.decode('utf-8')))
+                entries.append(entry)
+            project_data[section] = entries
+        return project_data
+
+
+class ProjectBundle:
+    """自包含工程包：zip容器内存放工程数据（project.json）和按内容哈希去重的图片（images/<sha256>.<ext>）
+    
+    读取时只解析中央目录，图片条目不压缩存储，按需从内存映射中直接切片解码；
+    工程包中的图片以虚拟路径 vlbundle:<工程包路径>::<条目名> 作为元素的 file_path
+    """
+    PROJECT_ENTRY = 'project.json'
+    HEADER_ENTRY = 'header.json'  # 统计信息和预览图，浏览工程时单独读取
+    LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+    
+    _open = {}  # 工程包路径 -> ProjectBundle
+    _hash_cache = {}  # (路径, 大小, 修改时间) -> sha256，重复保存时不再重新计算未变化的图片
+    
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        self.file = open(path, 'rb')
+        self.zip = zipfile.ZipFile(self.file)
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.pixmaps = OrderedDict()  # 条目名 -> QPixmap（按最近使用排序），重复引用的图片不必重复解码
+        self.pixmap_bytes = 0
+    
+    @classmethod
+    def get(cls, path):
+        """获取（必要时打开）工程包，文件在磁盘上变化后重新打开"""
+        path = os.path.abspath(path)
+        bundle = cls._open.get(path)
+        if bundle is not None and bundle.mtime != os.stat(path).st_mtime_ns:
+            bundle.close()
+            bundle = None
+        if bundle is None:
+            bundle = cls._open[path] = cls(path)
+        return bundle
+    
+    def close(self):
+        self.map.close()
+        self.zip.close()
+        self.file.close()
+        if ProjectBundle._open.get(self.path) is self:
+            del ProjectBundle._open[self.path]
+    
+    def names(self):
+        return set(self.zip.namelist())
+    
+    def read(self, name):
+        """读取条目内容；不压缩的条目直接返回内存映射切片（不复制）"""
+        info = self.zip.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED:
+            return self.zip.read(name)
+        header = self.LOCAL_HEADER.unpack_from(self.map, info.header_offset)
+        start = info.header_offset + self.LOCAL_HEADER.size + header[9] + header[10]
+        return memoryview(self.map)[start:start + info.file_size]
+    
+    def pixmap(self, name):
+        pix = self.pixmaps.get(name)
+        if pix is not None:
+            self.pixmaps.move_to_end(name)
+            return pix
+        pix = QPixmap()
+        pix.loadFromData(bytes(self.read(name)))
+        self.pixmaps[name] = pix
+        self.pixmap_bytes += pix.width() * pix.height() * 4
+        # 缓存有上限：虚拟化释放的图片不会一直留在内存中
+        while self.pixmap_bytes > BUNDLE_PIXMAP_CACHE_BYTES and len(self.pixmaps) > 1:
+            _, old = self.pixmaps.popitem(last=False)
+            self.pixmap_bytes -= old.width() * old.height() * 4
+        return pix
+    
+    @staticmethod
+    def is_bundle(head):
+        return head[:4] == b'PK\x03\x04'
+    
+    @staticmethod
+    def virtual_path(bundle_path, name):
+        return f"{BUNDLE_IMAGE_PREFIX}{os.path.abspath(bundle_path)}::{name}"
+    
+    @staticmethod
+    def split_virtual_path(path):
+        """拆分虚拟路径为 (工程包路径, 条目名)，不是虚拟路径时返回None"""
+        if not path.startswith(BUNDLE_IMAGE_PREFIX):
+            return None
+        bundle_path, _, name = path[len(BUNDLE_IMAGE_PREFIX):].rpartition('::')
+        return bundle_path, name
+    
+    @classmethod
+    def load_pixmap(cls, path):
+        """按路径加载图片，支持工程包内的虚拟路径"""
+        parts = cls.split_virtual_path(path)
+        if parts is None:
+            return QPixmap(path)
+        try:
+            return cls.get(parts[0]).pixmap(parts[1])
+        except (OSError, KeyError, zipfile.BadZipFile) as e:
+            print(f"无法从工程包读取图片 {path}: {e}")
+            return QPixmap()
+    
+    @classmethod
+    def image_size(cls, path):
+        """只读取图片文件头得到尺寸（不解码像素），支持虚拟路径；读取失败时返回无效尺寸"""
+        parts = cls.split_virtual_path(path)
+        if parts is None:
+            return QImageReader(path).size()
+        try:
+            data = QByteArray(bytes(cls.get(parts[0]).read(parts[1])))
+        except (OSError, KeyError, zipfile.BadZipFile) as e:
+            print(f"无法从工程包读取图片 {path}: {e}")
+            return QSize()
+        buffer = QBuffer(data)
+        return QImageReader(buffer).size()
+
+    @classmethod
+    def image_loader(cls, path, size=None):
+        """返回可在工作线程中调用的图片解码函数（得到QImage）；工程包在这里（调用线程中）打开。
+        给出 size 时直接按该尺寸解码（JPEG等格式在解码阶段就缩小，不必先得到原图），用于预览图"""
+        parts = cls.split_virtual_path(path)
+        data = None
+        if parts is not None:
+            try:
+                data = cls.get(parts[0]).read(parts[1])
+            except (OSError, KeyError, zipfile.BadZipFile) as e:
+                print(f"无法从工程包读取图片 {path}: {e}")
+                return QImage
+        
+        def load():
+            if size is None:
+                return QImage(path) if data is None else QImage.fromData(bytes(data))
+            if data is None:
+                reader = QImageReader(path)
+            else:
+                buffer = QBuffer()
+                buffer.setData(bytes(data))
+                reader = QImageReader(buffer)
+            reader.setScaledSize(size)
+            return reader.read()
+        return load
+
+    @classmethod
+    def read_image_bytes(cls, path):
+        """读取图片文件的原始字节，支持虚拟路径"""
+        parts = cls.split_virtual_path(path)
+        if parts is not None:
+            return bytes(cls.get(parts[0]).read(parts[1]))
+        with open(path, 'rb') as f:
+            return f.read()
+    
+    @classmethod
+    def copy_image(cls, src, dst):
+        """复制图片文件（源可以是工程包内的虚拟路径）"""
+        if cls.split_virtual_path(src) is None:
+            import shutil
+            shutil.copy2(src, dst)
+            return
+        with open(dst, 'wb') as f:
+            f.write(cls.read_image_bytes(src))
+    
+    @classmethod
+    def image_entry(cls, path):
+        """图片在工程包中的条目名：images/<内容sha256><扩展名>"""
+        parts = cls.split_virtual_path(path)
+        if parts is not None:
+            return parts[1]
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        digest = cls._hash_cache.get(key)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+            digest = cls._hash_cache[key] = h.hexdigest()
+        return f"images/{digest}{os.path.splitext(path)[1].lower()}"
+    
+    @classmethod
+    def write(cls, project_data, filepath):
+        """写出工程包：同一内容的图片只存一份，已存在于旧工程包中的条目直接复用原字节"""
+        filepath = os.path.abspath(filepath)
+        old = cls.get(filepath) if os.path.exists(filepath) else None
+        old_names = old.names() if old is not None else set()
+        
+        items = []
+        images = {}  # 条目名 -> 源路径
+        for d in project_data.get('items', []):
+            if d.get('type') == 'VImageItem' and d.get('path'):
+                try:
+                    name = cls.image_entry(d['path'])
+                except OSError as e:
+                    print(f"图片无法打包，保留原路径 {d['path']}: {e}")
+                else:
+                    images.setdefault(name, d['path'])
+                    d = dict(d, path=name)
+            items.append(d)
+        bundled = dict(project_data, items=items)
+        
+        tmp_path = filepath + '.tmp'
+        reused = 0
+        with zipfile.ZipFile(tmp_path, 'w') as zf:
+            header = {k: project_data[k] for k in ('version', 'stats', 'preview') if k in project_data}
+            zf.writestr(cls.HEADER_ENTRY, json.dumps(header, ensure_ascii=False), compress_type=zipfile.ZIP_STORED)
+            zf.writestr(cls.PROJECT_ENTRY, json.dumps(bundled, ensure_ascii=False), compress_type=zipfile.ZIP_DEFLATED)
+            for name, source in images.items():
+                # 图片本身已压缩，不再压缩以便读取时直接映射
+                if name in old_names:
+                    zf.writestr(name, old.read(name), compress_type=zipfile.ZIP_STORED)
+                    reused += 1
+                else:
+                    zf.writestr(name, cls.read_image_bytes(source), compress_type=zipfile.ZIP_STORED)
+        
+        if old is not None:
+            old.close()
+        os.replace(tmp_path, filepath)
+        print(f"工程包已保存: {len(images)} 张图片（复用 {reused} 张）")
+    
+    @classmethod
+    def read_project(cls, filepath):
+        """读取工程包中的工程数据，图片路径换成虚拟路径（图片在创建元素时才解码）"""
+        bundle = cls.get(filepath)
+        project_data = json.loads(bytes(bundle.read(cls.PROJECT_ENTRY)).decode('utf-8'))
+        names = bundle.names()
+        for d in project_data.get('items', []):
+            if d.get('type') == 'VImageItem' and d.get('path') in names:
+                d['path'] = cls.virtual_path(bundle.path, d['path'])
+        return project_data
+
+
+class ProjectJournal:
+    """增量保存：基础快照文件 + 追加式变更日志（<工程路径>.journal，每行一条JSON增量）
+    
+    每次保存只追加自上次保存以来新增、修改或删除的元素和连接；
+    日志过大时在后台线程重写基础快照（记录已包含的日志序号），再裁掉已合并的日志
+    """
+    COMPACT_RATIO = 0.5  # 日志大小超过基础快照的该比例时压缩
+    COMPACT_MIN_BYTES = 64 * 1024
+    SECTIONS = ('connectors', 'image_text_connectors')
+    BASE_ONLY = ('items', 'journal_seq', 'preview')  # 不记入日志的字段（预览图只随基础快照更新，统计信息随增量记录）
+    
+    _instances = {}  # 工程路径 -> ProjectJournal
+    _executor = None  # 后台压缩线程，第一次压缩时才创建
+    
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.state = None  # 上次保存（或加载）时的索引状态
+        self.primed = False  # 流式加载过基础快照但未保留记录，第一次保存时再从文件建立状态
+        self.base_mtime = None  # 基础快照的修改时间，被外部改动后不再追加日志
+        self.seq = 0  # 最后一条日志的序号
+        self.lock = threading.Lock()  # 保护日志文件（GUI线程追加与后台压缩）
+        self.compaction = None
+    
+    @classmethod
+    def get(cls, path):
+        path = os.path.abspath(path)
+        journal = cls._instances.get(path)
+        if journal is None:
+            journal = cls._instances[path] = cls(path)
+        return journal
+    
+    @classmethod
+    def executor(cls):
+        """所有工程共用的后台压缩线程（只在GUI线程调用）"""
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(max_workers=1)
+        return cls._executor
+    
+    @staticmethod
+    def supports(path):
+        """工程包自带图片，始终整体写出，不使用日志"""
+        return not path.lower().endswith(BUNDLE_PROJECT_EXT)
+    
+    @classmethod
+    def index(cls, project_data):
+        """把工程数据整理为便于比较的结构：元素按ID，连接按规范化JSON"""
+        state = {
+            'meta': {k: v for k, v in project_data.items() if k not in cls.BASE_ONLY + cls.SECTIONS},
+            'items': {d['id']: d for d in project_data.get('items', [])},
+        }
+        for section in cls.SECTIONS:
+            state[section] = {json.dumps(c, sort_keys=True): c for c in project_data.get(section, [])}
+        return state
+    
+    @classmethod
+    def diff(cls, old, new):
+        """计算两次状态之间的增量，没有变化时返回None"""
+        delta = {}
+        put = [d for item_id, d in new['items'].items() if old['items'].get(item_id) != d]
+        removed = [item_id for item_id in old['items'] if item_id not in new['items']]
+        if put:
+            delta['put'] = put
+        if removed:
+            delta['del'] = removed
+        for section in cls.SECTIONS:
+            added = [c for key, c in new[section].items() if key not in old[section]]
+            dropped = [c for key, c in old[section].items() if key not in new[section]]
+            if added:
+                delta[section + '_add'] = added
+            if dropped:
+                delta[section + '_del'] = dropped
+        if new['meta'] != old['meta']:
+            delta['meta'] = new['meta']
+        return delta or None
+    
+    @classmethod
+    def apply(cls, state, delta):
+        """把一条增量应用到状态上"""
+        for d in delta.get('put', []):
+            state['items'][d['id']] = d
+        for item_id in delta.get('del', []):
+            state['items'].pop(item_id, None)
+        for section in cls.SECTIONS:
+            for c in delta.get(section + '_add', []):
+                state[section][json.dumps(c, sort_keys=True)] = c
+            for c in delta.get(section + '_del', []):
+                state[section].pop(json.dumps(c, sort_keys=True), None)
+        if 'meta' in delta:
+            state['meta'] = delta['meta']
+    
+    @classmethod
+    def to_project_data(cls, state):
+        project_data = dict(state['meta'])
+        project_data['items'] = list(state['items'].values())
+        for section in cls.SECTIONS:
+            project_data[section] = list(state[section].values())
+        return project_data
+    
+    def load(self, project_data):
+        """把日志应用到刚读出的基础快照上，并记住结果作为下次增量保存的起点"""
+        base_seq = project_data.get('journal_seq', 0) if isinstance(project_data, dict) else 0
+        self.seq = base_seq
+        self.base_mtime = os.stat(self.path).st_mtime_ns
+        if isinstance(project_data, list):  # 旧版本格式
+            project_data = {'items': project_data}
+        state = self.index(project_data)
+        
+        applied = 0
+        if os.path.exists(self.journal_path):
+            with self.lock, open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        delta = json.loads(line)
+                    except ValueError:
+                        break  # 崩溃时写了一半的最后一行
+                    if delta.get('seq', 0) <= base_seq:
+                        continue  # 已合并进基础快照
+                    self.apply(state, delta)
+                    self.seq = delta['seq']
+                    applied += 1
+        if applied:
+            print(f"已应用 {applied} 条增量日志")
+        self.state = state
+        self.primed = False
+        return self.to_project_data(state)
+    
+    @staticmethod
+    def read_stats(journal_path):
+        """读取日志中最新的统计信息（基础快照头部的统计信息在增量保存后会过时），没有时返回None"""
+        stats = None
+        try:
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if '"meta"' not in line:
+                        continue
+                    try:
+                        stats = json.loads(line)['meta'].get('stats', stats)
+                    except (ValueError, KeyError, AttributeError):
+                        break
+        except OSError:
+            return None
+        return stats
+    
+    def prime(self):
+        """流式加载基础快照后调用：只记下文件状态，不保留读出的记录（加载时的峰值内存不必等于整体解析）；
+        第一次保存时再从文件建立增量比较的起点"""
+        self.state = None
+        self.base_mtime = os.stat(self.path).st_mtime_ns
+        self.primed = True
+    
+    def save(self, project_data, preview=None):
+        """保存工程：能追加增量时只写增量，否则整体写出基础快照。
+        preview 为生成预览图的函数，只在写出基础快照时调用"""
+        new_state = self.index(project_data)
+        with self.lock:  # 后台压缩会更新基础快照的修改时间
+            base_mtime = self.base_mtime
+        base_changed = (not os.path.exists(self.path) or
+                        os.stat(self.path).st_mtime_ns != base_mtime)
+        if self.state is None and self.primed and not base_changed:
+            self.load(ProjectData.read(self.path))
+        if self.state is None or base_changed:
+            self.write_base(project_data, preview)
+            return
+        
+        delta = self.diff(self.state, new_state)
+        if delta is None:
+            print("工程没有变化")
+            return
+        self.seq += 1
+        delta['seq'] = self.seq
+        line = json.dumps(delta, ensure_ascii=False) + '\n'
+        with self.lock, open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.state = new_state
+        print(f"增量保存: {len(line.encode('utf-8'))} 字节")
+        self.maybe_compact(project_data, preview)
+    
+    def write_base(self, project_data, preview=None):
+        """整体写出基础快照并清空日志"""
+        if self.compaction is not None:
+            self.compaction.exception()  # 等待后台压缩结束，失败已在回调中处理
+        if preview is not None:
+            project_data['preview'] = preview()
+        with self.lock:
+            self.seq = 0
+            ProjectData.write(project_data, self.path)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+        self.base_mtime = os.stat(self.path).st_mtime_ns
+        self.state = self.index(project_data)
+    
+    def maybe_compact(self, project_data, preview=None):
+        """日志相对基础快照过大时，在后台重写基础快照（预览图在当前线程生成）"""
+        if self.compaction is not None and not self.compaction.done():
+            return
+        journal_size = os.path.getsize(self.journal_path)
+        if journal_size < max(self.COMPACT_MIN_BYTES, self.COMPACT_RATIO * os.path.getsize(self.path)):
+            return
+        snapshot = dict(project_data, journal_seq=self.seq)
+        if preview is not None:
+            snapshot['preview'] = preview()
+        self.compaction = self.executor().submit(self.compact, snapshot)
+        self.compaction.add_done_callback(self.on_compacted)
+    
+    def on_compacted(self, future):
+        """后台线程中回调：压缩失败时基础快照和日志可能不一致，下次保存改为整体写出"""
+        error = future.exception()
+        if error is None:
+            return
+        with self.lock:
+            self.base_mtime = None
+        print(f"增量日志压缩失败: {error}")
+    
+    def compact(self, snapshot):
+        """后台线程：原子替换基础快照，再去掉已合并的日志行"""
+        seq = snapshot['journal_seq']
+        tmp_path = self.path + '.compact' + os.path.splitext(self.path)[1]
+        ProjectData.write(snapshot, tmp_path)
+        with self.lock:
+            os.replace(tmp_path, self.path)
+            self.base_mtime = os.stat(self.path).st_mtime_ns
+            remaining = []
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        if json.loads(line).get('seq', 0) > seq:
+                            remaining.append(line)
+                    except ValueError:
+                        break
+            tmp_journal = self.journal_path + '.tmp'
+            with open(tmp_journal, 'w', encoding='utf-8') as f:
+                f.writelines(remaining)
+            os.replace(tmp_journal, self.journal_path)
+        print(f"增量日志已合并到基础快照: {self.path}")
+
+
+class JsonRecordReader:
+    """增量JSON读取器：逐条产出工程文件中 items / connectors / image_text_connectors 数组的记录
+    source 为带 read(n) 的二进制源（文件对象或mmap），每次只解码一块，不把整个文件读入内存
+    """
+    CHUNK = 1 << 20
+    SECTIONS = ('items', 'connectors', 'image_text_connectors')
+    WHITESPACE = ' \t\r\n'
+    
+    def __init__(self, source):
+        self.source = source
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.json_decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+        self.meta = {}  # 数组以外的顶层字段
+    
+    def fill(self):
+        """再读入一块数据，返回是否读到了新内容"""
+        if self.eof:
+            return False
+        chunk = self.source.read(self.CHUNK)
+        self.bytes_read += len(chunk)
+        if not chunk:
+            self.eof = True
+            self.buf = self.buf[self.pos:] + self.decoder.decode(b'', final=True)
+        else:
+            self.buf = self.buf[self.pos:] + self.decoder.decode(chunk)
+        self.pos = 0
+        return True
+    
+    def peek(self):
+        """跳过空白，返回下一个字符（结束时为空串）"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+    
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"JSON格式错误: 位置 {self.bytes_read} 附近应为 '{char}'")
+        self.pos += 1
+    
+    def value(self):
+        """解码下一个完整的JSON值，数据不够时继续读入"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            if end == len(self.buf) and not self.eof:
+                # 恰好解码到缓冲区末尾（如数字）可能被截断，读入更多后重试
+                self.fill()
+                continue
+            self.pos = end
+            return value
+    
+    def array(self, section):
+        self.expect('[')
+        while True:
+            char = self.peek()
+            if char == ']':
+                self.pos += 1
+                return
+            if char == ',':
+                self.pos += 1
+                continue
+            if not char:
+                raise ValueError("JSON格式错误: 数组未结束")
+            yield section, self.value()
+    
+    def read_header(self):
+        """读取第一个记录数组之前的顶层字段（统计信息、预览图等）"""
+        if self.peek() != '{':
+            return {}  # 旧版本列表格式没有头部
+        self.expect('{')
+        while True:
+            char = self.peek()
+            if char in ('}', ''):
+                return self.meta
+            if char == ',':
+                self.pos += 1
+                continue
+            key = self.value()
+            self.expect(':')
+            if key in self.SECTIONS:
+                return self.meta
+            self.meta[key] = self.value()
+    
+    def records(self):
+        """逐条产出 (段名, 记录)"""
+        char = self.peek()
+        if char == '[':
+            # 旧版本格式：整个文件是元素列表
+            yield from self.array('items')
+            return
+        self.expect('{')
+        while True:
+            char = self.peek()
+            if char == '}':
+                self.pos += 1
+                return
+            if char == ',':
+                self.pos += 1
+                continue
+            if not char:
+                raise ValueError("JSON格式错误: 对象未结束")
+            key = self.value()
+            self.expect(':')
+            if key in self.SECTIONS and self.peek() == '[':
+                yield from self.array(key)
+            else:
+                self.meta[key] = self.value()
+
+
+class ProjectRecordStream:
+    """按记录读取工程文件
+    没有增量日志的JSON文件用 JsonRecordReader 从内存映射中增量解析；
+    二进制、工程包、gzip或带日志的文件整体读取后逐条产出
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.total = max(os.path.getsize(filepath), 1)  # 进度以字节计
+        self.done = 0
+    
+    def is_streamable(self):
+        if ProjectJournal.supports(self.filepath) and os.path.exists(ProjectJournal.get(self.filepath).journal_path):
+            return False
+        with open(self.filepath, 'rb') as f:
+            head = f.read(4)
+        return not (ProjectBundle.is_bundle(head) or BinaryProjectCodec.is_binary(head) or head[:2] == b'\x1f\x8b')
+    
+    def __iter__(self):
+        if not self.is_streamable():
+            data, connectors_data, image_text_connectors_data = ProjectData.parse(self.filepath)
+            self.done = self.total
+            for section, records in (('items', data), ('connectors', connectors_data),
+                                     ('image_text_connectors', image_text_connectors_data)):
+                for record in records:
+                    yield section, record
+            return
+        
+        with open(self.filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            reader = JsonRecordReader(mm)
+            for section, record in reader.records():
+                self.done = reader.bytes_read
+                yield section, record
+            self.done = self.total
+        
+        # 之后保存时只追加增量；比较起点在第一次保存时才从文件读取
+        if ProjectJournal.supports(self.filepath):
+            ProjectJournal.get(self.filepath).prime()
+
+
 class ProjectData:
     """Helper to serialize/deserialize project"""
     @staticmethod
-    def save(scene, filepath):
+    def serialize(scene):
+        """把场景序列化为工程数据（dict）
+        统计信息和预览图放在最前面，浏览工程时只需读取文件开头；统计信息按数据计算，
+        预览图需要绘制整个画布，留空由 save 在写出完整文件时生成
+        """
         project_data = {
             'version': '2.0',
+            'stats': {},
+            'preview': '',
             'items': [],
             'connectors': [],
             'image_text_connectors': []
@@ -969,10 +1911,10 @@ class ProjectData:
         # Store items with IDs to reconstruct hierarchy
         item_map = {}  # item -> id
         
-        # Assign IDs
-        for idx, item in enumerate(scene.items()):
+        # 使用元素的持久ID（只遍历元素索引，不经过字形、连接点等子项）
+        for item in scene.element_index:
             if isinstance(item, (VTextItem, VImageItem)):
-                item_map[item] = idx
+                item_map[item] = item.element_id
         
         # Save items
         for item, item_id in item_map.items():
@@ -1048,71 +1990,206 @@ class ProjectData:
             if conn_data:
                 project_data['image_text_connectors'].append(conn_data)
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(project_data, f, indent=2, ensure_ascii=False)
-        
+        canvas = scene.sceneRect()
+        project_data['stats'] = {
+            'texts': sum(1 for d in project_data['items'] if d['type'] == 'VTextItem'),
+            'images': sum(1 for d in project_data['items'] if d['type'] == 'VImageItem'),
+            'connectors': len(project_data['connectors']),
+            'image_text_connectors': len(project_data['image_text_connectors']),
+            'canvas': [canvas.width(), canvas.height()]
+        }
+        return project_data
+    
+    @staticmethod
+    def render_preview(scene, max_size=PREVIEW_SIZE):
+        """把画布渲染为小尺寸PNG，返回base64字符串
+        按导出快照绘制（字形按排版结果），虚拟化显示时离屏元素不必先创建字形和图片也能画出；
+        图片使用已显示的缩放图片，未显示的按缩略图尺寸低分辨率解码，不在GUI线程中解码原图
+        """
+        rect = scene.sceneRect()
+        if rect.isEmpty():
+            return ''
+        scale = min(max_size / rect.width(), max_size / rect.height(), 1.0)
+        exporter = TiledImageExporter(scene, scale, draft=True)
+        img = QImage(exporter.width, exporter.height, QImage.Format.Format_RGB32)
+        p = QPainter(img)
+        for index in range(exporter.band_count):
+            p.drawImage(0, index * exporter.band_height, exporter.draw_band(index))
+        p.end()
+        buffer = QBuffer()
+        buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+        img.save(buffer, "PNG")
+        return base64.b64encode(bytes(buffer.data())).decode('ascii')
+    
+    @staticmethod
+    def read_header(filepath):
+        """只读取工程文件开头的统计信息和预览图（统计信息以增量日志中最新的为准），不解析元素"""
+        header = ProjectData.read_base_header(filepath)
+        if ProjectJournal.supports(filepath) and os.path.exists(filepath + '.journal'):
+            stats = ProjectJournal.read_stats(filepath + '.journal')
+            if stats is not None:
+                header = dict(header, stats=stats)
+        return header
+    
+    @staticmethod
+    def read_base_header(filepath):
+        """读取基础文件开头的头部字段"""
+        with open(filepath, 'rb') as f:
+            head = f.read(4)
+            f.seek(0)
+            if ProjectBundle.is_bundle(head):
+                with zipfile.ZipFile(f) as zf:
+                    if ProjectBundle.HEADER_ENTRY not in zf.namelist():
+                        return {}
+                    return json.loads(zf.read(ProjectBundle.HEADER_ENTRY).decode('utf-8'))
+            if BinaryProjectCodec.is_binary(head):
+                return BinaryProjectCodec.decode_meta(f.read(BinaryProjectCodec.HEADER.size + 4), f)
+            source = gzip.GzipFile(fileobj=f) if head[:2] == b'\x1f\x8b' else f
+            return JsonRecordReader(source).read_header()
+    
+    @staticmethod
+    def is_project_file(filepath):
+        """检查文件是否为工程文件：工程包和二进制格式按文件头识别；
+        JSON（含gzip）须为旧版元素列表，或带有版本号、记录数组的对象（增量日志等其他JSON不算）"""
+        with open(filepath, 'rb') as f:
+            head = f.read(4)
+            f.seek(0)
+            if ProjectBundle.is_bundle(head) or BinaryProjectCodec.is_binary(head):
+                return True
+            source = gzip.GzipFile(fileobj=f) if head[:2] == b'\x1f\x8b' else f
+            reader = JsonRecordReader(source)
+            try:
+                if reader.peek() == '[':
+                    return True
+                meta = reader.read_header()
+                # read_header 停在第一个记录数组处时，下一个字符是 '['
+                return 'version' in meta or reader.peek() == '['
+            except (OSError, EOFError, ValueError):
+                return False
+    
+    @staticmethod
+    def read_preview(filepath):
+        """读取工程头部并解码预览图（可在后台线程调用），返回 (头部, QImage或None)"""
+        header = ProjectData.read_header(filepath)
+        preview = header.get('preview')
+        image = QImage.fromData(base64.b64decode(preview)) if preview else None
+        return header, image
+    
+    @staticmethod
+    def save(scene, filepath):
+        project_data = ProjectData.serialize(scene)
+        if ProjectJournal.supports(filepath):
+            # 增量保存不需要预览图，只有写出基础快照时才绘制
+            ProjectJournal.get(filepath).save(project_data, lambda: ProjectData.render_preview(scene))
+        else:
+            project_data['preview'] = ProjectData.render_preview(scene)
+            ProjectData.write(project_data, filepath)
         print(f"工程已保存: {len(project_data['items'])} 个元素, {len(project_data['connectors'])} 个父子连接, {len(project_data['image_text_connectors'])} 个图文连接")
 
     @staticmethod
-    def load(scene, filepath):
-        scene.clear()
-        
-        with open(filepath, 'r', encoding='utf-8') as f:
-            project_data = json.load(f)
+    def write(project_data, filepath):
+        """按扩展名写出JSON、二进制或工程包文件"""
+        if filepath.lower().endswith(BUNDLE_PROJECT_EXT):
+            ProjectBundle.write(project_data, filepath)
+        elif filepath.lower().endswith(BINARY_PROJECT_EXT):
+            with open(filepath, 'wb') as f:
+                f.write(BinaryProjectCodec.encode(project_data))
+        else:
+            with open(filepath, 'w', encoding='utf-8') as f:
+                json.dump(project_data, f, indent=2, ensure_ascii=False)
+    
+    @staticmethod
+    def write_compressed(project_data, filepath):
+        """写出gzip压缩的JSON：先写临时文件并落盘，再原子替换，崩溃时不会留下半个文件"""
+        data = gzip.compress(json.dumps(project_data, ensure_ascii=False).encode('utf-8'), compresslevel=6)
+        tmp_path = filepath + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    
+    @staticmethod
+    def read(filepath):
+        """读取工程文件（按文件头自动识别JSON、二进制或工程包格式）"""
+        with open(filepath, 'rb') as f:
+            raw = f.read(4)
+            if ProjectBundle.is_bundle(raw):
+                return ProjectBundle.read_project(filepath)
+            raw += f.read()
+        if raw[:2] == b'\x1f\x8b':  # gzip（自动保存文件）
+            raw = gzip.decompress(raw)
+        if BinaryProjectCodec.is_binary(raw):
+            return BinaryProjectCodec.decode(raw)
+        return json.loads(raw.decode('utf-8'))
+    
+    @staticmethod
+    def parse(filepath):
+        """读取工程文件（含增量日志），返回 (元素数据, 父子连接数据, 图文连接数据)"""
+        project_data = ProjectData.read(filepath)
+        if ProjectJournal.supports(filepath):
+            project_data = ProjectJournal.get(filepath).load(project_data)
         
         # 兼容旧版本格式
         if isinstance(project_data, list):
-            data = project_data
-            connectors_data = []
-            image_text_connectors_data = []
-        else:
-            data = project_data.get('items', [])
-            connectors_data = project_data.get('connectors', [])
-            image_text_connectors_data = project_data.get('image_text_connectors', [])
-        
-        # First pass: Create items
-        id_map = {}  # id -> item
-        delayed_parents = []
-        
-        for d in data:
-            item = None
-            if d['type'] == 'VTextItem':
-                item = VTextItem(d['text'], d['font_size'], d['box_height'])
-                if 'font_family' in d:
-                    item.font_family = d['font_family']
-                if 'text_color' in d:
-                    item.text_color = QColor(d['text_color'])
-                if 'chars_per_column' in d:
-                    item.chars_per_column = d['chars_per_column']
-                if 'column_spacing' in d:
-                    item.column_spacing = d['column_spacing']
-                if 'auto_height' in d:
-                    item.auto_height = d['auto_height']
-                if 'manual_line_break' in d:
-                    item.manual_line_break = d['manual_line_break']
-                item.rebuild()
-            elif d['type'] == 'VImageItem':
-                item = VImageItem(d['path'], d['width'])
+            return project_data, [], []
+        return (project_data.get('items', []),
+                project_data.get('connectors', []),
+                project_data.get('image_text_connectors', []))
+    
+    @staticmethod
+    def create_item(scene, d):
+        """根据元素数据创建元素并加入场景，未知类型返回None"""
+        item = None
+        # 先不创建字形、不解码图片：虚拟化时由场景按可见区域创建，否则在属性设置完后创建一次
+        if d['type'] == 'VTextItem':
+            item = VTextItem(d['text'], d['font_size'], d['box_height'], materialized=False)
+            if 'font_family' in d:
+                item.font_family = d['font_family']
+            if 'text_color' in d:
+                item.text_color = QColor(d['text_color'])
+            if 'chars_per_column' in d:
+                item.chars_per_column = d['chars_per_column']
+            if 'column_spacing' in d:
+                item.column_spacing = d['column_spacing']
+            if 'auto_height' in d:
+                item.auto_height = d['auto_height']
+            if 'manual_line_break' in d:
+                item.manual_line_break = d['manual_line_break']
+            item.rebuild()
+        elif d['type'] == 'VImageItem':
+            item = VImageItem(d['path'], d['width'], materialized=False)
+        
+        if item:
+            if not scene.virtualized:
+                item.materialize()
+            # 使用场景坐标（如果有的话）
+            if 'scene_x' in d and 'scene_y' in d:
+                item.setPos(d['scene_x'], d['scene_y'])
+            else:
+                item.setPos(d['x'], d['y'])
             
-            if item:
-                # 使用场景坐标（如果有的话）
-                if 'scene_x' in d and 'scene_y' in d:
-                    item.setPos(d['scene_x'], d['scene_y'])
-                else:
-                    item.setPos(d['x'], d['y'])
-                
-                item.setZValue(d.get('z', 0))
-                scene.addItem(item)
-                
-                # 恢复连接点可见性
-                if 'connection_point_visible' in d and item.connection_point:
-                    item.connection_point.setVisible(d['connection_point_visible'])
-                
-                id_map[d['id']] = item
-                if d['parent_id'] != -1:
-                    delayed_parents.append((item, d['parent_id']))
-        
-        # Second pass: Restore hierarchy
+            item.setZValue(d.get('z', 0))
+            if isinstance(d.get('id'), int):
+                item.restore_id(d['id'])
+            scene.addItem(item)
+            
+            # 恢复连接点可见性
+            if 'connection_point_visible' in d and item.connection_point:
+                item.connection_point.setVisible(d['connection_point_visible'])
+        return item
+    
+    @staticmethod
+    def restore_links(scene, id_map, delayed_parents, connectors_data, image_text_connectors_data):
+        """恢复层级关系并批量创建连接线"""
+        for _ in ProjectData.iter_restore_links(scene, id_map, delayed_parents, connectors_data, image_text_connectors_data):
+            pass
+    
+    @staticmethod
+    def iter_restore_links(scene, id_map, delayed_parents, connectors_data, image_text_connectors_data):
+        """restore_links 的分步版本：每恢复一个父级、创建一条连接线或计算一批路径后让出一次，
+        分片加载据此把最后的恢复阶段也限制在时间片内"""
+        # Restore hierarchy
         for item, pid in delayed_parents:
             if pid in id_map:
                 parent = id_map[pid]
@@ -1123,15 +2200,20 @@ class ProjectData:
                 # 将场景坐标转换为父级的本地坐标并设置
                 local_pos = parent.mapFromScene(curr_scene_pos)
                 item.setPos(local_pos)
+            yield
         
-        # Third pass: Restore parent-child connectors
+        # Restore parent-child connectors
         for conn_data in connectors_data:
             parent_id = conn_data.get('parent_id', -1)
             child_id = conn_data.get('child_id', -1)
             if parent_id in id_map and child_id in id_map:
-                scene.add_connector(id_map[parent_id], id_map[child_id])
+                conn = VConnector(id_map[parent_id], id_map[child_id])
+                scene.addItem(conn)
+                scene.connectors.append(conn)
+                conn.setVisible(scene.show_connectors)
+            yield
         
-        # Fourth pass: Restore image-text connectors
+        # Restore image-text connectors
         for conn_data in image_text_connectors_data:
             conn_type = conn_data.get('type', 'VImageTextConnector')
             line_width = conn_data.get('line_width', 3)
@@ -1143,7 +2225,6 @@ class ProjectData:
                     conn = VImageTextConnector(id_map[img_id], id_map[text_id], line_width)
                     scene.addItem(conn)
                     scene.image_text_connectors.append(conn)
-                    conn.update_path()
                     conn.setVisible(scene.show_image_text_connectors)
             elif conn_type == 'VGenericConnector':
                 item1_id = conn_data.get('item1_id', -1)
@@ -1153,17 +2234,295 @@ class ProjectData:
                     conn = VGenericConnector(id_map[item1_id], id_map[item2_id], connection_type, line_width)
                     scene.addItem(conn)
                     scene.image_text_connectors.append(conn)
-                    conn.update_path()
                     conn.setVisible(scene.show_image_text_connectors)
+            yield
+        
+        # 所有连接线创建完成后按批计算路径：贝塞尔控制点按批向量化计算，绕行折线每条单独搜索
+        batch = 1 if scene.obstacle_routing else LOAD_ROUTE_BATCH
+        for connectors in (scene.connectors, scene.image_text_connectors):
+            for start in range(0, len(connectors), batch):
+                scene.route_connectors(connectors[start:start + batch])
+                yield
+
+    @staticmethod
+    def load(scene, filepath):
+        scene.clear()
+        
+        # 边读边创建元素，连接数据留到最后统一恢复
+        id_map = {}  # id -> item
+        delayed_parents = []
+        connectors_data = []
+        image_text_connectors_data = []
+        for section, d in ProjectRecordStream(filepath):
+            if section == 'connectors':
+                connectors_data.append(d)
+            elif section == 'image_text_connectors':
+                image_text_connectors_data.append(d)
+            else:
+                item = ProjectData.create_item(scene, d)
+                if item:
+                    id_map[d['id']] = item
+                    if d['parent_id'] != -1:
+                        delayed_parents.append((item, d['parent_id']))
+        
+        ProjectData.restore_links(scene, id_map, delayed_parents, connectors_data, image_text_connectors_data)
+        
+        print(f"工程已加载: {len(id_map)} 个元素, {len(connectors_data)} 个父子连接, {len(image_text_connectors_data)} 个图文连接")
+
+
+class ProjectLoader(QObject):
+    """分片加载工程：按时间片边读取记录边创建元素并让出事件循环，最后统一恢复层级和连接线
+    元素构建在一个尚未显示的新场景中（索引暂停），完成后由调用方一次性替换到视图；
+    取消或失败时只丢弃新场景，当前场景不受影响
+    """
+    progress = pyqtSignal(int, int)  # 已读取字节数, 文件总字节数
+    finished = pyqtSignal(bool)  # True: 加载完成, False: 已取消
+    failed = pyqtSignal(str)
+    
+    TIME_SLICE = 0.03  # 每个时间片的最长处理时间（秒）
+    
+    def __init__(self, scene, filepath, parent=None):
+        super().__init__(parent)
+        self.scene = scene
+        self.filepath = filepath
+        self.stream = None
+        self.records = None
+        self.links = None  # 元素全部创建后的分步恢复（层级、连接线、路径）
+        self.id_map = {}
+        self.delayed_parents = []
+        self.connectors_data = []
+        self.image_text_connectors_data = []
+        self.canceled = False
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.process_chunk)
+    
+    def start(self):
+        """打开文件并开始分片读取、创建元素"""
+        try:
+            self.stream = ProjectRecordStream(self.filepath)
+        except OSError as e:
+            self.failed.emit(str(e))
+            return
+        
+        self.records = iter(self.stream)
+        self.scene.begin_bulk_build()
+        self.progress.emit(0, self.stream.total)
+        self.timer.start(0)
+    
+    def cancel(self):
+        """取消加载，丢弃正在构建的场景"""
+        if self.canceled or not self.timer.isActive():
+            return
+        self.canceled = True
+        self.timer.stop()
+        self.close_stream()
+        self.discard_scene()
+        print("工程加载已取消")
+        self.finished.emit(False)
+    
+    def process_chunk(self):
+        """在一个时间片内尽量多地创建元素，元素全部创建后同样按时间片恢复层级和连接线，然后让出事件循环"""
+        deadline = time.perf_counter() + self.TIME_SLICE
+        finished = False
+        try:
+            if self.links is None:
+                while time.perf_counter() < deadline:
+                    record = next(self.records, None)
+                    if record is None:
+                        # 收尾阶段从下一个时间片开始，避免和本片已创建的元素叠加
+                        self.close_stream()
+                        self.links = self.iter_links()
+                        break
+                    section, d = record
+                    if section == 'connectors':
+                        self.connectors_data.append(d)
+                    elif section == 'image_text_connectors':
+                        self.image_text_connectors_data.append(d)
+                    else:
+                        # 必须按文件顺序创建：z 值相同的元素按插入顺序叠放，换序（如按可见区域优先）会改变重叠元素的上下关系
+                        item = ProjectData.create_item(self.scene, d)
+                        if item:
+                            self.id_map[d['id']] = item
+                            if d['parent_id'] != -1:
+                                self.delayed_parents.append((item, d['parent_id']))
+            else:
+                for _ in self.links:
+                    if time.perf_counter() >= deadline:
+                        break
+                else:
+                    finished = True
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            self.timer.stop()
+            self.close_stream()
+            self.discard_scene()
+            self.failed.emit(f"工程数据有误: {e}")
+            return
+        
+        self.progress.emit(self.stream.done, self.stream.total)
+        if not finished:
+            return
+        
+        self.timer.stop()
+        print(f"工程已加载: {len(self.id_map)} 个元素, {len(self.connectors_data)} 个父子连接, {len(self.image_text_connectors_data)} 个图文连接")
+        self.finished.emit(True)
+    
+    def iter_links(self):
+        """收尾阶段：重建索引单独占一个时间片，之后逐步恢复层级并计算连接线路径"""
+        self.scene.end_bulk_build()
+        yield
+        yield from ProjectData.iter_restore_links(self.scene, self.id_map, self.delayed_parents,
+                                                  self.connectors_data, self.image_text_connectors_data)
+    
+    def close_stream(self):
+        """关闭记录流：生成器退出时关闭内存映射和文件句柄（否则要等垃圾回收，Windows上会挡住对同一文件的保存）"""
+        if self.records is not None:
+            self.records.close()
+            self.records = None
+    
+    def discard_scene(self):
+        """销毁未完成的场景"""
+        self.scene.clear()
+        self.scene.deleteLater()
+
+class AutosaveManager(QObject):
+    """定时自动保存：在GUI线程上把场景快照为普通Python数据，JSON编码、压缩和原子写入在后台线程完成
+    用户按住鼠标（拖拽、框选等）时推迟快照，避免打断交互；
+    相对的自动保存路径按配置文件所在目录解析，上次未正常退出时启动后提示恢复
+    """
+    RETRY_DELAY = 1000  # 交互进行中时推迟的毫秒数
+    RECOVERED_PREFIX = 'recovered-'  # 异常退出留下的自动保存文件改名加上该前缀，不会被新的自动保存覆盖
+    written = pyqtSignal(str, str)  # 自动保存文件路径, 错误信息（成功时为空串）
+    
+    def __init__(self, scene_getter, config_manager, parent=None):
+        super().__init__(parent)
+        self.scene_getter = scene_getter  # 场景可能被替换（加载工程），每次保存时重新获取
+        self.config_manager = config_manager
+        self.base_dir = os.path.dirname(config_manager.config_file)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None  # 正在后台写入的任务
+        self.last_snapshot = None  # 上次写入的快照，内容未变时跳过写入
+        self.retry_scheduled = False
+        self.session_marker = None  # 会话进行中的标记文件，正常退出时删除
+        self.written.connect(self.on_written)  # 后台线程发出，在GUI线程处理
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.autosave)
+        self.apply_config()
+    
+    def apply_config(self):
+        """按配置启动或停止定时器"""
+        interval = self.config_manager.get('autosave_interval', 60)
+        if interval > 0:
+            self.timer.start(int(interval * 1000))
+        else:
+            self.timer.stop()
+    
+    def autosave_path(self):
+        """自动保存文件的绝对路径"""
+        path = os.path.expanduser(self.config_manager.get('autosave_path', AUTOSAVE_FILE))
+        return os.path.join(self.base_dir, path)
+    
+    def begin_session(self):
+        """标记本次会话开始。上次会话未正常退出（标记仍在）时把它的自动保存文件改名保留，
+        返回改名后的路径；否则返回None"""
+        path = self.autosave_path()
+        recovered = None
+        if os.path.exists(path + '.running') and os.path.exists(path):
+            recovered = os.path.join(os.path.dirname(path), self.RECOVERED_PREFIX + os.path.basename(path))
+            try:
+                os.replace(path, recovered)
+            except OSError as e:
+                print(f"无法保留自动保存文件: {e}")
+                recovered = None
+        self.session_marker = path + '.running'
+        try:
+            open(self.session_marker, 'w').close()
+        except OSError as e:
+            print(f"无法创建会话标记: {e}")
+            self.session_marker = None
+        return recovered
+    
+    def is_busy(self):
+        """是否有正在进行的鼠标交互"""
+        if QApplication.mouseButtons() != Qt.MouseButton.NoButton:
+            return True
+        return self.scene_getter().mouseGrabberItem() is not None
+    
+    def retry_later(self):
+        self.retry_scheduled = False
+        self.autosave()
+    
+    def autosave(self):
+        """快照场景并提交后台写入"""
+        if self.pending is not None and not self.pending.done():
+            return  # 上一次写入尚未完成，本次跳过
+        if self.is_busy():
+            if not self.retry_scheduled:
+                self.retry_scheduled = True
+                QTimer.singleShot(self.RETRY_DELAY, self.retry_later)
+            return
         
-        print(f"工程已加载: {len(id_map)} 个元素, {len(connectors_data)} 个父子连接, {len(image_text_connectors_data)} 个图文连接")
+        snapshot = ProjectData.serialize(self.scene_getter())
+        if snapshot == self.last_snapshot:
+            return
+        self.last_snapshot = snapshot
+        path = self.autosave_path()
+        self.pending = self.executor.submit(ProjectData.write_compressed, snapshot, path)
+        self.pending.add_done_callback(lambda future: self.report_written(future, path))
+    
+    def report_written(self, future, path):
+        """后台线程中回调：只发出信号，状态在GUI线程中更新"""
+        error = future.exception()
+        self.written.emit(path, '' if error is None else str(error) or type(error).__name__)
+    
+    def on_written(self, path, error):
+        if error:
+            self.last_snapshot = None  # 下次重新尝试写入
+            print(f"自动保存失败: {error}")
+        else:
+            print(f"已自动保存到: {path}")
+    
+    def shutdown(self):
+        """停止定时器，等待未完成的写入，并删除会话标记（正常退出）"""
+        self.timer.stop()
+        self.executor.shutdown(wait=True)
+        if self.session_marker is not None:
+            try:
+                os.remove(self.session_marker)
+            except OSError:
+                pass
+            self.session_marker = None
 
 # --- Undo/Redo System ---
 
+UNDO_COMMAND_BYTES = 256  # 命令对象本身的估算开销
+UNDO_ELEMENT_BYTES = 1024  # 元素对象本身及其连接点、包围框等辅助项
+UNDO_GLYPH_BYTES = 400  # 每个字形图形项（QGraphicsSimpleTextItem 包装对象、字体和变换）
+UNDO_CHAR_BYTES = 4  # 未物化文字只保留文本字符串，按每字符估算
+UNDO_PIXEL_BYTES = 4  # 显示用图片按 32 位像素计算
+UNDO_CONNECTOR_BYTES = 512  # 被摘下的连接器对象及其路径
+
+
+def estimate_item_bytes(item):
+    """估算元素（含字形、图片和子元素）占用的内存字节数，供撤销历史计算容量；
+    未物化（虚拟化释放）的元素没有字形和图片，只计对象本身"""
+    size = UNDO_ELEMENT_BYTES
+    if isinstance(item, VTextItem):
+        per_char = UNDO_GLYPH_BYTES if item.materialized else UNDO_CHAR_BYTES
+        size += len(item.full_text) * per_char
+    elif isinstance(item, VImageItem) and item.p_item is not None:
+        pixmap = item.p_item.pixmap()
+        size += pixmap.width() * pixmap.height() * UNDO_PIXEL_BYTES
+    for child in item.childItems():
+        if isinstance(child, BaseElement):
+            size += estimate_item_bytes(child)
+    return size
+
+
 class UndoCommand:
     """撤销命令基类"""
     def __init__(self, scene):
         self.scene = scene
+        self.bytes = UNDO_COMMAND_BYTES  # 入栈时由 footprint() 计算
     
     def execute(self):
         """执行命令"""
@@ -1172,172 +2531,62 @@ class UndoCommand:
     def undo(self):
         """撤销命令"""
         pass
+    
+    def footprint(self):
+        """命令在历史中额外占用的内存估算（字节）：只计算仅由命令保持存活的数据"""
+        return UNDO_COMMAND_BYTES
+    
+    def merge(self, other):
+        """尝试把紧随其后的命令并入本命令（已执行），成功返回True"""
+        return False
 
 class AddItemCommand(UndoCommand):
     """添加元素命令"""
     def __init__(self, scene, item):
         super().__init__(scene)
         self.item = item
-        self.item_data = None
-        self.parent_item = None
-        self.child_connectors = []  # 保存作为父级的连接器
-        self.parent_connector = None  # 保存作为子级的连接器
-        self.image_text_connectors = []  # 保存图文连接器
+        self.record = None  # 撤销时摘下的父级、位置和连接器
     
     def execute(self):
+        if self.record is not None:
+            # 重做：原样挂回撤销时摘下的元素和连接器
+            self.scene.reattach_element(self.item, self.record)
+            self.record = None
+            return
         self.scene.addItem(self.item)
         # 确保连接点可见性正确设置
         if isinstance(self.item, (VTextItem, VImageItem)):
             self.item.set_connection_points_visible(self.scene.show_connection_points)
-        # 保存状态用于撤销
-        self.save_item_state()
     
     def undo(self):
-        # 删除与此元素相关的所有连接器
-        self.scene.remove_all_connectors_for_item(self.item)
-        # 删除与此元素相关的图文连接器
-        self.scene.remove_image_text_connectors(self.item)
-        # 删除元素本身
-        self.scene.removeItem(self.item)
-    
-    def save_item_state(self):
-        """保存元素状态"""
-        # 保存父子关系
-        if self.item.parentItem() and isinstance(self.item.parentItem(), BaseElement):
-            self.parent_item = self.item.parentItem()
-        
-        # 保存基本属性
-        if isinstance(self.item, VTextItem):
-            self.item_data = {
-                'type': 'VTextItem',
-                'text': self.item.full_text,
-                'font_size': self.item.font_size,
-                'box_height': self.item.box_height,
-                'font_family': self.item.font_family,
-                'text_color': self.item.text_color.name(),
-                'pos': (self.item.x(), self.item.y()),
-                'scene_pos': (self.item.scenePos().x(), self.item.scenePos().y())
-            }
-        elif isinstance(self.item, VImageItem):
-            self.item_data = {
-                'type': 'VImageItem',
-                'path': self.item.file_path,
-                'width': self.item.target_width,
-                'pos': (self.item.x(), self.item.y()),
-                'scene_pos': (self.item.scenePos().x(), self.item.scenePos().y())
-            }
+        # 摘下元素及其相关连接器，保留对象以便重做
+        self.record = self.scene.detach_element(self.item)
+    
+    def footprint(self):
+        # 撤销后摘下的元素及其子元素、连接器只由本命令（重做历史）引用
+        if self.record is None:
+            return UNDO_COMMAND_BYTES
+        return UNDO_COMMAND_BYTES + estimate_item_bytes(self.item) + len(self.record[2]) * UNDO_CONNECTOR_BYTES
 
 class DeleteItemCommand(UndoCommand):
-    """删除元素命令"""
+    """删除元素命令：原元素连同子元素、连接器一起摘下并由命令保持，撤销时原样挂回，
+    不重新排版、不重新解码图片，后续命令引用的仍是同一个对象"""
     def __init__(self, scene, item):
         super().__init__(scene)
         self.item = item
-        self.item_data = None
-        self.parent_item = None
-        self.child_items = []  # 保存子元素
-        self.child_connectors = []  # 保存作为父级的连接器
-        self.parent_connector = None  # 保存作为子级的连接器
-        self.image_text_connectors = []  # 保存图文连接器
-        self.save_item_state()
+        self.record = None  # (父级, 场景坐标, 连接器列表)
     
     def execute(self):
-        # 保存父子关系和连接器信息
-        self.save_relationships()
-        
-        # 删除与此元素相关的所有连接器
-        self.scene.remove_all_connectors_for_item(self.item)
-        # 删除与此元素相关的图文连接器
-        self.scene.remove_image_text_connectors(self.item)
-        # 删除元素本身
-        self.scene.removeItem(self.item)
+        self.record = self.scene.detach_element(self.item)
     
     def undo(self):
-        # 重新创建元素
-        if self.item_data['type'] == 'VTextItem':
-            new_item = VTextItem(
-                self.item_data['text'],
-                self.item_data['font_size'],
-                self.item_data['box_height']
-            )
-            new_item.font_family = self.item_data['font_family']
-            new_item.text_color = QColor(self.item_data['text_color'])
-            new_item.rebuild()
-        elif self.item_data['type'] == 'VImageItem':
-            new_item = VImageItem(
-                self.item_data['path'],
-                self.item_data['width']
-            )
-        
-        # 设置位置
-        if self.parent_item and self.parent_item.scene():
-            # 如果有父级，恢复父子关系
-            new_item.setParentItem(self.parent_item)
-            new_item.setPos(self.item_data['pos'][0], self.item_data['pos'][1])
-            # 重新创建父子连接器
-            self.scene.add_connector(self.parent_item, new_item)
-        else:
-            # 没有父级，直接添加到场景
-            new_item.setPos(self.item_data['scene_pos'][0], self.item_data['scene_pos'][1])
-            self.scene.addItem(new_item)
-        
-        # 恢复子元素的父子关系
-        for child_item in self.child_items:
-            if child_item.scene():
-                # 保存子元素当前场景位置
-                child_scene_pos = child_item.scenePos()
-                # 设置父子关系
-                child_item.setParentItem(new_item)
-                # 转换为本地坐标
-                child_local_pos = new_item.mapFromScene(child_scene_pos)
-                child_item.setPos(child_local_pos)
-                # 重新创建连接器
-                self.scene.add_connector(new_item, child_item)
-        
-        # 恢复图文连接器（这里需要更复杂的逻辑，暂时跳过）
-        
-        self.item = new_item
-    
-    def save_relationships(self):
-        """保存父子关系和连接器"""
-        # 保存父级关系
-        if self.item.parentItem() and isinstance(self.item.parentItem(), BaseElement):
-            self.parent_item = self.item.parentItem()
-        
-        # 保存子元素
-        for child in self.item.childItems():
-            if isinstance(child, BaseElement):
-                self.child_items.append(child)
-        
-        # 保存相关的连接器
-        self.child_connectors = [c for c in self.scene.connectors if c.parent_element == self.item]
-        self.parent_connector = next((c for c in self.scene.connectors if c.child_element == self.item), None)
-        
-        # 保存图文连接器
-        self.image_text_connectors = [c for c in self.scene.image_text_connectors 
-                                    if (hasattr(c, 'image_item') and (c.image_item == self.item or c.text_item == self.item)) or
-                                       (hasattr(c, 'item1') and (c.item1 == self.item or c.item2 == self.item))]
-    
-    def save_item_state(self):
-        """保存元素状态"""
-        if isinstance(self.item, VTextItem):
-            self.item_data = {
-                'type': 'VTextItem',
-                'text': self.item.full_text,
-                'font_size': self.item.font_size,
-                'box_height': self.item.box_height,
-                'font_family': self.item.font_family,
-                'text_color': self.item.text_color.name(),
-                'pos': (self.item.x(), self.item.y()),
-                'scene_pos': (self.item.scenePos().x(), self.item.scenePos().y())
-            }
-        elif isinstance(self.item, VImageItem):
-            self.item_data = {
-                'type': 'VImageItem',
-                'path': self.item.file_path,
-                'width': self.item.target_width,
-                'pos': (self.item.x(), self.item.y()),
-                'scene_pos': (self.item.scenePos().x(), self.item.scenePos().y())
-            }
+        self.scene.reattach_element(self.item, self.record)
+    
+    def footprint(self):
+        # 被删除的元素及其子元素、连接器只由本命令引用；撤销后重新挂回场景，不再计入
+        if self.record is None or self.item.scene() is self.scene:
+            return UNDO_COMMAND_BYTES
+        return UNDO_COMMAND_BYTES + estimate_item_bytes(self.item) + len(self.record[2]) * UNDO_CONNECTOR_BYTES
 
 class SetParentCommand(UndoCommand):
     """设置父子关系命令"""
@@ -1385,108 +2634,566 @@ class SetParentCommand(UndoCommand):
             self.child_item.setParentItem(None)
             self.child_item.setPos(self.old_scene_pos)
 
-class MoveItemCommand(UndoCommand):
-    """移动元素命令"""
-    def __init__(self, scene, item, old_pos, new_pos):
-        super().__init__(scene)
-        self.item = item
-        # 存储场景坐标，以简化父子移动的恢复逻辑
-        self.old_scene_pos = old_pos
-        self.new_scene_pos = new_pos
-        
-        # 记录移动前子元素的场景位置，以防父元素移动导致子元素相对位置变化
-        self.child_scene_positions = {}
-        for child in item.childItems():
-            if isinstance(child, BaseElement):
-                self.child_scene_positions[child] = child.scenePos()
+MOVE_MERGE_WINDOW = 1.0  # 秒：这段时间内对同一组元素的连续小幅移动合并为一步撤销
+MOVE_MERGE_DISTANCE = 10  # 像素：单次位移不超过此值才视为小幅移动（如键盘微调）
 
-    def execute(self):
-        # 执行：移到新场景位置
-        if self.item.parentItem():
+
+class MoveItemsCommand(UndoCommand):
+    """移动元素命令：一次记录一组元素移动前后的场景坐标，连接线在整组移动后统一更新"""
+    def __init__(self, scene, moves):
+        super().__init__(scene)
+        # 元素 -> (移动前场景坐标, 移动后场景坐标)；存储场景坐标以简化父子移动的恢复逻辑
+        self.moves = dict(moves)
+        self.time = time.monotonic()
+        self.small = self.is_small()  # 只有小幅移动之间才合并
+        
+        # 记录（未一起移动的）子元素相对父元素的位置，以防父元素移动导致子元素相对位置变化；
+        # 拖动结束时命令在移动之后才创建，本地坐标不受父元素移动影响，场景坐标则已是移动后的值
+        self.child_positions = {}
+        for item in self.moves:
+            for child in item.child_elements():
+                if child not in self.moves:
+                    self.child_positions[child] = (item, child.pos())
+    
+    @staticmethod
+    def set_scene_pos(item, scene_pos):
+        if item.parentItem():
             # 如果有父级，转换为本地坐标
-            local_pos = self.item.parentItem().mapFromScene(self.new_scene_pos)
-            self.item.setPos(local_pos)
+            item.setPos(item.parentItem().mapFromScene(scene_pos))
         else:
-            self.item.setPos(self.new_scene_pos)
+            item.setPos(scene_pos)
+    
+    def execute(self):
+        # 批量期间元素位置变化只登记连线，结束时统一计算路径
+        self.scene.begin_connector_batch()
+        try:
+            for item, (_, new_pos) in self.moves.items():
+                self.set_scene_pos(item, new_pos)
+        finally:
+            self.scene.end_connector_batch()
+    
+    def undo(self):
+        self.scene.begin_connector_batch()
+        try:
+            for item, (old_pos, _) in self.moves.items():
+                self.set_scene_pos(item, old_pos)
+            # 恢复子元素相对位置
+            for child, (parent, pos) in self.child_positions.items():
+                if child.parentItem() is parent:
+                    child.setPos(pos)
+        finally:
+            self.scene.end_connector_batch()
+    
+    def is_small(self):
+        return all(abs(new.x() - old.x()) <= MOVE_MERGE_DISTANCE and abs(new.y() - old.y()) <= MOVE_MERGE_DISTANCE
+                   for old, new in self.moves.values())
+    
+    def merge(self, other):
+        """短时间内对同一组元素的连续小幅移动（如键盘微调）合并到本命令"""
+        if (not isinstance(other, MoveItemsCommand) or not (self.small and other.small)
+                or other.moves.keys() != self.moves.keys() or other.time - self.time > MOVE_MERGE_WINDOW):
+            return False
+        for item, (_, new_pos) in other.moves.items():
+            self.moves[item] = (self.moves[item][0], new_pos)
+        self.time = other.time
+        return True
+    
+    def footprint(self):
+        return UNDO_COMMAND_BYTES + 96 * len(self.moves) + 64 * len(self.child_positions)
+
+PROPERTY_MERGE_WINDOW = 1.0  # 秒：这段时间内对同一组元素同一属性的连续修改（如微调框连点）合并为一步撤销
+
+
+class SetPropertyCommand(UndoCommand):
+    """修改元素属性命令（字体、颜色、每列字数、列间距、手动换行等）：只记录 (元素, 属性名, 旧值, 新值)，
+    撤销/重做时先写回全部属性，再对每个元素只重排一次。
+    merge_key 标识修改来源（如某个微调框），只有来源相同的连续修改才合并；为None时从不合并"""
+    def __init__(self, scene, changes, merge_key=None):
+        super().__init__(scene)
+        self.changes = list(changes)
+        self.merge_key = merge_key
+        self.time = time.monotonic()
+
+    @classmethod
+    def for_items(cls, scene, items, values, merge_key=None):
+        """把一组元素的属性设为 values（属性名 -> 新值）的命令；没有实际变化时返回 None"""
+        changes = [(item, name, getattr(item, name), value)
+                   for item in items for name, value in values.items() if getattr(item, name) != value]
+        return cls(scene, changes, merge_key) if changes else None
+
+    def apply(self, index):
+        """写回 changes 中第 index 项（2 为旧值，3 为新值），然后每个元素重排一次"""
+        items = {}
+        for change in self.changes:
+            setattr(change[0], change[1], change[index])
+            items[change[0]] = None
+        # 连线路径在全部元素重排后统一计算
+        self.scene.begin_connector_batch()
+        try:
+            for item in items:
+                item.rebuild()
+                if item.scene() is self.scene:
+                    self.scene.update_connectors(item)
+                    self.scene.update_image_text_connectors(item)
+        finally:
+            self.scene.end_connector_batch()
 
-        # 确保连线更新
-        self.item.scene().update_connectors(self.item)
-        self.item.scene().update_image_text_connectors(self.item)
+    def execute(self):
+        self.apply(3)
 
     def undo(self):
-        # 撤销：移回旧场景位置
-        if self.item.parentItem():
-            # 如果有父级，转换为本地坐标
-            local_pos = self.item.parentItem().mapFromScene(self.old_scene_pos)
-            self.item.setPos(local_pos)
-        else:
-            self.item.setPos(self.old_scene_pos)
-        
-        # 恢复子元素场景位置
-        for child, scene_pos in self.child_scene_positions.items():
-            if child.parentItem() == self.item:
-                # 将场景位置转换回父元素（即当前项目）的新本地坐标
-                local_pos = self.item.mapFromScene(scene_pos)
-                child.setPos(local_pos)
-        
-        # 确保连线更新
-        self.item.scene().update_connectors(self.item)
-        self.item.scene().update_image_text_connectors(self.item)
+        self.apply(2)
+
+    def merge(self, other):
+        """同一来源短时间内对同一组元素同一属性的连续修改合并到本命令，保留最早的旧值"""
+        if not isinstance(other, SetPropertyCommand) or self.merge_key is None or other.merge_key is not self.merge_key:
+            return False
+        if other.time - self.time > PROPERTY_MERGE_WINDOW:
+            return False
+        new_values = {(item, name): new for item, name, _, new in other.changes}
+        if new_values.keys() != {(item, name) for item, name, _, _ in self.changes}:
+            return False
+        self.changes = [(item, name, old, new_values[item, name]) for item, name, old, _ in self.changes]
+        self.time = other.time
+        return True
+
+    def footprint(self):
+        return UNDO_COMMAND_BYTES + 128 * len(self.changes)
+
+class MacroCommand(UndoCommand):
+    """组合命令：一批命令作为一步撤销/重做。
+    执行和撤销期间场景处于批量连接器维护状态，连接器的移除和路径计算对整批只做一次"""
+    def __init__(self, scene, commands=None):
+        super().__init__(scene)
+        self.commands = list(commands or [])
+    
+    def execute(self):
+        self.scene.begin_connector_batch()
+        try:
+            for command in self.commands:
+                command.execute()
+        finally:
+            self.scene.end_connector_batch()
+    
+    def undo(self):
+        self.scene.begin_connector_batch()
+        try:
+            for command in reversed(self.commands):
+                command.undo()
+        finally:
+            self.scene.end_connector_batch()
+    
+    def footprint(self):
+        return UNDO_COMMAND_BYTES + sum(command.footprint() for command in self.commands)
 
 class UndoStack:
-    """撤销栈管理器"""
-    def __init__(self, max_size=50):
-        self.commands = []
-        self.current_index = -1
-        self.max_size = max_size
+    """撤销栈管理器：容量按各命令估算的内存字节数计算，超出预算时从最旧的一端淘汰（O(1)）
+    小的编辑可以保留数百步，少数大的删除也不会长期占住大量内存"""
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.done = deque()  # 可撤销的命令，左端最旧
+        self.undone = deque()  # 可重做的命令，右端为最近撤销的，左端最远
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.macro = None  # 正在记录的组合命令
+        self.macro_depth = 0
     
     def push(self, command):
-        """添加新命令"""
-        # 删除当前位置之后的所有命令
-        self.commands = self.commands[:self.current_index + 1]
-        
-        # 添加新命令
-        self.commands.append(command)
-        self.current_index += 1
-        
-        # 限制栈大小
-        if len(self.commands) > self.max_size:
-            self.commands.pop(0)
-            self.current_index -= 1
-        
-        # 执行命令
+        """执行并添加新命令；组合命令记录期间并入该组合命令"""
         command.execute()
+        if self.macro is not None:
+            self.macro.commands.append(command)
+            return
+        self.record(command)
+    
+    def record(self, command):
+        """把已执行的命令加入历史"""
+        # 新命令使重做历史失效
+        for undone in self.undone:
+            self.total_bytes -= undone.bytes
+        self.undone.clear()
+        
+        # 能与上一条合并的命令（连续微调等）不新增历史
+        if self.done and self.done[-1].merge(command):
+            self.reaccount(self.done[-1])
+            return
+        
+        # 按执行后的状态估算占用
+        command.bytes = command.footprint()
+        self.done.append(command)
+        self.total_bytes += command.bytes
+        self.trim()
+    
+    def begin_macro(self, scene):
+        """开始组合命令（可嵌套）：之后 push 的命令立即执行，到 end_macro 时作为一步撤销加入历史"""
+        self.macro_depth += 1
+        if self.macro is None:
+            self.macro = MacroCommand(scene)
+            scene.begin_connector_batch()
+    
+    def end_macro(self):
+        self.macro_depth -= 1
+        if self.macro_depth > 0:
+            return
+        macro, self.macro = self.macro, None
+        macro.scene.end_connector_batch()
+        if len(macro.commands) == 1:
+            self.record(macro.commands[0])
+        elif macro.commands:
+            self.record(macro)
+    
+    def reaccount(self, command):
+        """命令状态改变（合并、撤销、重做）后重新估算其占用：例如添加命令撤销后改由命令持有被摘下的元素"""
+        self.total_bytes -= command.bytes
+        command.bytes = command.footprint()
+        self.total_bytes += command.bytes
+    
+    def trim(self):
+        """超出预算时先淘汰最旧的可撤销命令，再淘汰最远的可重做命令（重做历史同样计入 total_bytes），
+        两端各至少保留最近一条"""
+        while self.total_bytes > self.max_bytes and len(self.done) > 1:
+            self.total_bytes -= self.done.popleft().bytes
+        while self.total_bytes > self.max_bytes and len(self.undone) > 1:
+            self.total_bytes -= self.undone.popleft().bytes
+    
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.trim()
     
     def undo(self):
         """撤销"""
         if self.can_undo():
-            command = self.commands[self.current_index]
+            command = self.done.pop()
             command.undo()
-            self.current_index -= 1
+            self.undone.append(command)
+            self.reaccount(command)
+            self.trim()
             return True
         return False
     
     def redo(self):
         """重做"""
         if self.can_redo():
-            self.current_index += 1
-            command = self.commands[self.current_index]
+            command = self.undone.pop()
             command.execute()
+            self.done.append(command)
+            self.reaccount(command)
+            self.trim()
             return True
         return False
     
     def can_undo(self):
         """是否可以撤销"""
-        return self.current_index >= 0
+        return bool(self.done)
     
     def can_redo(self):
         """是否可以重做"""
-        return self.current_index < len(self.commands) - 1
+        return bool(self.undone)
     
     def clear(self):
         """清空栈"""
-        self.commands.clear()
-        self.current_index = -1
+        self.done.clear()
+        self.undone.clear()
+        self.total_bytes = 0
+
+# --- Spatial Index ---
+
+class SpatialGrid:
+    """均匀网格空间索引：保存对象的场景矩形，支持点查询、矩形查询和最近邻查询"""
+    def __init__(self, cell_size=256):
+        self.cell_size = cell_size
+        self.cells = {}  # (cx, cy) -> set(obj)
+        self.rects = {}  # obj -> (left, top, right, bottom)
+        self.cell_bounds = None  # 已占用网格范围 (min_cx, min_cy, max_cx, max_cy)，只扩不缩
+    
+    def __len__(self):
+        return len(self.rects)
+    
+    def __contains__(self, obj):
+        return obj in self.rects
+    
+    def __iter__(self):
+        return iter(list(self.rects))
+    
+    def _cell_keys(self, left, top, right, bottom):
+        cs = self.cell_size
+        for cx in range(int(left // cs), int(right // cs) + 1):
+            for cy in range(int(top // cs), int(bottom // cs) + 1):
+                yield (cx, cy)
+    
+    def insert(self, obj, rect):
+        """插入对象（已存在时更新位置）"""
+        if obj in self.rects:
+            self.remove(obj)
+        bounds = (rect.left(), rect.top(), rect.right(), rect.bottom())
+        self.rects[obj] = bounds
+        for key in self._cell_keys(*bounds):
+            self.cells.setdefault(key, set()).add(obj)
+        
+        cs = self.cell_size
+        c_left, c_top = int(bounds[0] // cs), int(bounds[1] // cs)
+        c_right, c_bottom = int(bounds[2] // cs), int(bounds[3] // cs)
+        if self.cell_bounds is None:
+            self.cell_bounds = (c_left, c_top, c_right, c_bottom)
+        else:
+            b = self.cell_bounds
+            self.cell_bounds = (min(b[0], c_left), min(b[1], c_top), max(b[2], c_right), max(b[3], c_bottom))
+    
+    def remove(self, obj):
+        """移除对象"""
+        bounds = self.rects.pop(obj, None)
+        if bounds is None:
+            return
+        for key in self._cell_keys(*bounds):
+            cell = self.cells.get(key)
+            if cell is not None:
+                cell.discard(obj)
+                if not cell:
+                    del self.cells[key]
+    
+    def update(self, obj, rect):
+        """更新对象位置，返回旧矩形（不存在时为None）"""
+        old_rect = self.rect_of(obj)
+        self.insert(obj, rect)
+        return old_rect
+    
+    def rect_of(self, obj):
+        """获取对象当前索引的矩形"""
+        bounds = self.rects.get(obj)
+        if bounds is None:
+            return None
+        return QRectF(QPointF(bounds[0], bounds[1]), QPointF(bounds[2], bounds[3]))
+    
+    def clear(self):
+        self.cells.clear()
+        self.rects.clear()
+        self.cell_bounds = None
+    
+    def query_point(self, x, y):
+        """包含该点的所有对象"""
+        cs = self.cell_size
+        result = []
+        for obj in self.cells.get((int(x // cs), int(y // cs)), ()):
+            left, top, right, bottom = self.rects[obj]
+            if left <= x <= right and top <= y <= bottom:
+                result.append(obj)
+        return result
+    
+    def query_rect(self, rect):
+        """与矩形相交的所有对象"""
+        left, top, right, bottom = rect.left(), rect.top(), rect.right(), rect.bottom()
+        result = set()
+        for key in self._cell_keys(left, top, right, bottom):
+            for obj in self.cells.get(key, ()):
+                if obj in result:
+                    continue
+                o_left, o_top, o_right, o_bottom = self.rects[obj]
+                if o_left <= right and o_right >= left and o_top <= bottom and o_bottom >= top:
+                    result.add(obj)
+        return result
+    
+    def distance_to(self, obj, x, y):
+        """点到对象矩形的距离（点在矩形内时为0）"""
+        left, top, right, bottom = self.rects[obj]
+        dx = max(left - x, 0.0, x - right)
+        dy = max(top - y, 0.0, y - bottom)
+        return math.hypot(dx, dy)
+    
+    def nearest(self, x, y, k=1, max_distance=None, predicate=None):
+        """按距离由近到远返回最多k个对象的[(距离, 对象)]
+        从点所在网格开始逐圈向外搜索，已找到的第k个对象比下一圈更近时停止
+        """
+        if not self.rects or k <= 0:
+            return []
+        cs = self.cell_size
+        cx, cy = int(x // cs), int(y // cs)
+        min_cx, min_cy, max_cx, max_cy = self.cell_bounds
+        max_ring = max(cx - min_cx, max_cx - cx, cy - min_cy, max_cy - cy, 0)
+        if max_distance is not None:
+            max_ring = min(max_ring, int(max_distance // cs) + 1)
+        
+        seen = set()
+        found = []  # [(distance, obj)]
+        for ring in range(max_ring + 1):
+            if ring == 0:
+                keys = [(cx, cy)]
+            else:
+                keys = [(cx + dx, cy - ring) for dx in range(-ring, ring + 1)]
+                keys += [(cx + dx, cy + ring) for dx in range(-ring, ring + 1)]
+                keys += [(cx - ring, cy + dy) for dy in range(-ring + 1, ring)]
+                keys += [(cx + ring, cy + dy) for dy in range(-ring + 1, ring)]
+            for key in keys:
+                for obj in self.cells.get(key, ()):
+                    if obj in seen:
+                        continue
+                    seen.add(obj)
+                    if predicate is not None and not predicate(obj):
+                        continue
+                    dist = self.distance_to(obj, x, y)
+                    if max_distance is None or dist <= max_distance:
+                        found.append((dist, obj))
+            
+            if len(found) >= k:
+                found.sort(key=lambda entry: entry[0])
+                found = found[:k]
+                # 下一圈之外的对象距离至少为ring*cs
+                if found[-1][0] <= ring * cs:
+                    break
+            if len(seen) == len(self.rects):
+                break
+        
+        found.sort(key=lambda entry: entry[0])
+        return found[:k]
+
+class ConnectorRouter:
+    """绕开元素包围盒的正交连线路由器
+    在连线端点附近的区域建立网格，用A*搜索绕开障碍元素的折线；
+    路由结果按端点缓存，并按走廊（折线包围盒）建立空间索引以便增量重路由
+    """
+    TURN_PENALTY = 2  # 每次转弯的额外代价，倾向更少的折点
+    MAX_CELLS = 100  # 搜索区域每边最多的网格数，超过时自动放大网格步长
+    
+    def __init__(self, scene, grid_step=20, margin=12, padding=200):
+        self.scene = scene
+        self.grid_step = grid_step
+        self.margin = margin  # 障碍物外扩距离
+        self.padding = padding  # 搜索区域相对端点包围盒的外扩距离
+        self.cache = {}  # connector -> (key, points)
+        self.corridors = SpatialGrid()  # connector -> 路由走廊
+    
+    def clear(self):
+        self.cache.clear()
+        self.corridors.clear()
+    
+    def forget(self, connector):
+        """丢弃连线的缓存路由"""
+        self.cache.pop(connector, None)
+        self.corridors.remove(connector)
+    
+    def connectors_crossing(self, rect):
+        """走廊与矩形相交的连线"""
+        return self.corridors.query_rect(rect)
+    
+    def route(self, connector, start, end, start_dir, end_dir, endpoint_items):
+        """返回从start到end的折线点列表（结果按端点缓存）"""
+        key = (round(start.x(), 1), round(start.y(), 1), round(end.x(), 1), round(end.y(), 1), start_dir, end_dir)
+        cached = self.cache.get(connector)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        
+        points = self.search(start, end, start_dir, end_dir, endpoint_items)
+        self.cache[connector] = (key, points)
+        
+        xs = [p.x() for p in points]
+        ys = [p.y() for p in points]
+        corridor = QRectF(QPointF(min(xs), min(ys)), QPointF(max(xs), max(ys)))
+        self.corridors.insert(connector, corridor.adjusted(-self.margin, -self.margin, self.margin, self.margin))
+        return points
+    
+    def search(self, start, end, start_dir, end_dir, endpoint_items):
+        """网格A*搜索，找不到路径时退回简单折线"""
+        stub = self.margin + self.grid_step
+        # 有出线方向的端点先沿该方向伸出一段，使折线离开元素后再绕行
+        head = start + QPointF(start_dir[0] * stub, start_dir[1] * stub) if start_dir else start
+        tail = end + QPointF(end_dir[0] * stub, end_dir[1] * stub) if end_dir else end
+        
+        region = QRectF(head, tail).normalized().adjusted(-self.padding, -self.padding, self.padding, self.padding)
+        step = max(self.grid_step, region.width() / self.MAX_CELLS, region.height() / self.MAX_CELLS)
+        # 均匀网格线之外再加入两端的坐标，使起止点都正好落在格点上
+        xs = self.grid_lines(region.left(), region.right(), step, (head.x(), tail.x()))
+        ys = self.grid_lines(region.top(), region.bottom(), step, (head.y(), tail.y()))
+        
+        blocked = set()
+        for item in self.scene.elements_in_rect(region):
+            # 没有出线方向的端点元素（使用中心点连接）不作为障碍
+            if item is endpoint_items[0] and not start_dir:
+                continue
+            if item is endpoint_items[1] and not end_dir:
+                continue
+            rect = item.sceneBoundingRect().adjusted(-self.margin, -self.margin, self.margin, self.margin)
+            cols = range(bisect.bisect_left(xs, rect.left()), bisect.bisect_right(xs, rect.right()))
+            rows = range(bisect.bisect_left(ys, rect.top()), bisect.bisect_right(ys, rect.bottom()))
+            for cx in cols:
+                for cy in rows:
+                    blocked.add((cx, cy))
+        
+        source = (xs.index(head.x()), ys.index(head.y()))
+        target = (xs.index(tail.x()), ys.index(tail.y()))
+        blocked.discard(source)
+        blocked.discard(target)
+        cells = self.a_star(source, target, blocked, xs, ys, step)
+        
+        if cells is None:
+            # 无可行路径：使用中点折线
+            mid_y = (head.y() + tail.y()) / 2
+            middle = [QPointF(head.x(), mid_y), QPointF(tail.x(), mid_y)]
+        else:
+            middle = [QPointF(xs[cx], ys[cy]) for cx, cy in cells]
+        
+        points = [start]
+        for p in [head] + middle + [tail, end]:
+            if p != points[-1]:
+                points.append(p)
+        return self.simplify(points)
+    
+    @staticmethod
+    def grid_lines(low, high, step, extra):
+        """生成[low, high]内的网格线坐标，并保证包含extra中的坐标"""
+        count = int((high - low) / step) + 1
+        return sorted(set([low + i * step for i in range(count)]) | set(extra))
+    
+    def a_star(self, source, target, blocked, xs, ys, step):
+        """四邻域A*，状态包含来向以计入转弯代价"""
+        directions = ((1, 0), (-1, 0), (0, 1), (0, -1))
+        cols, rows = len(xs), len(ys)
+        turn_cost = self.TURN_PENALTY * step
+        tx, ty = xs[target[0]], ys[target[1]]
+        
+        def estimate(cell):
+            return abs(xs[cell[0]] - tx) + abs(ys[cell[1]] - ty)
+        
+        open_heap = [(estimate(source), 0, source, None)]
+        best = {(source, None): 0}
+        came_from = {}
+        while open_heap:
+            _, cost, cell, heading = heapq.heappop(open_heap)
+            if cell == target:
+                path = [cell]
+                state = (cell, heading)
+                while state in came_from:
+                    state = came_from[state]
+                    path.append(state[0])
+                path.reverse()
+                return path
+            if cost > best.get((cell, heading), float('inf')):
+                continue
+            x, y = cell
+            for d in directions:
+                nx, ny = x + d[0], y + d[1]
+                if nx < 0 or ny < 0 or nx >= cols or ny >= rows or (nx, ny) in blocked:
+                    continue
+                new_cost = cost + abs(xs[nx] - xs[x]) + abs(ys[ny] - ys[y])
+                if heading is not None and heading != d:
+                    new_cost += turn_cost
+                state = ((nx, ny), d)
+                if new_cost < best.get(state, float('inf')):
+                    best[state] = new_cost
+                    came_from[state] = (cell, heading)
+                    heapq.heappush(open_heap, (new_cost + estimate((nx, ny)), new_cost, (nx, ny), d))
+        return None
+    
+    @staticmethod
+    def simplify(points):
+        """去掉共线的中间点"""
+        result = points[:2]
+        for p in points[2:]:
+            a, b = result[-2], result[-1]
+            collinear = (abs(a.x() - b.x()) < 1e-6 and abs(b.x() - p.x()) < 1e-6) or \
+                        (abs(a.y() - b.y()) < 1e-6 and abs(b.y() - p.y()) < 1e-6)
+            if collinear:
+                result[-1] = p
+            else:
+                result.append(p)
+        return result
 
 # --- Graphics Items ---
 
@@ -1547,31 +3254,77 @@ class ConnectionPoint(QGraphicsEllipseItem):
         if self.scene() and self.parent_element:
             self.scene().update_image_text_connectors(self.parent_element)
     
+    def set_highlighted(self, highlighted):
+        """设置高亮状态（悬停或拖拽连线吸附时）"""
+        if highlighted:
+            self.setBrush(QBrush(QColor(255, 150, 150, 255)))  # 高亮显示
+            self.setPen(QPen(QColor(255, 0, 0), 4))  # 更粗的悬停边框
+        else:
+            self.setBrush(QBrush(QColor(255, 100, 100, 200)))  # 恢复原样
+            self.setPen(QPen(QColor(200, 50, 50), 3))  # 恢复原始粗细
+    
     def hoverEnterEvent(self, event):
         """鼠标悬停进入"""
-        self.setBrush(QBrush(QColor(255, 150, 150, 255)))  # 高亮显示
-        self.setPen(QPen(QColor(255, 0, 0), 4))  # 更粗的悬停边框
+        self.set_highlighted(True)
         super().hoverEnterEvent(event)
     
     def hoverLeaveEvent(self, event):
         """鼠标悬停离开"""
-        self.setBrush(QBrush(QColor(255, 100, 100, 200)))  # 恢复原样
-        self.setPen(QPen(QColor(200, 50, 50), 3))  # 恢复原始粗细
+        self.set_highlighted(False)
         super().hoverLeaveEvent(event)
     
+    def paint(self, painter, option, widget):
+        scene = self.scene()
+        if scene is not None and scene.exporting:
+            return  # 连接点只用于编辑，不出现在导出结果中
+        super().paint(painter, option, widget)
+    
     def mousePressEvent(self, event):
         """鼠标按下开始连接"""
         if event.button() == Qt.MouseButton.LeftButton:
             if self.scene():
-                self.scene().start_connection_from_point(self)
+                self.scene().start_connection_from_point(self, event.scenePos())
         super().mousePressEvent(event)
     
     def get_scene_center(self):
         """获取连接点在场景中的中心位置"""
         return self.mapToScene(0, 0)
 
-class VGenericConnector(QGraphicsPathItem):
+class ConnectionPreviewItem(QGraphicsPathItem):
+    """拖拽连线时的预览曲线"""
+    def paint(self, painter, option, widget):
+        scene = self.scene()
+        if scene is not None and scene.exporting:
+            return  # 只用于编辑，不出现在导出结果中
+        super().paint(painter, option, widget)
+
+class ConnectorPathMixin:
+    """三种连接线共用的路径设置和端点访问，END_ATTRS 为两端元素的属性名"""
+    END_ATTRS = ('item1', 'item2')
+    
+    def set_curve(self, anchor1, ctrl1, ctrl2, anchor2):
+        """根据端点和控制点设置三次贝塞尔曲线"""
+        path = QPainterPath()
+        path.moveTo(anchor1)
+        path.cubicTo(QPointF(*ctrl1), QPointF(*ctrl2), anchor2)
+        self.setPath(path)
+    
+    def set_polyline(self, points):
+        """设置绕行折线路径"""
+        path = QPainterPath()
+        path.moveTo(points[0])
+        for p in points[1:]:
+            path.lineTo(p)
+        self.setPath(path)
+    
+    def endpoints(self):
+        """连线两端的元素"""
+        return tuple(getattr(self, name) for name in self.END_ATTRS)
+
+class VGenericConnector(ConnectorPathMixin, QGraphicsPathItem):
     """通用连接线 - 支持任意两个元素之间的连接"""
+    curve_style = CURVE_STYLE_GENERIC
+    
     def __init__(self, item1, item2, connection_type="generic", line_width=None):
         super().__init__()
         self.item1 = item1
@@ -1614,8 +3367,9 @@ class VGenericConnector(QGraphicsPathItem):
         super().hoverLeaveEvent(event)
     
     def paint(self, painter, option, widget):
-        """绘制连接线，选中时显示高亮"""
-        if self.isSelected():
+        """绘制连接线，选中时显示高亮（导出时按未选中的样式）"""
+        exporting = self.scene() is not None and self.scene().exporting
+        if self.isSelected() and not exporting:
             # 选中时使用橙色粗线
             pen = QPen(QColor(255, 140, 0), self.line_width + 2, Qt.PenStyle.SolidLine)
             self.setPen(pen)
@@ -1625,6 +3379,9 @@ class VGenericConnector(QGraphicsPathItem):
             pen.setWidth(self.line_width)
             pen.setStyle(Qt.PenStyle.SolidLine)
             self.setPen(pen)
+        if exporting:
+            option = QStyleOptionGraphicsItem(option)
+            option.state &= ~QStyle.StateFlag.State_Selected  # 不画Qt自带的选中虚线框
         super().paint(painter, option, widget)
     
     def contextMenuEvent(self, event):
@@ -1673,56 +3430,48 @@ class VGenericConnector(QGraphicsPathItem):
                 self.scene().remove_connector_item(self)
         
     def update_path(self):
-        if not self.item1.scene() or not self.item2.scene():
+        scene = self.scene()
+        if scene is not None and scene.obstacle_routing:
+            scene.route_around_obstacles(self)
+            return
+        anchors = self.get_anchors()
+        if anchors is None:
             return
+        anchor1, anchor2 = anchors
+        ctrl1, ctrl2 = curve_controls(anchor1.x(), anchor1.y(), anchor2.x(), anchor2.y(), *self.curve_style)
+        self.set_curve(anchor1, ctrl1, ctrl2, anchor2)
+    
+    def get_anchors(self):
+        """获取连接线两端的场景坐标，元素不在场景中时返回None"""
+        if not self.item1.scene() or not self.item2.scene():
+            return None
 
-        # 获取两个元素的连接点
-        point1 = self.get_connection_point(self.item1)
-        point2 = self.get_connection_point(self.item2)
+        # 优先使用两个元素的连接点
+        anchor1 = self.item1.connection_anchor()
+        anchor2 = self.item2.connection_anchor()
         
-        if not point1 or not point2:
+        if anchor1 is None or anchor2 is None:
             # 如果没有连接点，使用中心点
-            rect1 = self.item1.boundingRect()
-            pos1 = self.item1.scenePos()
-            anchor1 = pos1 + QPointF(rect1.width()/2, rect1.height()/2)
-            
-            rect2 = self.item2.boundingRect()
-            pos2 = self.item2.scenePos()
-            anchor2 = pos2 + QPointF(rect2.width()/2, rect2.height()/2)
-        else:
-            anchor1 = point1.get_scene_center()
-            anchor2 = point2.get_scene_center()
-        
-        path = QPainterPath()
-        path.moveTo(anchor1)
-        
-        # 计算控制点，创建优美的曲线
-        distance = (anchor2 - anchor1).manhattanLength()
-        curve_offset = min(distance * 0.3, 80)
-        
-        # 根据相对位置调整控制点
-        dx = anchor2.x() - anchor1.x()
-        dy = anchor2.y() - anchor1.y()
-        
-        if abs(dx) > abs(dy):  # 水平方向为主
-            ctrl1 = anchor1 + QPointF(curve_offset if dx > 0 else -curve_offset, 0)
-            ctrl2 = anchor2 - QPointF(curve_offset if dx > 0 else -curve_offset, 0)
-        else:  # 垂直方向为主
-            ctrl1 = anchor1 + QPointF(0, curve_offset if dy > 0 else -curve_offset)
-            ctrl2 = anchor2 - QPointF(0, curve_offset if dy > 0 else -curve_offset)
-        
-        path.cubicTo(ctrl1, ctrl2, anchor2)
-        self.setPath(path)
+            anchor1 = self.item1.anchor_center()
+            anchor2 = self.item2.anchor_center()
+        return anchor1, anchor2
+    
+    def anchor_directions(self):
+        """两端的出线方向：使用连接点时沿连接点朝外，使用中心点时为None"""
+        if self.item1.connection_point is None or self.item2.connection_point is None:
+            return None, None
+        return tuple((0, -1) if item.connection_point.point_type == "image_top" else (0, 1)
+                     for item in (self.item1, self.item2))
     
     def get_connection_point(self, item):
         """获取元素的连接点"""
-        for child in item.childItems():
-            if isinstance(child, ConnectionPoint):
-                return child
-        return None
+        return item.connection_point
 
-class VImageTextConnector(QGraphicsPathItem):
+class VImageTextConnector(ConnectorPathMixin, QGraphicsPathItem):
     """图文连接线- 连接图片顶部中点和文字底部中点"""
+    curve_style = CURVE_STYLE_IMAGE_TEXT
+    END_ATTRS = ('image_item', 'text_item')
+    
     def __init__(self, image_item, text_item, line_width=None):
         super().__init__()
         self.image_item = image_item
@@ -1763,8 +3512,9 @@ class VImageTextConnector(QGraphicsPathItem):
         super().hoverLeaveEvent(event)
     
     def paint(self, painter, option, widget):
-        """绘制连接线，选中时显示高亮"""
-        if self.isSelected():
+        """绘制连接线，选中时显示高亮（导出时按未选中的样式）"""
+        exporting = self.scene() is not None and self.scene().exporting
+        if self.isSelected() and not exporting:
             # 选中时使用橙色粗线
             pen = QPen(QColor(255, 140, 0), self.line_width + 2, Qt.PenStyle.SolidLine)
             self.setPen(pen)
@@ -1774,6 +3524,9 @@ class VImageTextConnector(QGraphicsPathItem):
             pen.setWidth(self.line_width)
             pen.setStyle(Qt.PenStyle.SolidLine)
             self.setPen(pen)
+        if exporting:
+            option = QStyleOptionGraphicsItem(option)
+            option.state &= ~QStyle.StateFlag.State_Selected  # 不画Qt自带的选中虚线框
         super().paint(painter, option, widget)
         
     def contextMenuEvent(self, event):
@@ -1822,59 +3575,34 @@ class VImageTextConnector(QGraphicsPathItem):
                 self.scene().remove_connector_item(self)
         
     def update_path(self):
-        if not self.image_item.scene() or not self.text_item.scene():
+        scene = self.scene()
+        if scene is not None and scene.obstacle_routing:
+            scene.route_around_obstacles(self)
             return
+        anchors = self.get_anchors()
+        if anchors is None:
+            return
+        img_anchor, text_anchor = anchors
+        ctrl1, ctrl2 = curve_controls(img_anchor.x(), img_anchor.y(), text_anchor.x(), text_anchor.y(), *self.curve_style)
+        self.set_curve(img_anchor, ctrl1, ctrl2, text_anchor)
+    
+    def get_anchors(self):
+        """获取图片端和文字端的场景坐标，元素不在场景中时返回None"""
+        if not self.image_item.scene() or not self.text_item.scene():
+            return None
 
-        # 从连接点获取位置
-        img_point = None
-        text_point = None
-        
-        # 查找图片的连接点
-        for child in self.image_item.childItems():
-            if isinstance(child, ConnectionPoint) and child.point_type == "image_top":
-                img_point = child
-                break
-        
-        # 查找文字的连接点
-        for child in self.text_item.childItems():
-            if isinstance(child, ConnectionPoint) and child.point_type == "text_bottom":
-                text_point = child
-                break
-        
-        if not img_point or not text_point:
-            # 如果没有连接点，使用原来的计算方条
-            img_rect = self.image_item.boundingRect()
-            img_pos = self.image_item.scenePos()
-            img_anchor = img_pos + QPointF(img_rect.width()/2, 0)
-            
-            text_rect = self.text_item.boundingRect()
-            text_pos = self.text_item.scenePos()
-            text_anchor = text_pos + QPointF(text_rect.width()/2, text_rect.height())
-        else:
-            # 使用连接点的位置
-            img_anchor = img_point.get_scene_center()
-            text_anchor = text_point.get_scene_center()
-        
-        path = QPainterPath()
-        path.moveTo(img_anchor)
-        
-        # 计算控制点，创建优美的曲条
-        distance = (text_anchor - img_anchor).manhattanLength()
-        curve_offset = min(distance * 0.3, 100)  # 曲线弯曲程度
-        
-        # 根据相对位置调整控制条
-        if text_anchor.y() > img_anchor.y():  # 文字在图片下条
-            ctrl1 = img_anchor + QPointF(0, curve_offset)
-            ctrl2 = text_anchor - QPointF(0, curve_offset)
-        else:  # 文字在图片上条
-            ctrl1 = img_anchor - QPointF(0, curve_offset)
-            ctrl2 = text_anchor + QPointF(0, curve_offset)
-        
-        path.cubicTo(ctrl1, ctrl2, text_anchor)
-        self.setPath(path)
+        # 图片顶部中点和文字底部中点，与两者的连接点位置一致
+        return self.image_item.anchor_top(), self.text_item.anchor_bottom()
+    
+    def anchor_directions(self):
+        """图片顶部向上出线，文字底部向下出线"""
+        return (0, -1), (0, 1)
 
-class VConnector(QGraphicsPathItem):
+class VConnector(ConnectorPathMixin, QGraphicsPathItem):
     """Dynamic Red Line Connector"""
+    curve_style = CURVE_STYLE_PARENT_CHILD
+    END_ATTRS = ('parent_element', 'child_element')
+    
     def __init__(self, parent_item, child_item):
         super().__init__()
         self.parent_element = parent_item
@@ -1886,64 +3614,130 @@ class VConnector(QGraphicsPathItem):
         pen.setStyle(Qt.PenStyle.DashLine)
         self.setPen(pen)
         self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable, False)
+    
+    def paint(self, painter, option, widget):
+        scene = self.scene()
+        if scene is not None and scene.exporting:
+            return  # 父子关系连线不导出
+        super().paint(painter, option, widget)
         
     def update_path(self):
-        if not self.parent_element.scene() or not self.child_element.scene():
+        scene = self.scene()
+        if scene is not None and scene.obstacle_routing:
+            scene.route_around_obstacles(self)
+            return
+        anchors = self.get_anchors()
+        if anchors is None:
             return
+        p_anchor, c_anchor = anchors
+        ctrl1, ctrl2 = curve_controls(p_anchor.x(), p_anchor.y(), c_anchor.x(), c_anchor.y(), *self.curve_style)
+        self.set_curve(p_anchor, ctrl1, ctrl2, c_anchor)
+    
+    def get_anchors(self):
+        """获取父级底部和子级顶部的场景坐标，元素不在场景中时返回None"""
+        if not self.parent_element.scene() or not self.child_element.scene():
+            return None
 
-        # Simple logic: closest points roughly
-        # Or specifically: Parent Bottom -> Child Top
-        p_anchor = self.parent_element.scenePos() + QPointF(self.parent_element.boundingRect().width()/2, self.parent_element.boundingRect().height())
-        c_anchor = self.child_element.scenePos() + QPointF(self.child_element.boundingRect().width()/2, 0)
-        
-        if isinstance(self.parent_element, VTextItem):
-            # Text grows down/left. Anchor at bottom of last col? Or center?
-            # Let's use Bottom-Center of bounding rect for now
-            pass
-            
-        path = QPainterPath()
-        path.moveTo(p_anchor)
-        # Bezier curve for smooth look
-        ctrl1 = p_anchor + QPointF(0, 50)
-        ctrl2 = c_anchor - QPointF(0, 50)
-        path.cubicTo(ctrl1, ctrl2, c_anchor)
-        self.setPath(path)
+        # Parent Bottom -> Child Top
+        return self.parent_element.anchor_bottom(), self.child_element.anchor_top()
+    
+    def anchor_directions(self):
+        """父级底部向下出线，子级顶部向上出线"""
+        return (0, 1), (0, -1)
 
 class BaseElement(QGraphicsItem):
     """Common base for Text and Image elements"""
+    next_element_id = 1  # 下一个可分配的元素ID
+    
     def __init__(self):
         super().__init__()
+        self.element_id = BaseElement.allocate_id()  # 持久ID，保存和加载时保持不变
+        self.materialized = True  # 字形、图片等子项是否已创建（虚拟化显示时可释放）
         self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable)
         self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable)
         self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemSendsGeometryChanges)
         self.connectors = []
-        self._drag_start_pos_scene = QPointF() # 记录拖动开始时的场景位置 
+        self.connection_point = None  # 连接点（由子类创建并缓存引用）
+        self._child_elements = []  # 子元素缓存（不含字形等普通子项）
+    
+    @staticmethod
+    def allocate_id():
+        element_id = BaseElement.next_element_id
+        BaseElement.next_element_id += 1
+        return element_id
+    
+    def restore_id(self, element_id):
+        """使用已保存的ID，并保证之后分配的ID不会与之重复"""
+        self.element_id = element_id
+        BaseElement.next_element_id = max(BaseElement.next_element_id, element_id + 1)
+    
+    def materialize(self):
+        """创建显示用的子项（由子类实现）"""
+        self.materialized = True
+    
+    def dematerialize(self):
+        """释放显示用的子项，只保留数据和包围盒（由子类实现）"""
+        self.materialized = False
 
     def itemChange(self, change, value):
         if change == QGraphicsItem.GraphicsItemChange.ItemPositionHasChanged:
             # Update connectors
             if self.scene():
+                self.scene().update_element_index(self)
                 self.scene().update_connectors(self)
                 self.scene().update_image_text_connectors(self)
+        elif change == QGraphicsItem.GraphicsItemChange.ItemSceneChange:
+            # 离开旧场景前从其空间索引中移除
+            if isinstance(self.scene(), LayoutScene):
+                self.scene().unindex_element(self)
+        elif change == QGraphicsItem.GraphicsItemChange.ItemSceneHasChanged:
+            if isinstance(self.scene(), LayoutScene):
+                self.scene().index_element(self)
+        elif change == QGraphicsItem.GraphicsItemChange.ItemChildAddedChange:
+            if isinstance(value, BaseElement) and value not in self._child_elements:
+                self._child_elements.append(value)
+        elif change == QGraphicsItem.GraphicsItemChange.ItemChildRemovedChange:
+            if value in self._child_elements:
+                self._child_elements.remove(value)
         return super().itemChange(change, value)
 
+    def child_elements(self):
+        """直接子元素列表（不遍历字形等子项）"""
+        return list(self._child_elements)
+
+    # --- 锚点 API（场景坐标） ---
+    def anchor_top(self):
+        """顶部中点"""
+        rect = self.boundingRect()
+        return self.mapToScene(QPointF(rect.center().x(), rect.top()))
+
+    def anchor_bottom(self):
+        """底部中点"""
+        rect = self.boundingRect()
+        return self.mapToScene(QPointF(rect.center().x(), rect.bottom()))
+
+    def anchor_center(self):
+        """中心点"""
+        return self.mapToScene(self.boundingRect().center())
+
+    def connection_anchor(self):
+        """连接点中心，没有连接点时返回None"""
+        if self.connection_point is None:
+            return None
+        return self.connection_point.get_scene_center()
+
     def mousePressEvent(self, event):
         """记录拖动开始时的位置"""
-        if event.button() == Qt.MouseButton.LeftButton:
-            self._drag_start_pos_scene = self.scenePos()
         super().mousePressEvent(event)
+        if event.button() == Qt.MouseButton.LeftButton and self.scene():
+            # 在基类处理完选中状态之后记录，拖动会带着所有选中元素一起移动
+            self.scene().begin_drag_move(self)
 
     def mouseReleaseEvent(self, event):
         """记录移动命令到撤销栈"""
-        if event.button() == Qt.MouseButton.LeftButton:
-            current_pos_scene = self.scenePos()
-            # 只有当移动距离足够大时才记录，避免误触
-            if (current_pos_scene - self._drag_start_pos_scene).manhattanLength() > 2.0:
-                # 创建移动命令
-                command = MoveItemCommand(self.scene(), self, self._drag_start_pos_scene, current_pos_scene)
-                self.scene().undo_stack.push(command)
-        
         super().mouseReleaseEvent(event)
+        if event.button() == Qt.MouseButton.LeftButton and self.scene():
+            self.scene().finish_drag_move()
     
     def contextMenuEvent(self, event):
         menu = QMenu()
@@ -1983,6 +3777,7 @@ class BaseElement(QGraphicsItem):
             batch_menu = menu.addMenu("批量连接 (Batch Connect)")
             auto_connect_action = batch_menu.addAction("智能连接")
             position_connect_action = batch_menu.addAction("位置连接")
+            nearest_connect_action = batch_menu.addAction("就近连接")
             connect_to_text_action = batch_menu.addAction("连到文字")
             connect_to_image_action = batch_menu.addAction("连到图片")
             batch_menu.addSeparator()
@@ -2011,6 +3806,8 @@ class BaseElement(QGraphicsItem):
                 self.scene().auto_connect_selected_items()
             elif action == position_connect_action:
                 self.scene().connect_by_position()
+            elif action == nearest_connect_action:
+                self.scene().connect_nearest()
             elif action == connect_to_text_action:
                 self.scene().connect_all_images_to_text()
             elif action == connect_to_image_action:
@@ -2036,7 +3833,7 @@ class BaseElement(QGraphicsItem):
 
     def paint(self, painter, option, widget):
         # Draw orange dashed selection border
-        if self.isSelected():
+        if self.isSelected() and not (self.scene() is not None and self.scene().exporting):
             # 设置抗锯齿以获得更平滑的线条
             painter.setRenderHint(QPainter.RenderHint.Antialiasing)
             
@@ -2179,8 +3976,10 @@ class InlineTextEditor(QTextEdit):
 
 class VTextItem(BaseElement):
     """Vertical Text Engine (Right-to-Left columns)"""
-    def __init__(self, text="请输入文本", font_size=DEFAULT_FONT_SIZE, box_height=400):
+    def __init__(self, text="请输入文本", font_size=DEFAULT_FONT_SIZE, box_height=400, materialized=True):
+        """materialized 为False时只排版、不创建字形（加载工程时由场景按需创建）"""
         super().__init__()
+        self.materialized = materialized
         self.full_text = text
         self.font_size = font_size
         self.font_family = DEFAULT_FONT
@@ -2203,18 +4002,56 @@ class VTextItem(BaseElement):
         self.rebuild()
         self.create_connection_point()
 
-    def rebuild(self):
-        old_rect = self.boundingRect()
-        
-        # Clear child text items only
+    glyph_heights = {}  # (字体, 字符) -> 字形高度，不创建字形也能计算排版尺寸
+    
+    @staticmethod
+    def glyph_height(font, char):
+        key = (font.key(), char)
+        height = VTextItem.glyph_heights.get(key)
+        if height is None:
+            probe = QGraphicsSimpleTextItem(char)
+            probe.setFont(font)
+            height = VTextItem.glyph_heights[key] = probe.boundingRect().height()
+        return height
+    
+    def clear_glyphs(self):
+        """移除字形子项（保留子元素和连接点）"""
         scene = self.scene()
-        child_items = self.childItems()
-        for child in child_items:
+        for child in self.childItems():
             if not isinstance(child, (BaseElement, ConnectionPoint)):
                 if scene:
                     scene.removeItem(child)
                 else:
                     child.setParentItem(None)
+    
+    def create_glyphs(self):
+        """按排版结果创建字形子项"""
+        brush = QBrush(self.text_color)
+        for char, x, y, is_rotated in self.glyph_layout:
+            t = QGraphicsSimpleTextItem(char)
+            t.setFont(self.glyph_font)
+            t.setBrush(brush)
+            if is_rotated:
+                t.setTransformOriginPoint(t.boundingRect().center())
+                t.setRotation(90)
+            t.setParentItem(self)
+            t.setPos(x, y)
+    
+    def materialize(self):
+        if not self.materialized:
+            super().materialize()
+            self.create_glyphs()
+    
+    def dematerialize(self):
+        if self.materialized:
+            super().dematerialize()
+            self.clear_glyphs()
+    
+    def rebuild(self):
+        old_rect = self.boundingRect()
+        
+        # Clear child text items only
+        self.clear_glyphs()
             
         font = QFont(self.font_family, self.font_size)
         fm = QFontMetrics(font)
@@ -2231,7 +4068,7 @@ class VTextItem(BaseElement):
         
         cursor_y = 0
         col_idx = 0
-        generated_items = []
+        layout = []  # (字符, x, y, 是否旋转)
         
         for char in self.full_text:
             if char == '\n' and self.manual_line_break:
@@ -2244,10 +4081,6 @@ class VTextItem(BaseElement):
             is_rotated = char in ROTATE_CHARS
             is_offset = char in OFFSET_CHARS
             
-            t = QGraphicsSimpleTextItem(char)
-            t.setFont(font)
-            t.setBrush(QBrush(self.text_color))
-            
             if cursor_y + char_h > effective_height:
                 cursor_y = 0
                 col_idx += 1
@@ -2256,10 +4089,6 @@ class VTextItem(BaseElement):
             x_local = -(col_idx * col_step)
             y_pos = cursor_y
             
-            if is_rotated:
-                t.setTransformOriginPoint(t.boundingRect().center())
-                t.setRotation(90)
-            
             final_x = x_local
             final_y = y_pos
             
@@ -2267,9 +4096,7 @@ class VTextItem(BaseElement):
                 final_x += self.font_size * 0.4
                 final_y -= self.font_size * 0.4
                 
-            t.setParentItem(self) 
-            t.setPos(final_x, final_y)
-            generated_items.append(t)
+            layout.append((char, final_x, final_y, is_rotated))
             cursor_y += char_h * LINE_HEIGHT_RATIO
 
         total_cols = col_idx + 1
@@ -2277,19 +4104,20 @@ class VTextItem(BaseElement):
         
         # 调整所有字符位置，使第一列保持在右侧
         shift_x = total_width - col_step
+        self.glyph_layout = [(char, x + shift_x, y, is_rotated) for char, x, y, is_rotated in layout]
+        self.glyph_font = font
         
-        for item in generated_items:
-            item.moveBy(shift_x, 0)
-        
-        if generated_items:
-            max_y = 0
-            for item in generated_items:
-                item_bottom = item.y() + item.boundingRect().height()
-                max_y = max(max_y, item_bottom)
+        if layout:
+            max_y = max(y + self.glyph_height(font, char) for char, x, y, is_rotated in layout)
             actual_height = max(max_y + 5, char_h) 
         else:
             actual_height = char_h
+        
+        # 虚拟化显示时离屏元素只计算排版，不创建字形
+        if self.materialized:
+            self.create_glyphs()
             
+        self.prepareGeometryChange()
         self._rect = QRectF(0, 0, total_width, actual_height)
         
         new_width = total_width
@@ -2298,6 +4126,8 @@ class VTextItem(BaseElement):
         
         if abs(dx) > 0.1: 
             self.moveBy(dx, 0)
+        elif self.scene():
+            self.scene().update_element_index(self)
         
         if self.connection_point:
             self.connection_point.update_position()
@@ -2361,6 +4191,7 @@ class VTextItem(BaseElement):
             batch_menu = menu.addMenu("批量连接 (Batch Connect)")
             auto_connect_action = batch_menu.addAction("智能连接")
             position_connect_action = batch_menu.addAction("位置连接")
+            nearest_connect_action = batch_menu.addAction("就近连接")
             connect_to_text_action = batch_menu.addAction("连到文字")
             connect_to_image_action = batch_menu.addAction("连到图片")
             batch_menu.addSeparator()
@@ -2402,6 +4233,8 @@ class VTextItem(BaseElement):
                 self.scene().auto_connect_selected_items()
             elif action == position_connect_action:
                 self.scene().connect_by_position()
+            elif action == nearest_connect_action:
+                self.scene().connect_nearest()
             elif action == connect_to_text_action:
                 self.scene().connect_all_images_to_text()
             elif action == connect_to_image_action:
@@ -2425,38 +4258,34 @@ class VTextItem(BaseElement):
         elif action == set_parent_action:
              if self.scene(): self.scene().start_binding_mode(self)
 
+    def set_properties(self, values):
+        """修改属性（属性名 -> 新值），作为一步可撤销命令执行并重排一次"""
+        command = SetPropertyCommand.for_items(self.scene(), [self], values)
+        if command is not None:
+            self.scene().undo_stack.push(command)
+
     def change_font_settings(self):
         current_font = QFont(self.font_family, self.font_size)
         font, ok = QFontDialog.getFont(current_font, None, "选择字体")
         if ok:
-            self.font_family = font.family()
-            self.font_size = font.pointSize()
-            self.rebuild()
-            if self.scene(): self.scene().update_connectors(self)
+            self.set_properties({'font_family': font.family(), 'font_size': font.pointSize()})
 
     def change_color_settings(self):
         color = QColorDialog.getColor(self.text_color, None, "选择颜色")
         if color.isValid():
-            self.text_color = color
-            self.rebuild()
+            self.set_properties({'text_color': color})
     
     def change_chars_per_column_settings(self):
         """设置每列字符数"""
         chars_count, ok = QInputDialog.getInt(None, "设置每列字符数", "每列字符数", self.chars_per_column, 5, 50)
         if ok:
-            self.chars_per_column = chars_count
-            self.rebuild()
-            if self.scene(): 
-                self.scene().update_connectors(self)
+            self.set_properties({'chars_per_column': chars_count})
     
     def change_column_spacing_settings(self):
         """设置列间距"""
         spacing, ok = QInputDialog.getInt(None, "设置列间距", "列间距 (像素):", self.column_spacing, 0, 200)
         if ok:
-            self.column_spacing = spacing
-            self.rebuild()
-            if self.scene():
-                self.scene().update_connectors(self)
+            self.set_properties({'column_spacing': spacing})
             print(f"列间距已设置为: {self.column_spacing}px")
     
     def toggle_connection_point(self):
@@ -2544,22 +4373,67 @@ class VTextItem(BaseElement):
 
 class VImageItem(BaseElement):
     """Image Item that fits into columns"""
-    def __init__(self, path, target_width=DEFAULT_FONT_SIZE):
+    def __init__(self, path, target_width=DEFAULT_FONT_SIZE, materialized=True):
+        """materialized 为False时只读取图片尺寸、不解码图片（加载工程时由场景按需创建）"""
         super().__init__()
+        self.materialized = materialized
         self.file_path = path
         self.target_width = target_width
         self.connection_point = None 
         
-        pix = QPixmap(path)
-        if not pix.isNull():
-            ratio = pix.height() / pix.width()
+        self.p_item = None
+        self.source_image = None  # 导出时绘制的原图（不使用按屏幕尺寸缩小的图片）
+        
+        if materialized:
+            pix = ProjectBundle.load_pixmap(path)
+            size = pix.size()
+        else:
+            pix = None
+            size = ProjectBundle.image_size(path)
+        if not size.isEmpty():
+            ratio = size.height() / size.width()
             target_h = target_width * ratio
-            self.p_item = QGraphicsPixmapItem(pix.scaled(int(target_width), int(target_h), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
-            self.p_item.setParentItem(self)
             self._rect = QRectF(0, 0, target_width, target_h)
+            if pix is not None:
+                self.set_pixmap(pix)
         
         self.create_connection_point()
     
+    def set_pixmap(self, pix):
+        """按目标尺寸缩放并显示图片"""
+        self.p_item = QGraphicsPixmapItem(pix.scaled(int(self._rect.width()), int(self._rect.height()), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
+        self.p_item.setParentItem(self)
+    
+    def materialize(self):
+        if not self.materialized:
+            super().materialize()
+            pix = ProjectBundle.load_pixmap(self.file_path)
+            if not pix.isNull():
+                self.set_pixmap(pix)
+    
+    def dematerialize(self):
+        if self.materialized:
+            super().dematerialize()
+            if self.p_item is not None:
+                if self.scene():
+                    self.scene().removeItem(self.p_item)
+                else:
+                    self.p_item.setParentItem(None)
+                self.p_item = None
+    
+    def set_source_image(self, image):
+        """导出期间改为直接绘制原图；传入None恢复显示缩放后的图片"""
+        self.source_image = image
+        if self.p_item is not None:
+            self.p_item.setVisible(image is None)
+        self.update()
+    
+    def paint(self, painter, option, widget):
+        if self.source_image is not None:
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            painter.drawImage(self._rect, self.source_image)
+        super().paint(painter, option, widget)
+    
     def create_connection_point(self):
         """创建图片的连接点(顶部中点)"""
         if not self.connection_point:
@@ -2591,7 +4465,7 @@ class VImageItem(BaseElement):
 # --- Canvas & Scene ---
 
 class LayoutScene(QGraphicsScene):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, asset_manager=None, config_manager=None):
         super().__init__(parent)
         self.setBackgroundBrush(QBrush(QColor(45, 45, 48))) 
         self.grid_pen = QPen(QColor(220, 220, 220, 100))
@@ -2601,18 +4475,41 @@ class LayoutScene(QGraphicsScene):
         self.show_grid = True  
         self.show_connectors = True  
         self.show_image_text_connectors = True  
-        self.undo_stack = UndoStack()  
         self.clipboard_items = []  
         self.clipboard_image_text_connections = []  
         self.show_connection_points = True  
         self.connection_mode = False  
         self.connection_source_point = None  
-        self.asset_manager = AssetManager()
-        self.config_manager = ConfigManager()  # 配置管理器
+        self.connection_dragging = False  # 是否正在从连接点拖拽连线
+        self.connection_press_pos = QPointF()
+        self.connection_point_grid = None  # 连线期间的连接点空间哈希
+        self.connection_snap_target = None  # 当前吸附的目标连接点
+        self.connection_preview = None  # 连线预览曲线
+        # 新建场景（如加载工程）时可复用已有的素材库和配置；素材库在首次使用时才创建（命令行渲染用不到）
+        self._asset_manager = asset_manager
+        self.config_manager = config_manager if config_manager is not None else ConfigManager()  # 配置管理器
+        self.undo_stack = UndoStack(self.config_manager.get('undo_budget_mb', 64) * 1024 * 1024)
         self.image_text_binding_mode = False  
         self.image_text_source = None
         self.selection_order = []  # 记录选中顺序
         self.background_pixmap = None  # 背景图片缓存
+        self.background_scaled = None  # (缓存键, 缩放后的背景图片)
+        self.element_index = SpatialGrid()  # 元素空间索引（只含排版元素，不含字形等子项）
+        self.obstacle_routing = False  # 连线是否绕开元素走折线
+        self.router = ConnectorRouter(self)
+        self.pending_reroute = set()  # 等待重新绕行的连线
+        self.bulk_building = False  # 批量构建期间暂停空间索引
+        self.exporting = False  # 导出绘制期间不画网格、父子连线、连接点和选中框
+        self.connector_batch_depth = 0  # 批量连接器维护的嵌套层数（组合命令期间大于0）
+        self.connector_index = None  # 批量期间：元素 -> 相关连接器
+        self.batch_removed = set()  # 批量期间标记删除的连接器
+        self.batch_reroute = {}  # 批量期间需要重新计算路径的连接器（有序）
+        self.drag_start_positions = {}  # 拖动开始时被拖动元素的场景坐标
+        self.virtualized = False  # 虚拟化显示：只为可见区域附近的元素创建字形和图片
+        self.virtual_region = None  # 最近一次可见区域（已外扩）
+        self.materialized_seen = {}  # 元素 -> 最近一次出现在可见区域附近的时间
+        self.evict_timer = QTimer(self)
+        self.evict_timer.timeout.connect(self.evict_offscreen)
         
         # 连接选择改变信号
         self.selectionChanged.connect(self.on_selection_changed_track)
@@ -2620,6 +4517,48 @@ class LayoutScene(QGraphicsScene):
         # 加载背景图片
         self.load_background_image()
 
+    @property
+    def asset_manager(self):
+        if self._asset_manager is None:
+            self._asset_manager = AssetManager()
+        return self._asset_manager
+    
+    def begin_export(self, source_images=False, rect=None):
+        """进入导出绘制状态：不画网格、父子连线、连接点、连线预览和选中框，选中的连接线按基础颜色绘制。
+        只切换绘制标志、不改动元素的可见性和选中状态，编辑中的场景不会闪烁；返回值交给 end_export 恢复。
+        source_images 为True时 rect 区域（默认全部）内的图片元素改为绘制原始分辨率的原图（用于矢量输出），
+        同一路径只解码一次；PNG分块导出不经过这里，由 TiledImageExporter 在工作线程中按输出尺寸缩放"""
+        self.exporting = True
+        replaced = []
+        if source_images:
+            sources = {}
+            items = self.element_index if rect is None else self.element_index.query_rect(rect)
+            for item in items:
+                if not isinstance(item, VImageItem):
+                    continue
+                if item.file_path not in sources:
+                    sources[item.file_path] = ProjectBundle.load_pixmap(item.file_path).toImage()
+                image = sources[item.file_path]
+                if image.isNull():
+                    continue
+                item.set_source_image(image)
+                replaced.append(item)
+        return replaced
+    
+    def end_export(self, state):
+        """退出导出绘制状态"""
+        self.exporting = False
+        for item in state:
+            item.set_source_image(None)
+    
+    def selected_elements_rect(self):
+        """选中元素（含子元素）的场景包围矩形，没有选中元素时返回空矩形"""
+        rect = QRectF()
+        for item in self.selectedItems():
+            if isinstance(item, BaseElement):
+                rect = rect.united(item.sceneBoundingRect()).united(item.mapRectToScene(item.childrenBoundingRect()))
+        return rect
+    
     def load_background_image(self):
         """加载背景图片"""
         bg_path = self.config_manager.get('default_background_image', '')
@@ -2661,7 +4600,7 @@ class LayoutScene(QGraphicsScene):
         painter.fillRect(canvas_rect, QColor(250, 250, 245))
         
         # 绘制网格（在背景图片之前）
-        if self.show_grid:
+        if self.show_grid and not self.exporting:
             painter.setPen(self.grid_pen)
             c_left = int(canvas_rect.left())
             c_right = int(canvas_rect.right())
@@ -2684,11 +4623,7 @@ class LayoutScene(QGraphicsScene):
             
             if scale_mode == 'fit':
                 # 适应画布，保持宽高比
-                scaled_pixmap = self.background_pixmap.scaled(
-                    canvas_rect.size().toSize(),
-                    Qt.AspectRatioMode.KeepAspectRatio,
-                    Qt.TransformationMode.SmoothTransformation
-                )
+                scaled_pixmap = self.scaled_background(canvas_rect.size().toSize(), Qt.AspectRatioMode.KeepAspectRatio)
                 # 居中绘制
                 x = canvas_rect.x() + (canvas_rect.width() - scaled_pixmap.width()) / 2
                 y = canvas_rect.y() + (canvas_rect.height() - scaled_pixmap.height()) / 2
@@ -2696,22 +4631,14 @@ class LayoutScene(QGraphicsScene):
             
             elif scale_mode == 'fill':
                 # 填充画布，保持宽高比，可能裁剪
-                scaled_pixmap = self.background_pixmap.scaled(
-                    canvas_rect.size().toSize(),
-                    Qt.AspectRatioMode.KeepAspectRatioByExpanding,
-                    Qt.TransformationMode.SmoothTransformation
-                )
+                scaled_pixmap = self.scaled_background(canvas_rect.size().toSize(), Qt.AspectRatioMode.KeepAspectRatioByExpanding)
                 x = canvas_rect.x() + (canvas_rect.width() - scaled_pixmap.width()) / 2
                 y = canvas_rect.y() + (canvas_rect.height() - scaled_pixmap.height()) / 2
                 painter.drawPixmap(int(x), int(y), scaled_pixmap)
             
             elif scale_mode == 'stretch':
                 # 拉伸填充，不保持宽高比
-                scaled_pixmap = self.background_pixmap.scaled(
-                    canvas_rect.size().toSize(),
-                    Qt.AspectRatioMode.IgnoreAspectRatio,
-                    Qt.TransformationMode.SmoothTransformation
-                )
+                scaled_pixmap = self.scaled_background(canvas_rect.size().toSize(), Qt.AspectRatioMode.IgnoreAspectRatio)
                 painter.drawPixmap(canvas_rect.toRect(), scaled_pixmap)
             
             elif scale_mode == 'tile':
@@ -2725,6 +4652,163 @@ class LayoutScene(QGraphicsScene):
         painter.setPen(QPen(QColor(180, 180, 180), 1))
         painter.drawRect(canvas_rect)
     
+    def scaled_background(self, size, aspect_mode):
+        """缩放后的背景图片；结果会被缓存，分块或分页导出时不必每块重新缩放，PDF中也只嵌入一次"""
+        key = (self.background_pixmap.cacheKey(), size.width(), size.height(), aspect_mode)
+        if self.background_scaled is None or self.background_scaled[0] != key:
+            pixmap = self.background_pixmap.scaled(size, aspect_mode, Qt.TransformationMode.SmoothTransformation)
+            self.background_scaled = (key, pixmap)
+        return self.background_scaled[1]
+    
+    # --- 元素空间索引 ---
+    def index_element(self, item):
+        """将元素加入空间索引"""
+        if self.bulk_building:
+            return
+        rect = item.sceneBoundingRect()
+        self.element_index.insert(item, rect)
+        if self.virtualized:
+            if self.virtual_region is not None and self.virtual_region.intersects(rect):
+                item.materialize()
+                self.materialized_seen[item] = time.monotonic()
+            else:
+                item.dematerialize()
+    
+    def unindex_element(self, item):
+        """从空间索引中移除元素"""
+        self.element_index.remove(item)
+    
+    def update_element_index(self, item):
+        """元素移动或尺寸改变后更新索引（子元素随父级移动，一并更新）"""
+        if item in self.element_index:
+            new_rect = item.sceneBoundingRect()
+            old_rect = self.element_index.update(item, new_rect)
+            if self.obstacle_routing and self.router.corridors:
+                # 只重路由走廊经过元素新旧位置的连线
+                crossing = self.router.connectors_crossing(new_rect)
+                if old_rect is not None:
+                    crossing |= self.router.connectors_crossing(old_rect)
+                self.schedule_reroute(crossing)
+        for child in item.child_elements():
+            self.update_element_index(child)
+    
+    def begin_bulk_build(self):
+        """开始批量构建：暂停Qt的BSP索引和元素空间索引，结束时一次性重建"""
+        self.bulk_building = True
+        self.setItemIndexMethod(QGraphicsScene.ItemIndexMethod.NoIndex)
+    
+    def end_bulk_build(self):
+        """结束批量构建并重建索引"""
+        self.bulk_building = False
+        self.setItemIndexMethod(QGraphicsScene.ItemIndexMethod.BspTreeIndex)
+        self.rebuild_element_index()
+    
+    def inherit_settings(self, other):
+        """从另一个场景继承显示设置（用于替换场景）"""
+        self.setSceneRect(other.sceneRect())
+        self.show_grid = other.show_grid
+        self.show_connectors = other.show_connectors
+        self.show_image_text_connectors = other.show_image_text_connectors
+        self.show_connection_points = other.show_connection_points
+        self.obstacle_routing = other.obstacle_routing
+        self.set_virtualized(other.virtualized)
+        self.background_pixmap = other.background_pixmap
+        self.clipboard_items = other.clipboard_items
+        self.clipboard_image_text_connections = other.clipboard_image_text_connections
+    
+    def set_virtualized(self, enabled, visible_rect=None):
+        """切换虚拟化显示"""
+        self.virtualized = enabled
+        self.materialized_seen.clear()
+        if enabled:
+            self.evict_timer.start(2000)
+            self.virtual_region = None
+            if visible_rect is not None:
+                self.update_materialized(visible_rect)
+            for item in self.element_index:
+                if item not in self.materialized_seen:
+                    item.dematerialize()
+        else:
+            self.evict_timer.stop()
+            self.virtual_region = None
+            for item in self.element_index:
+                item.materialize()
+    
+    def update_materialized(self, visible_rect):
+        """视图可见区域变化：为可见区域附近的元素创建字形和图片"""
+        if not self.virtualized:
+            return
+        region = visible_rect.adjusted(-VIRTUAL_MARGIN, -VIRTUAL_MARGIN, VIRTUAL_MARGIN, VIRTUAL_MARGIN)
+        self.virtual_region = region
+        now = time.monotonic()
+        for item in self.element_index.query_rect(region):
+            item.materialize()
+            self.materialized_seen[item] = now
+    
+    def evict_offscreen(self):
+        """释放离开可见区域已超过一段时间的元素的字形和图片"""
+        now = time.monotonic()
+        region = self.virtual_region
+        for item, seen in list(self.materialized_seen.items()):
+            if item.scene() is not self:
+                del self.materialized_seen[item]
+            elif region is not None and region.intersects(item.sceneBoundingRect()):
+                self.materialized_seen[item] = now
+            elif now - seen > VIRTUAL_EVICT_DELAY:
+                item.dematerialize()
+                del self.materialized_seen[item]
+    
+    def ensure_materialized(self, rect=None):
+        """导出等需要完整绘制时，先创建指定区域（默认全部）元素的字形和图片"""
+        if not self.virtualized:
+            return
+        items = self.element_index if rect is None else self.element_index.query_rect(rect)
+        now = time.monotonic()
+        for item in list(items):
+            item.materialize()
+            self.materialized_seen[item] = now
+    
+    def rebuild_element_index(self):
+        """重建空间索引"""
+        self.element_index.clear()
+        for item in self.items():
+            if isinstance(item, BaseElement):
+                self.index_element(item)
+    
+    def element_at(self, pos):
+        """获取指定场景坐标处最上层的元素"""
+        hits = self.element_index.query_point(pos.x(), pos.y())
+        if not hits:
+            return None
+        
+        def stacking_key(item):
+            depth = 0
+            top = item
+            while isinstance(top.parentItem(), BaseElement):
+                top = top.parentItem()
+                depth += 1
+            return (top.zValue(), depth, item.zValue())
+        return max(hits, key=stacking_key)
+    
+    def elements_in_rect(self, rect):
+        """获取与矩形相交的所有元素"""
+        return list(self.element_index.query_rect(rect))
+    
+    def nearest_elements(self, pos, k=1, max_distance=None, predicate=None):
+        """按距离由近到远获取最多k个元素"""
+        return [item for _, item in self.element_index.nearest(pos.x(), pos.y(), k, max_distance, predicate)]
+    
+    def clear(self):
+        """清空场景，同时重置索引和连接线列表"""
+        self.element_index.clear()
+        self.materialized_seen.clear()
+        self.router.clear()
+        self.pending_reroute.clear()
+        self.connectors = []
+        self.image_text_connectors = []
+        self.selection_order = []
+        super().clear()
+    
     def on_selection_changed_track(self):
         """追踪选中顺序"""
         current_selected = set(self.selectedItems())
@@ -2752,9 +4836,7 @@ class LayoutScene(QGraphicsScene):
 
     def mousePressEvent(self, event):
         if self.binding_source:
-            item = self.itemAt(event.scenePos(), QTransform())
-            while item and not isinstance(item, BaseElement):
-                item = item.parentItem()
+            item = self.element_at(event.scenePos())
             
             if item and item != self.binding_source:
                 # 获取旧的父级
@@ -2770,9 +4852,7 @@ class LayoutScene(QGraphicsScene):
             return
         
         if self.image_text_binding_mode:
-            item = self.itemAt(event.scenePos(), QTransform())
-            while item and not isinstance(item, BaseElement):
-                item = item.parentItem()
+            item = self.element_at(event.scenePos())
             
             if item and item != self.image_text_source:
                 source_is_image = isinstance(self.image_text_source, VImageItem)
@@ -2792,40 +4872,300 @@ class LayoutScene(QGraphicsScene):
             self.image_text_source = None
             if self.views(): self.views()[0].setCursor(Qt.CursorShape.ArrowCursor)
             return
+        
+        if self.connection_mode and not self.connection_dragging and event.button() == Qt.MouseButton.LeftButton:
+            # 点击模式：在吸附半径内点击即可完成连接
+            target = self.find_snap_target(event.scenePos())
+            if target is not None:
+                self.finish_connection(target)
+                event.accept()
+                return
             
         super().mousePressEvent(event)
+    
+    def mouseMoveEvent(self, event):
+        if self.connection_mode:
+            self.update_connection_preview(event.scenePos())
+        if len(self.drag_start_positions) > 1:
+            # 拖动多个元素：整组移动后统一更新连线，而不是每个元素各扫描一遍
+            self.begin_connector_batch()
+            try:
+                super().mouseMoveEvent(event)
+            finally:
+                self.end_connector_batch()
+            return
+        super().mouseMoveEvent(event)
+    
+    @staticmethod
+    def top_level_elements(items):
+        """去掉祖先也在集合中的元素（它们随祖先一起移动）"""
+        items = set(items)
+        result = []
+        for item in items:
+            parent = item.parentItem()
+            while parent is not None and parent not in items:
+                parent = parent.parentItem()
+            if parent is None:
+                result.append(item)
+        return result
+    
+    def begin_drag_move(self, item):
+        """元素上按下鼠标：记录将被一起拖动的元素的起始位置"""
+        items = [i for i in self.selectedItems() if isinstance(i, BaseElement)]
+        if item not in items:
+            items.append(item)
+        self.drag_start_positions = {i: i.scenePos() for i in self.top_level_elements(items)}
+    
+    def finish_drag_move(self):
+        """松开鼠标：把实际发生的移动记录为一条命令"""
+        starts, self.drag_start_positions = self.drag_start_positions, {}
+        # 只有当移动距离足够大时才记录，避免误触
+        moves = {item: (old_pos, item.scenePos()) for item, old_pos in starts.items()
+                 if item.scene() is self and (item.scenePos() - old_pos).manhattanLength() > 2.0}
+        if moves:
+            self.undo_stack.push(MoveItemsCommand(self, moves))
+    
+    def nudge_selected(self, dx, dy):
+        """方向键微调选中元素；连续微调合并为一步撤销"""
+        items = self.top_level_elements(i for i in self.selectedItems() if isinstance(i, BaseElement))
+        if not items:
+            return
+        moves = {item: (item.scenePos(), item.scenePos() + QPointF(dx, dy)) for item in items}
+        self.undo_stack.push(MoveItemsCommand(self, moves))
+    
+    def mouseReleaseEvent(self, event):
+        if self.connection_dragging and event.button() == Qt.MouseButton.LeftButton:
+            self.connection_dragging = False
+            if (event.scenePos() - self.connection_press_pos).manhattanLength() > 4:
+                # 拖拽松开：吸附到连接点则完成连接，否则取消
+                target = self.find_snap_target(event.scenePos())
+                if target is not None:
+                    self.finish_connection(target)
+                else:
+                    self.cancel_connection_mode()
+        super().mouseReleaseEvent(event)
+
+    # --- 批量连接器维护 ---
+    @staticmethod
+    def connector_ends(conn):
+        """连接器两端的元素"""
+        return conn.endpoints()
+    
+    def begin_connector_batch(self):
+        """开始批量操作（可嵌套）：建立元素到连接器的索引。期间删除连接器只做标记、连线更新只做记录，
+        end_connector_batch 时一次性移除并统一计算路径，多选删除、粘贴等不必每个元素都扫描整个连接器列表"""
+        self.connector_batch_depth += 1
+        if self.connector_batch_depth > 1:
+            return
+        self.connector_index = {}
+        for conn in self.connectors + self.image_text_connectors:
+            self.index_connector(conn)
+        self.batch_removed = set()
+        self.batch_reroute = {}
+    
+    def end_connector_batch(self):
+        self.connector_batch_depth -= 1
+        if self.connector_batch_depth > 0:
+            return
+        removed = self.batch_removed
+        if removed:
+            for conn in removed:
+                self.router.forget(conn)
+                if conn.scene() is self:
+                    self.removeItem(conn)
+            self.connectors = [c for c in self.connectors if c not in removed]
+            self.image_text_connectors = [c for c in self.image_text_connectors if c not in removed]
+        reroute = [c for c in self.batch_reroute if c not in removed]
+        self.connector_index = None
+        self.batch_removed = set()
+        self.batch_reroute = {}
+        self.route_connectors(reroute)
+    
+    def index_connector(self, conn):
+        """批量期间把新连接器登记到索引"""
+        for item in self.connector_ends(conn):
+            self.connector_index.setdefault(item, []).append(conn)
+    
+    def connectors_for_item(self, item):
+        """与元素相关的连接器：(父子连接器列表, 图文/通用连接器列表)"""
+        if self.connector_index is not None:
+            related = [c for c in self.connector_index.get(item, ()) if c not in self.batch_removed]
+        else:
+            related = [c for c in self.connectors if c.parent_element == item or c.child_element == item]
+            related += [c for c in self.image_text_connectors if item in self.connector_ends(c)]
+        return ([c for c in related if isinstance(c, VConnector)],
+                [c for c in related if not isinstance(c, VConnector)])
+    
+    def discard_connectors(self, connectors):
+        """批量期间标记删除连接器，end_connector_batch 时统一移除"""
+        self.batch_removed.update(connectors)
+
+    def detach_element(self, item):
+        """把元素连同子元素和所有相关连接器从场景中摘下（对象本身保持不变），
+        返回 reattach_element 所需的记录；元素已不在本场景中（如随已删除的祖先一起摘下）时什么也不做，返回None"""
+        if item.scene() is not self:
+            return None
+        elements = [item]
+        for element in elements:
+            elements.extend(element.child_elements())  # 不遍历字形等数量很大的子项
+        if self.connector_index is not None:
+            related = {}
+            for element in elements:
+                for conn in self.connector_index.get(element, ()):
+                    if conn not in self.batch_removed:
+                        related[conn] = None
+            connectors = list(related)
+            self.discard_connectors(connectors)
+        else:
+            members = set(elements)
+            connectors = [c for c in self.connectors + self.image_text_connectors
+                          if not members.isdisjoint(self.connector_ends(c))]
+            for conn in connectors:
+                self.router.forget(conn)
+                self.removeItem(conn)
+            if connectors:
+                removed = set(connectors)
+                self.connectors = [c for c in self.connectors if c not in removed]
+                self.image_text_connectors = [c for c in self.image_text_connectors if c not in removed]
+        parent = item.parentItem() if isinstance(item.parentItem(), BaseElement) else None
+        scene_pos = item.scenePos()
+        self.removeItem(item)
+        return parent, scene_pos, connectors
+
+    def reattach_element(self, item, record):
+        """把 detach_element 摘下的元素和连接器原样挂回，不重建元素也不重新计算连线"""
+        if record is None:
+            return
+        parent, scene_pos, connectors = record
+        if parent is not None and parent.scene() is self:
+            item.setParentItem(parent)  # pos 仍是相对原父级的本地坐标
+        else:
+            item.setPos(scene_pos)
+            self.addItem(item)
+        for conn in connectors:
+            if conn in self.batch_removed:
+                # 同一批量内先摘后挂：连接器仍在列表和场景中，取消标记即可
+                self.batch_removed.discard(conn)
+                continue
+            if any(end.scene() is not self for end in self.connector_ends(conn)):
+                continue  # 另一端已不在场景中
+            self.addItem(conn)
+            if isinstance(conn, VConnector):
+                self.connectors.append(conn)
+                conn.setVisible(self.show_connectors)
+            else:
+                self.image_text_connectors.append(conn)
+                conn.setVisible(self.show_image_text_connectors)
+            if self.connector_index is not None:
+                self.index_connector(conn)
+        if parent is not None and parent.scene() is not self:
+            # 原父级已不在场景中：位置变了，相关连线需要重算
+            self.update_connectors(item)
+            self.update_image_text_connectors(item)
 
     def add_connector(self, parent, child):
         self.remove_child_connectors(child)
         conn = VConnector(parent, child)
         self.addItem(conn)
         self.connectors.append(conn)
-        conn.update_path()
         conn.setVisible(self.show_connectors)
+        if self.connector_index is not None:
+            self.index_connector(conn)
+            self.batch_reroute[conn] = None
+        else:
+            conn.update_path()
 
     def remove_child_connectors(self, child):
+        if self.connector_index is not None:
+            self.discard_connectors([c for c in self.connectors_for_item(child)[0] if c.child_element == child])
+            return
         to_rem = [c for c in self.connectors if c.child_element == child]
         for c in to_rem:
+            self.router.forget(c)
             self.removeItem(c)
             self.connectors.remove(c)
     
     def remove_all_connectors_for_item(self, item):
         """移除与指定元素相关的所有连接器（父子关系连接器）"""
+        if self.connector_index is not None:
+            self.discard_connectors(self.connectors_for_item(item)[0])
+            return
         to_rem = [c for c in self.connectors if c.parent_element == item or c.child_element == item]
         for c in to_rem:
+            self.router.forget(c)
             self.removeItem(c)
             self.connectors.remove(c)
 
     def update_connectors(self, item_moved):
+        if self.connector_index is not None:
+            for c in self.connectors_for_item(item_moved)[0]:
+                self.batch_reroute[c] = None
+            return
         for c in self.connectors:
             if c.parent_element == item_moved or c.child_element == item_moved:
                 c.update_path()
 
     def update_all_connectors(self):
+        self.route_connectors(self.connectors)
         for c in self.connectors:
-            c.update_path()
             c.setVisible(self.show_connectors)
     
+    def route_connectors(self, connectors):
+        """批量计算连接线路径：先收集所有端点，再统一计算控制点并回写"""
+        if self.obstacle_routing:
+            for conn in connectors:
+                conn.update_path()
+            return
+        
+        groups = {}  # curve_style -> [(connector, anchor1, anchor2)]
+        for conn in connectors:
+            anchors = conn.get_anchors()
+            if anchors is not None:
+                groups.setdefault(conn.curve_style, []).append((conn, anchors[0], anchors[1]))
+        
+        for style, entries in groups.items():
+            starts = [(a1.x(), a1.y()) for _, a1, _ in entries]
+            ends = [(a2.x(), a2.y()) for _, _, a2 in entries]
+            controls = compute_curve_controls(starts, ends, *style)
+            for (conn, a1, a2), (ctrl1, ctrl2) in zip(entries, controls):
+                conn.set_curve(a1, ctrl1, ctrl2, a2)
+    
+    def route_around_obstacles(self, conn):
+        """用路由器为连线计算绕开元素的折线"""
+        anchors = conn.get_anchors()
+        if anchors is None:
+            return
+        start_dir, end_dir = conn.anchor_directions()
+        points = self.router.route(conn, anchors[0], anchors[1], start_dir, end_dir, conn.endpoints())
+        conn.set_polyline(points)
+    
+    def schedule_reroute(self, connectors):
+        """合并同一轮事件中的重路由请求，回到事件循环后统一处理"""
+        if not connectors:
+            return
+        if not self.pending_reroute:
+            QTimer.singleShot(0, self.flush_reroute)
+        self.pending_reroute.update(connectors)
+    
+    def flush_reroute(self):
+        """重新绕行受元素移动影响的连线"""
+        pending = self.pending_reroute
+        self.pending_reroute = set()
+        if not self.obstacle_routing:
+            return
+        for conn in pending:
+            self.router.forget(conn)
+            if conn.scene() is self:
+                conn.update_path()
+    
+    def set_obstacle_routing(self, enabled):
+        """切换连线绕开元素走线"""
+        self.obstacle_routing = enabled
+        self.router.clear()
+        self.pending_reroute.clear()
+        self.route_connectors(self.connectors)
+        self.route_connectors(self.image_text_connectors)
+    
     def set_connectors_visible(self, visible):
         """控制所有连接器的可见性"""
         self.show_connectors = visible
@@ -2845,28 +5185,103 @@ class LayoutScene(QGraphicsScene):
             if isinstance(item, (VTextItem, VImageItem)):
                 item.set_connection_points_visible(visible)
     
-    def start_connection_from_point(self, point):
-        """从连接点开始连接"""
+    def start_connection_from_point(self, point, press_pos=None):
+        """从连接点开始连接：按住拖拽到目标连接点附近松开，或先后点击两个连接点"""
         if self.connection_mode and self.connection_source_point:
-            self.complete_connection(self.connection_source_point, point)
-            self.connection_mode = False
-            self.connection_source_point = None
-            if self.views():
-                self.views()[0].setCursor(Qt.CursorShape.ArrowCursor)
-        else:
-            self.connection_mode = True
-            self.connection_source_point = point
-            if self.views():
-                self.views()[0].setCursor(Qt.CursorShape.CrossCursor)
-            print("连接模式：点击另一个连接点完成连接，或按ESC键取消")
+            self.finish_connection(point)
+            return
+        
+        self.connection_mode = True
+        self.connection_source_point = point
+        self.connection_dragging = True
+        self.connection_press_pos = press_pos if press_pos is not None else point.get_scene_center()
+        self.build_connection_point_grid()
+        
+        self.connection_preview = ConnectionPreviewItem()
+        pen = QPen(QColor(255, 140, 0, 220), DEFAULT_LINE_WIDTH, Qt.PenStyle.DashLine)
+        self.connection_preview.setPen(pen)
+        self.connection_preview.setZValue(200)
+        self.addItem(self.connection_preview)
+        self.update_connection_preview(self.connection_press_pos)
+        
+        if self.views():
+            self.views()[0].setCursor(Qt.CursorShape.CrossCursor)
+        print("连接模式：拖拽到另一个连接点附近松开，或点击另一个连接点完成连接，按ESC键取消")
+    
+    def build_connection_point_grid(self):
+        """为当前场景中可见的连接点建立空间哈希，用于拖拽时快速查找吸附目标"""
+        grid = SpatialGrid(cell_size=64)
+        for item in self.element_index:
+            point = item.connection_point
+            if point is not None and point.isVisible():
+                center = point.get_scene_center()
+                grid.insert(point, QRectF(center, center))
+        self.connection_point_grid = grid
+    
+    def find_snap_target(self, pos):
+        """查找吸附半径内最近的可连接连接点"""
+        source = self.connection_source_point
+        if source is None or self.connection_point_grid is None:
+            return None
+        hits = self.connection_point_grid.nearest(
+            pos.x(), pos.y(), 1, CONNECTION_SNAP_RADIUS,
+            lambda point: point.parent_element is not source.parent_element
+        )
+        return hits[0][1] if hits else None
+    
+    def update_connection_preview(self, pos):
+        """更新连线预览曲线，附近有连接点时吸附过去"""
+        source = self.connection_source_point
+        if source is None or self.connection_preview is None:
+            return
+        
+        target = self.find_snap_target(pos)
+        if target is not self.connection_snap_target:
+            if self.connection_snap_target is not None:
+                self.connection_snap_target.set_highlighted(False)
+            if target is not None:
+                target.set_highlighted(True)
+            self.connection_snap_target = target
+        
+        start = source.get_scene_center()
+        end = target.get_scene_center() if target is not None else pos
+        image_text = target is not None and {type(source.parent_element), type(target.parent_element)} == {VImageItem, VTextItem}
+        if image_text and isinstance(target.parent_element, VImageItem):
+            start, end = end, start
+        style = CURVE_STYLE_IMAGE_TEXT if image_text else CURVE_STYLE_GENERIC
+        ctrl1, ctrl2 = curve_controls(start.x(), start.y(), end.x(), end.y(), *style)
+        
+        path = QPainterPath()
+        path.moveTo(start)
+        path.cubicTo(QPointF(*ctrl1), QPointF(*ctrl2), end)
+        self.connection_preview.setPath(path)
+    
+    def finish_connection(self, target_point):
+        """以目标连接点完成连接并退出连接模式"""
+        source_point = self.connection_source_point
+        self.end_connection_mode()
+        if source_point is not None and target_point is not None:
+            self.complete_connection(source_point, target_point)
+    
+    def end_connection_mode(self):
+        """退出连接模式并清理预览"""
+        if self.connection_snap_target is not None:
+            self.connection_snap_target.set_highlighted(False)
+        if self.connection_preview is not None:
+            self.removeItem(self.connection_preview)
+        self.connection_mode = False
+        self.connection_dragging = False
+        self.connection_source_point = None
+        self.connection_snap_target = None
+        self.connection_point_grid = None
+        self.connection_preview = None
+        if self.views():
+            self.views()[0].setCursor(Qt.CursorShape.ArrowCursor)
     
     def cancel_connection_mode(self):
         """取消连接模式"""
         if self.connection_mode:
-            self.connection_mode = False
-            self.connection_source_point = None
-            if self.views():
-                self.views()[0].setCursor(Qt.CursorShape.ArrowCursor)
+            self.end_connection_mode()
             print("已取消连接模式")
     
     def complete_connection(self, source_point, target_point):
@@ -3028,6 +5443,9 @@ class LayoutScene(QGraphicsScene):
     
     def remove_image_text_connectors(self, item):
         """移除与指定元素相关的所有连接线"""
+        if self.connector_index is not None:
+            self.discard_connectors(self.connectors_for_item(item)[1])
+            return
         to_remove = []
         for conn in self.image_text_connectors:
             # 检查图文连接器
@@ -3040,11 +5458,16 @@ class LayoutScene(QGraphicsScene):
                     to_remove.append(conn)
         
         for conn in to_remove:
+            self.router.forget(conn)
             self.removeItem(conn)
             self.image_text_connectors.remove(conn)
     
     def update_image_text_connectors(self, item):
         """更新与指定元素相关的所有连接线"""
+        if self.connector_index is not None:
+            for conn in self.connectors_for_item(item)[1]:
+                self.batch_reroute[conn] = None
+            return
         for conn in self.image_text_connectors:
             # 检查图文连接器
             if hasattr(conn, 'image_item') and hasattr(conn, 'text_item'):
@@ -3057,8 +5480,8 @@ class LayoutScene(QGraphicsScene):
     
     def update_all_image_text_connectors(self):
         """更新所有图文连接器"""
+        self.route_connectors(self.image_text_connectors)
         for conn in self.image_text_connectors:
-            conn.update_path()
             conn.setVisible(self.show_image_text_connectors)
     
     def auto_connect_selected_items(self):
@@ -3223,6 +5646,103 @@ class LayoutScene(QGraphicsScene):
                     connections_made += 1
         print(f"按位置创建了 {connections_made} 个图文连接")
     
+    def connect_nearest(self, items=None, max_distance=None, direction=None):
+        """就近连接：每张图片连接离它最近的文字，未连接的文字再连接离它最近的图片
+        direction: 'below' 文字在图片下方, 'above' 文字在图片上方, 'any' 不限方向
+        """
+        if items is None:
+            items = self.selectedItems()
+        images = [item for item in items if isinstance(item, VImageItem)]
+        texts = [item for item in items if isinstance(item, VTextItem)]
+        if not images or not texts:
+            print("请同时选中图片和文字")
+            return 0
+        if max_distance is None:
+            max_distance = self.config_manager.get('auto_connect_max_distance', 300)
+        if direction is None:
+            direction = self.config_manager.get('auto_connect_direction', 'below')
+        
+        image_index = SpatialGrid()
+        for img in images:
+            image_index.insert(img, img.sceneBoundingRect())
+        text_index = SpatialGrid()
+        for text in texts:
+            text_index.insert(text, text.sceneBoundingRect())
+        
+        def text_matches(img, text):
+            """文字相对图片的方向是否满足约束"""
+            img_y = img.anchor_center().y()
+            text_y = text.anchor_center().y()
+            if direction == 'below':
+                return text_y > img_y
+            if direction == 'above':
+                return text_y < img_y
+            return True
+        
+        def image_probe(img):
+            if direction == 'below':
+                return img.anchor_bottom()
+            if direction == 'above':
+                return img.anchor_top()
+            return img.anchor_center()
+        
+        def text_probe(text):
+            if direction == 'below':
+                return text.anchor_top()
+            if direction == 'above':
+                return text.anchor_bottom()
+            return text.anchor_center()
+        
+        pairs = []
+        paired_texts = set()
+        for img in images:
+            pos = image_probe(img)
+            hits = text_index.nearest(pos.x(), pos.y(), 1, max_distance, lambda text: text_matches(img, text))
+            if hits:
+                pairs.append((img, hits[0][1]))
+                paired_texts.add(hits[0][1])
+        
+        for text in texts:
+            if text in paired_texts:
+                continue
+            pos = text_probe(text)
+            hits = image_index.nearest(pos.x(), pos.y(), 1, max_distance, lambda img: text_matches(img, text))
+            if hits:
+                pairs.append((hits[0][1], text))
+        
+        created = self.add_image_text_connectors_bulk(pairs)
+        print(f"就近连接完成：创建了 {len(created)} 个图文连接")
+        return len(created)
+    
+    def add_image_text_connectors_bulk(self, pairs):
+        """批量添加图文连接线：一次性去重、创建并统一计算路径"""
+        existing = set()
+        for conn in self.image_text_connectors:
+            if hasattr(conn, 'image_item') and hasattr(conn, 'text_item'):
+                existing.add(frozenset((conn.image_item, conn.text_item)))
+            elif hasattr(conn, 'item1') and hasattr(conn, 'item2'):
+                existing.add(frozenset((conn.item1, conn.item2)))
+        
+        created = []
+        for image_item, text_item in pairs:
+            key = frozenset((image_item, text_item))
+            if key in existing:
+                continue
+            existing.add(key)
+            conn = VImageTextConnector(image_item, text_item)
+            self.addItem(conn)
+            self.image_text_connectors.append(conn)
+            conn.setVisible(self.show_image_text_connectors)
+            created.append(conn)
+        
+        if self.connector_index is not None:
+            for conn in created:
+                self.index_connector(conn)
+                self.batch_reroute[conn] = None
+        else:
+            self.route_connectors(created)
+        return created
+    
     def connect_all_images_to_text(self):
         """将所有选中的图片连接到一个文字"""
         selected = self.selectedItems()
@@ -3249,12 +5769,14 @@ class LayoutScene(QGraphicsScene):
         """移除所有图文连接"""
         count = len(self.image_text_connectors)
         for conn in self.image_text_connectors[:]:
+            self.router.forget(conn)
             self.removeItem(conn)
         self.image_text_connectors.clear()
         print(f"已移除 {count} 个图文连接")
     
     def remove_connector_item(self, connector):
         """删除单个连接线"""
+        self.router.forget(connector)
         if connector in self.image_text_connectors:
             self.removeItem(connector)
             self.image_text_connectors.remove(connector)
@@ -3337,7 +5859,16 @@ class LayoutScene(QGraphicsScene):
             base_x, base_y = pos.x(), pos.y()
         
         new_items = []
-        
+        # 整次粘贴作为一步撤销，连接线在结束时统一计算路径
+        self.undo_stack.begin_macro(self)
+        try:
+            self.paste_clipboard(new_items, min_x, min_y, base_x, base_y)
+        finally:
+            self.undo_stack.end_macro()
+        return new_items
+    
+    def paste_clipboard(self, new_items, min_x, min_y, base_x, base_y):
+        """创建剪贴板中的元素及其父子关系和图文连接（在组合命令中调用）"""
         for idx, item_data in enumerate(self.clipboard_items):
             new_item = None
             if item_data['type'] == 'VTextItem':
@@ -3377,15 +5908,12 @@ class LayoutScene(QGraphicsScene):
             if item_data['parent_index'] != -1 and item_data['parent_index'] < len(new_items):
                 child_item = new_items[idx]
                 parent_item = new_items[item_data['parent_index']]
-                current_scene_pos = child_item.scenePos()
-                child_item.setParentItem(parent_item)
-                child_item.setPos(parent_item.mapFromScene(current_scene_pos))
-                self.add_connector(parent_item, child_item)
+                # 父子关系也记录为命令，撤销/重做整次粘贴时一并恢复
+                self.undo_stack.push(SetParentCommand(self, child_item, parent_item))
         
-        for img_idx, text_idx in self.clipboard_image_text_connections:
-            if img_idx < len(new_items) and text_idx < len(new_items):
-                self.add_image_text_connector(new_items[img_idx], new_items[text_idx])
-        return new_items
+        self.add_image_text_connectors_bulk([(new_items[img_idx], new_items[text_idx])
+                                             for img_idx, text_idx in self.clipboard_image_text_connections
+                                             if img_idx < len(new_items) and text_idx < len(new_items)])
     
     def paste_item(self, pos=None):
         items = self.paste_items(pos)
@@ -3444,12 +5972,27 @@ class LayoutScene(QGraphicsScene):
                 if base_elements: self.copy_items(base_elements)
             elif event.key() == Qt.Key.Key_V:
                 self.paste_items()
+        elif event.key() in (Qt.Key.Key_Left, Qt.Key.Key_Right, Qt.Key.Key_Up, Qt.Key.Key_Down) and \
+                event.modifiers() in (Qt.KeyboardModifier.NoModifier, Qt.KeyboardModifier.ShiftModifier) and \
+                any(isinstance(i, BaseElement) for i in self.selectedItems()):
+            # 方向键微调，按住Shift每次移动10像素
+            step = 10 if event.modifiers() == Qt.KeyboardModifier.ShiftModifier else 1
+            dx = {Qt.Key.Key_Left: -step, Qt.Key.Key_Right: step}.get(event.key(), 0)
+            dy = {Qt.Key.Key_Up: -step, Qt.Key.Key_Down: step}.get(event.key(), 0)
+            self.nudge_selected(dx, dy)
         elif event.key() == Qt.Key.Key_Delete:
             selected = self.selectedItems()
+            # 多个元素的删除合并为一步撤销；祖先也被选中的元素随祖先一起删除，不单独生成命令
+            top_level = set(self.top_level_elements(item for item in selected if isinstance(item, BaseElement)))
+            self.undo_stack.begin_macro(self)
+            try:
+                for item in selected:
+                    if item in top_level:
+                        self.delete_item(item)
+            finally:
+                self.undo_stack.end_macro()
             for item in selected:
-                if isinstance(item, BaseElement):
-                    self.delete_item(item)
-                elif isinstance(item, (VImageTextConnector, VGenericConnector)):
+                if isinstance(item, (VImageTextConnector, VGenericConnector)) and item.scene() is self:
                     # 删除连接线
                     self.remove_connector_item(item)
         else:
@@ -3459,18 +6002,9 @@ class LayoutScene(QGraphicsScene):
         if items is None: items = [item for item in self.selectedItems() if isinstance(item, BaseElement)]
         if len(items) < 2: return
         min_y = min(item.scenePos().y() for item in items)
-        for item in items:
-            current_pos = item.scenePos()
-            new_scene_pos = QPointF(current_pos.x(), min_y)
-            if item.parentItem():
-                item.setPos(item.parentItem().mapFromScene(new_scene_pos))
-            else:
-                item.setPos(new_scene_pos)
-        
-        # 更新所有移动元素的连接线
-        for item in items:
-            self.update_connectors(item)
-            self.update_image_text_connectors(item)
+        # 记录为一条可撤销的移动命令，连接线统一更新
+        moves = {item: (item.scenePos(), QPointF(item.scenePos().x(), min_y)) for item in items}
+        self.undo_stack.push(MoveItemsCommand(self, moves))
         
         print(f"已对齐到顶部")
     
@@ -3478,19 +6012,10 @@ class LayoutScene(QGraphicsScene):
         if items is None: items = [item for item in self.selectedItems() if isinstance(item, BaseElement)]
         if len(items) < 2: return
         max_right = max(item.scenePos().x() + item.boundingRect().width() for item in items)
-        for item in items:
-            current_pos = item.scenePos()
-            new_x = max_right - item.boundingRect().width()
-            new_scene_pos = QPointF(new_x, current_pos.y())
-            if item.parentItem():
-                item.setPos(item.parentItem().mapFromScene(new_scene_pos))
-            else:
-                item.setPos(new_scene_pos)
-        
-        # 更新所有移动元素的连接线
-        for item in items:
-            self.update_connectors(item)
-            self.update_image_text_connectors(item)
+        # 记录为一条可撤销的移动命令，连接线统一更新
+        moves = {item: (item.scenePos(), QPointF(max_right - item.boundingRect().width(), item.scenePos().y()))
+                 for item in items}
+        self.undo_stack.push(MoveItemsCommand(self, moves))
         
         print(f"已对齐到右边")
     
@@ -3504,6 +6029,31 @@ class LayoutView(QGraphicsView):
         self.setAcceptDrops(True)
         self._is_panning = False
         self._pan_start = QPoint()
+        # 可见区域变化合并到一次回调中，更新虚拟化场景的实例化范围
+        self.visible_update_timer = QTimer(self)
+        self.visible_update_timer.setSingleShot(True)
+        self.visible_update_timer.timeout.connect(self.update_visible_elements)
+        self.transformChanged.connect(self.schedule_visible_update)
+    
+    def visible_scene_rect(self):
+        return self.mapToScene(self.viewport().rect()).boundingRect()
+    
+    def schedule_visible_update(self):
+        if not self.visible_update_timer.isActive():
+            self.visible_update_timer.start(30)
+    
+    def update_visible_elements(self):
+        scene = self.scene()
+        if isinstance(scene, LayoutScene) and scene.virtualized:
+            scene.update_materialized(self.visible_scene_rect())
+    
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        self.schedule_visible_update()
+    
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.schedule_visible_update()
 
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.MiddleButton:
@@ -3613,6 +6163,520 @@ class LayoutView(QGraphicsView):
                 img.setPos(pos)
                 self.scene().addItem(img)
 
+class ProjectBrowserDialog(QDialog):
+    """工程浏览器：并行读取文件夹中各工程文件的头部（预览图和统计信息），以缩略图网格显示"""
+    def __init__(self, folder, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"浏览工程 - {folder}")
+        self.resize(960, 640)
+        self.selected_path = None
+        
+        layout = QVBoxLayout(self)
+        self.list_widget = QListWidget()
+        self.list_widget.setViewMode(QListView.ViewMode.IconMode)
+        self.list_widget.setResizeMode(QListView.ResizeMode.Adjust)
+        self.list_widget.setMovement(QListView.Movement.Static)
+        self.list_widget.setIconSize(QSize(PREVIEW_SIZE, PREVIEW_SIZE))
+        self.list_widget.setGridSize(QSize(PREVIEW_SIZE + 24, PREVIEW_SIZE + 60))
+        self.list_widget.setWordWrap(True)
+        self.list_widget.itemDoubleClicked.connect(self.open_item)
+        layout.addWidget(self.list_widget)
+        
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Open | QDialogButtonBox.StandardButton.Cancel)
+        buttons.accepted.connect(lambda: self.open_item(self.list_widget.currentItem()))
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+        
+        # 后台线程并行读取头部，GUI线程定时收集结果
+        self.executor = ThreadPoolExecutor(max_workers=8)
+        self.futures = {}  # Future -> QListWidgetItem
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(PROJECT_EXTENSIONS):
+                path = os.path.join(folder, name)
+                item = QListWidgetItem(name)
+                item.setData(Qt.ItemDataRole.UserRole, path)
+                self.list_widget.addItem(item)
+                self.futures[self.executor.submit(ProjectData.read_preview, path)] = item
+        
+        self.poll_timer = QTimer(self)
+        self.poll_timer.timeout.connect(self.collect_results)
+        self.poll_timer.start(50)
+    
+    def collect_results(self):
+        """把已读取完成的头部显示到列表中"""
+        for future in [f for f in self.futures if f.done()]:
+            item = self.futures.pop(future)
+            try:
+                header, image = future.result()
+            except Exception as e:
+                item.setToolTip(f"无法读取: {e}")
+                continue
+            if image is not None and not image.isNull():
+                item.setIcon(QIcon(QPixmap.fromImage(image)))
+            stats = header.get('stats')
+            if stats:
+                canvas = stats.get('canvas', [0, 0])
+                item.setText(f"{item.text()}\n文字 {stats.get('texts', 0)} · 图片 {stats.get('images', 0)}")
+                item.setToolTip(f"{item.data(Qt.ItemDataRole.UserRole)}\n"
+                                f"画布 {int(canvas[0])} × {int(canvas[1])}\n"
+                                f"父子连接 {stats.get('connectors', 0)} · 图文连接 {stats.get('image_text_connectors', 0)}")
+        if not self.futures:
+            self.poll_timer.stop()
+    
+    def open_item(self, item):
+        if item is None:
+            return
+        self.selected_path = item.data(Qt.ItemDataRole.UserRole)
+        self.accept()
+    
+    def done(self, result):
+        self.poll_timer.stop()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        super().done(result)
+
+# --- Export ---
+
+EXPORT_BAND_BYTES = 8 * 1024 * 1024  # 单个条带的像素缓冲上限，决定导出时的峰值内存
+CANVAS_DPI = 300  # 画布像素与纸张尺寸的换算（默认画布 7054x5021 约等于 A2）
+PDF_POSTER_OVERLAP = 5.0  # 海报拼贴时相邻页面的重叠宽度（毫米），便于裁切粘贴
+EXPORT_SELECTION_PADDING = 10  # 导出选中区域时向外留白的画布像素
+
+
+def adler32_combine(adler1, adler2, len2):
+    """合并两段相邻数据的adler32校验值（算法同zlib的adler32_combine）"""
+    base = 65521
+    rem = len2 % base
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1) % base
+    sum1 = (sum1 + (adler2 & 0xffff) + base - 1) % base
+    sum2 = (sum2 + ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + base - rem) % base
+    return sum1 | (sum2 << 16)
+
+
+class TiledImageExporter:
+    """分块导出大画布：GUI线程只把导出区域内的元素快照为绘制数据（字形排版、图片路径、连线路径等，
+    不复制像素，也不为每个条带录制绘制指令），工作线程各自只绘制与自己条带相交的元素，再过滤、压缩并按顺序流式写入PNG。
+    同一图片由所有条带共享：第一次用到时解码并按输出尺寸缩放一次，最后一个用到它的条带完成后释放。
+    各条带的deflate数据以同步刷新结尾，可以直接拼接成一个IDAT数据流，峰值内存只与同时处理的条带数有关"""
+    BAND_PAD = 4  # 条带上下外扩的输出像素，抗锯齿边缘刚好越过条带边界的元素也会被绘制
+
+    def __init__(self, scene, scale=1.0, rect=None, draft=False):
+        """rect 为导出的场景区域（默认整个画布）；scale 为输出像素与画布像素之比，按 CANVAS_DPI 换算为DPI。
+        draft 为True时（预览图）不读原图：已显示的图片直接用屏幕上的缩放图片，其余按输出尺寸低分辨率解码"""
+        self.rect = QRectF(rect) if rect is not None else scene.sceneRect()
+        self.scale = scale
+        self.draft = draft
+        size = (self.rect.size() * scale).toSize()
+        self.width = max(size.width(), 1)
+        self.height = max(size.height(), 1)
+        self.band_height = max(16, min(1024, EXPORT_BAND_BYTES // (self.width * 4)))
+        self.band_count = -(-self.height // self.band_height)
+        # 场景坐标 -> 输出像素坐标
+        self.transform = (QTransform.fromTranslate(-self.rect.x(), -self.rect.y())
+                          * QTransform.fromScale(self.width / self.rect.width(), self.height / self.rect.height()))
+        self.ops = []  # 绘制操作：(类型, 元素到场景的变换, 不透明度, 数据...)
+        self.band_ops = [[] for _ in range(self.band_count)]  # 条带 -> 相交的绘制操作序号（按绘制顺序）
+        self.loaders = {}  # 图片键 -> 可在工作线程中调用的解码函数
+        self.images = {}  # 图片键 -> [锁, QImage]
+        self.image_uses = {}  # 图片键 -> 还会用到它的条带数
+        self.image_lock = threading.Lock()
+        self.snapshot(scene)
+
+    def add_op(self, bounds, op, images=()):
+        """登记绘制操作；bounds 为场景包围矩形，images 为操作用到的共享图片键"""
+        area = self.transform.mapRect(bounds)
+        if area.right() < -self.BAND_PAD or area.left() > self.width + self.BAND_PAD:
+            return
+        first = max(0, int((area.top() - self.BAND_PAD) // self.band_height))
+        last = min(self.band_count - 1, int((area.bottom() + self.BAND_PAD) // self.band_height))
+        if first > last:
+            return
+        index = len(self.ops)
+        self.ops.append(op)
+        for band in range(first, last + 1):
+            self.band_ops[band].append(index)
+        for key in images:
+            self.image_uses[key] = self.image_uses.get(key, 0) + last - first + 1
+
+    def snapshot(self, scene):
+        """按导出显示效果（不画网格、父子连线、连接点、连线预览和选中框）记录绘制数据。
+        只读取元素属性，不创建字形、不解码图片，虚拟化时离屏的元素也不必先创建显示子项"""
+        identity = QTransform()
+        canvas = scene.sceneRect()
+        # 背景，与 LayoutScene.drawBackground 一致
+        self.add_op(self.rect, ('fill', identity, 1.0, self.rect, QColor(60, 60, 60)))
+        self.add_op(canvas.translated(5, 5), ('fill', identity, 1.0, canvas.translated(5, 5), QColor(30, 30, 30, 150)))
+        self.add_op(canvas, ('fill', identity, 1.0, canvas, QColor(250, 250, 245)))
+        if scene.background_pixmap is not None and not scene.background_pixmap.isNull():
+            config = scene.config_manager
+            path = config.get('default_background_image', '')
+            mode = config.get('background_scale_mode', 'fit')
+            size = QSizeF(scene.background_pixmap.size())
+            if mode in ('fit', 'fill'):
+                aspect = Qt.AspectRatioMode.KeepAspectRatio if mode == 'fit' else Qt.AspectRatioMode.KeepAspectRatioByExpanding
+                size = size.scaled(canvas.size(), aspect)
+                target = QRectF(canvas.x() + (canvas.width() - size.width()) / 2,
+                                canvas.y() + (canvas.height() - size.height()) / 2, size.width(), size.height())
+            else:
+                target = canvas
+            key = ('file', path)
+            if self.draft:
+                image = scene.background_pixmap.toImage()
+                self.loaders[key] = lambda: image
+            else:
+                self.loaders[key] = ProjectBundle.image_loader(path)
+            kind = 'tile' if mode == 'tile' else 'image'
+            self.add_op(target, (kind, identity, config.get('background_opacity', 0.3), target, key), [key])
+        self.add_op(canvas, ('frame', identity, 1.0, canvas, QPen(QColor(180, 180, 180), 1)))
+        
+        for item in scene.items(self.rect, Qt.ItemSelectionMode.IntersectsItemBoundingRect, Qt.SortOrder.AscendingOrder):
+            if not item.isVisible() or isinstance(item, (ConnectionPoint, ConnectionPreviewItem, VConnector)):
+                continue
+            parent = item.parentItem()
+            if isinstance(parent, VTextItem) and isinstance(item, QGraphicsSimpleTextItem):
+                continue  # 字形按所属文字的排版结果绘制
+            if isinstance(parent, VImageItem) and item is parent.p_item:
+                continue  # 不使用屏幕显示用的缩小图片
+            transform = item.sceneTransform()
+            opacity = item.effectiveOpacity()
+            bounds = item.sceneBoundingRect()
+            if isinstance(item, VTextItem):
+                if item.glyph_layout:
+                    margin = item.font_size  # 偏移标点可能略超出包围盒
+                    self.add_op(bounds.adjusted(-margin, -margin, margin, margin),
+                                ('glyphs', transform, opacity, item.glyph_font, QColor(item.text_color), item.glyph_layout))
+            elif isinstance(item, VImageItem):
+                local = item.boundingRect()
+                if local.isEmpty():
+                    continue
+                size = (transform * self.transform).mapRect(local).size().toSize().expandedTo(QSize(1, 1))
+                if self.draft:
+                    key = ('draft', item.file_path, size.width(), size.height())
+                    if key not in self.loaders:
+                        if item.p_item is not None:
+                            image = item.p_item.pixmap().toImage()
+                            self.loaders[key] = lambda image=image: image
+                        else:
+                            self.loaders[key] = ProjectBundle.image_loader(item.file_path, size)
+                    self.add_op(bounds, ('image', transform, opacity, local, key), [key])
+                    continue
+                source = ('file', item.file_path)
+                if source not in self.loaders:
+                    self.loaders[source] = ProjectBundle.image_loader(item.file_path)
+                key = ('scaled', item.file_path, size.width(), size.height())
+                self.add_op(bounds, ('image', transform, opacity, local, key), [source, key])
+            elif isinstance(item, (VGenericConnector, VImageTextConnector)):
+                # 按未选中时的样式导出
+                self.add_op(bounds, ('path', transform, opacity, QPainterPath(item.path()),
+                                     QPen(item.base_color, item.line_width)))
+            elif not isinstance(item, BaseElement):
+                # 其他图形项：各自录制一次（不按条带重复），工作线程回放
+                picture = QPicture()
+                p = QPainter(picture)
+                item.paint(p, QStyleOptionGraphicsItem(), None)
+                p.end()
+                self.add_op(bounds, ('picture', transform, opacity, picture))
+
+    def shared_image(self, key):
+        """取共享图片，第一次用到时解码（'file'、'draft'）或按输出尺寸缩放（'scaled'），同一个键只处理一次"""
+        with self.image_lock:
+            entry = self.images.get(key)
+            if entry is None:
+                entry = self.images[key] = [threading.Lock(), None]
+        with entry[0]:
+            if entry[1] is None:
+                if key in self.loaders:
+                    entry[1] = self.loaders[key]()
+                else:
+                    _, path, w, h = key
+                    image = self.shared_image(('file', path))
+                    if not image.isNull() and w < image.width() and h < image.height():
+                        # 缩小到输出尺寸只做一次，绘制时基本是一比一的拷贝
+                        image = image.scaled(w, h, Qt.AspectRatioMode.KeepAspectRatio,
+                                             Qt.TransformationMode.SmoothTransformation)
+                    entry[1] = image
+            return entry[1]
+
+    def release_images(self, keys):
+        """条带用完图片后调用；已没有条带需要的图片立即释放"""
+        with self.image_lock:
+            for key in keys:
+                self.image_uses[key] -= 1
+                if self.image_uses[key] == 0:
+                    del self.image_uses[key]
+                    self.images.pop(key, None)
+
+    @staticmethod
+    def draw_glyphs(painter, font, color, layout):
+        """按 VTextItem 的排版结果绘制字形，效果与 create_glyphs 创建的字形子项相同"""
+        painter.setFont(font)
+        painter.setPen(color)
+        metrics = QFontMetricsF(font)
+        ascent = metrics.ascent()
+        base = painter.transform()
+        for char, x, y, is_rotated in layout:
+            if is_rotated:
+                # 绕字形中心旋转90度
+                cx = metrics.horizontalAdvance(char) / 2
+                cy = metrics.height() / 2
+                painter.setTransform(QTransform.fromTranslate(-cx, -cy) * QTransform().rotate(90)
+                                     * QTransform.fromTranslate(x + cx, y + cy) * base)
+                painter.drawText(QPointF(0, ascent), char)
+                painter.setTransform(base)
+            else:
+                painter.drawText(QPointF(x, y + ascent), char)
+
+    def draw(self, painter, op, base):
+        kind, transform, opacity = op[:3]
+        painter.setTransform(transform * base)
+        painter.setOpacity(opacity)
+        if kind == 'fill':
+            painter.fillRect(op[3], op[4])
+        elif kind == 'frame' or kind == 'path':
+            painter.setPen(op[4])
+            painter.setBrush(Qt.BrushStyle.NoBrush)
+            if kind == 'frame':
+                painter.drawRect(op[3])
+            else:
+                painter.drawPath(op[3])
+        elif kind == 'glyphs':
+            self.draw_glyphs(painter, *op[3:])
+        elif kind == 'picture':
+            painter.drawPicture(0, 0, op[3])
+        else:
+            image = self.shared_image(op[4])
+            if image.isNull():
+                return
+            if kind == 'tile':
+                brush = QBrush(image)
+                brush.setTransform(QTransform.fromTranslate(op[3].x(), op[3].y()))
+                painter.fillRect(op[3], brush)
+            else:
+                painter.drawImage(op[3], image)
+
+    def encode_band(self, index):
+        """在工作线程中绘制一个条带并压缩，返回 (deflate数据, adler32, 原始长度)"""
+        img = self.draw_band(index)
+        raw = self.filter_rows(img.convertToFormat(QImage.Format.Format_RGB888))
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        data = compressor.compress(raw) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data, zlib.adler32(raw), len(raw)
+
+    def draw_band(self, index):
+        """绘制一个条带，返回QImage；每个条带只能绘制一次（用完的共享图片随即释放）"""
+        y = index * self.band_height
+        h = min(self.band_height, self.height - y)
+        img = QImage(self.width, h, QImage.Format.Format_RGB32)
+        img.fill(Qt.GlobalColor.white)
+        base = self.transform * QTransform.fromTranslate(0, -y)
+        ops = [self.ops[i] for i in self.band_ops[index]]
+        p = QPainter(img)
+        p.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        try:
+            for op in ops:
+                self.draw(p, op, base)
+        finally:
+            p.end()
+            self.band_ops[index] = None
+            self.release_images([key for op in ops if op[0] in ('image', 'tile') for key in self.op_images(op)])
+        return img
+
+    @staticmethod
+    def op_images(op):
+        """绘制操作登记过的共享图片键"""
+        key = op[4]
+        return (('file', key[1]), key) if key[0] == 'scaled' else (key,)
+
+    def filter_rows(self, img):
+        """把RGB888图像转为PNG扫描行（每行前加过滤类型字节）"""
+        row_bytes = self.width * 3
+        bpl = img.bytesPerLine()
+        buf = img.constBits().asstring(img.sizeInBytes())
+        if np is not None:
+            rows = np.frombuffer(buf, np.uint8).reshape(img.height(), bpl)[:, :row_bytes]
+            out = np.empty((img.height(), row_bytes + 1), np.uint8)
+            out[:, 0] = 1  # Sub过滤：与左侧像素做差，大片留白和纯色更易压缩
+            out[:, 1:4] = rows[:, :3]
+            np.subtract(rows[:, 3:], rows[:, :-3], out=out[:, 4:])
+            return out.tobytes()
+        return b''.join(b'\x00' + buf[y * bpl:y * bpl + row_bytes] for y in range(img.height()))
+
+    @staticmethod
+    def write_chunk(f, tag, data):
+        f.write(struct.pack('>I', len(data)) + tag + data)
+        f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(tag))))
+
+    def write(self, filepath, jobs=None, progress=None, cancelled=None):
+        """并行编码各条带并按顺序写入PNG（先写临时文件再替换）。
+        progress(已完成条带数, 总条带数)；cancelled() 返回True时中止并返回False"""
+        jobs = jobs or min(os.cpu_count() or 1, 8)
+        total = self.band_count
+        # 临时文件名带进程和线程号：批量渲染时多个进程可能同时写同一目录
+        tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        adler = 1
+        aborted = False
+        try:
+            with open(tmp_path, 'wb') as f, ThreadPoolExecutor(max_workers=jobs) as executor:
+                f.write(b'\x89PNG\r\n\x1a\n')
+                self.write_chunk(f, b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0))
+                ppm = round(CANVAS_DPI * self.scale / 0.0254)  # 每米像素数，让排版软件按正确的DPI置入
+                self.write_chunk(f, b'pHYs', struct.pack('>IIB', ppm, ppm, 1))
+                self.write_chunk(f, b'IDAT', b'\x78\x9c')  # zlib 数据流头
+                futures = {}
+                submitted = 0
+                for index in range(total):
+                    # 只预取有限个条带，保证内存不随画布尺寸增长
+                    while submitted < total and submitted < index + jobs * 2:
+                        futures[submitted] = executor.submit(self.encode_band, submitted)
+                        submitted += 1
+                    if cancelled is not None and cancelled():
+                        for future in futures.values():
+                            future.cancel()
+                        aborted = True
+                        break
+                    data, band_adler, length = futures.pop(index).result()
+                    adler = adler32_combine(adler, band_adler, length)
+                    self.write_chunk(f, b'IDAT', data)
+                    if progress is not None:
+                        progress(index + 1, total)
+                if not aborted:
+                    self.write_chunk(f, b'IDAT', b'\x03\x00' + struct.pack('>I', adler))  # 结束块 + 校验值
+                    self.write_chunk(f, b'IEND', b'')
+                    f.flush()
+                    os.fsync(f.fileno())
+            if aborted:
+                os.remove(tmp_path)
+                return False
+            os.replace(tmp_path, filepath)
+            return True
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+class ExportJob(QObject):
+    """在后台线程绘制、编码并写入已做好快照的导出（TiledImageExporter），不再访问场景。
+    信号在后台线程发出，由Qt排队送到GUI线程；cancel() 请求在下一个条带前中止"""
+    progress = pyqtSignal(int, int)  # 已完成条带数, 总条带数
+    finished = pyqtSignal(bool)  # True 已写入, False 已取消
+    failed = pyqtSignal(str)
+    
+    def __init__(self, exporter, filepath, parent=None):
+        super().__init__(parent)
+        self.exporter = exporter
+        self.filepath = filepath
+        self.cancel_requested = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+    
+    def start(self):
+        self.thread.start()
+    
+    def cancel(self):
+        self.cancel_requested = True
+    
+    def run(self):
+        try:
+            done = self.exporter.write(self.filepath, progress=self.progress.emit,
+                                       cancelled=lambda: self.cancel_requested)
+        except Exception as e:
+            self.failed.emit(f"{type(e).__name__}: {e}")
+            return
+        self.finished.emit(done)
+
+
+def export_pdf(scene, filepath, page_size=None, rect=None):
+    """以矢量方式导出PDF：文字保留为嵌入（子集化）字体，图片使用原图且每张只嵌入一次。
+    page_size 为None时整块区域输出为一页（按 CANVAS_DPI 换算纸张尺寸）；
+    否则按该纸张尺寸（QPageSize.PageSizeId）分页平铺为海报，返回页数"""
+    rect = QRectF(rect) if rect is not None else scene.sceneRect()
+    printer = QPrinter(QPrinter.PrinterMode.HighResolution)
+    printer.setOutputFormat(QPrinter.OutputFormat.PdfFormat)
+    printer.setOutputFileName(filepath)
+    printer.setFontEmbeddingEnabled(True)
+    printer.setCreator("VertiLayout Pro")
+    printer.setDocName(os.path.splitext(os.path.basename(filepath))[0])
+    printer.setResolution(CANVAS_DPI)  # 一个设备像素对应一个画布像素
+    printer.setFullPage(True)
+    mm_per_px = 25.4 / CANVAS_DPI
+    if page_size is None:
+        printer.setPageSize(QPageSize(QSizeF(rect.width() * mm_per_px, rect.height() * mm_per_px),
+                                      QPageSize.Unit.Millimeter, "Canvas", QPageSize.SizeMatchPolicy.ExactMatch))
+    else:
+        orientation = QPageLayout.Orientation.Landscape if rect.width() > rect.height() else QPageLayout.Orientation.Portrait
+        printer.setPageLayout(QPageLayout(QPageSize(page_size), orientation, QMarginsF(0, 0, 0, 0)))
+    printer.setPageMargins(QMarginsF(0, 0, 0, 0), QPageLayout.Unit.Millimeter)
+    
+    page = printer.pageLayout().fullRectPixels(CANVAS_DPI)
+    page_w, page_h = page.width(), page.height()
+    overlap = 0 if page_size is None else PDF_POSTER_OVERLAP / mm_per_px
+    step_x = max(page_w - overlap, 1)
+    step_y = max(page_h - overlap, 1)
+    cols = max(1, math.ceil((rect.width() - overlap) / step_x)) if page_size is not None else 1
+    rows = max(1, math.ceil((rect.height() - overlap) / step_y)) if page_size is not None else 1
+    
+    state = scene.begin_export(source_images=True, rect=rect)
+    painter = QPainter()
+    try:
+        scene.ensure_materialized(rect)
+        if not painter.begin(printer):
+            raise OSError(f"无法写入 {filepath}")
+        for r in range(rows):
+            for c in range(cols):
+                if r or c:
+                    printer.newPage()
+                if page_size is None:
+                    source = rect
+                else:
+                    source = QRectF(rect.x() + c * step_x, rect.y() + r * step_y, page_w, page_h).intersected(rect)
+                scene.render(painter, QRectF(0, 0, source.width(), source.height()), source,
+                             Qt.AspectRatioMode.IgnoreAspectRatio)
+        painter.end()
+    finally:
+        if painter.isActive():
+            painter.end()
+        scene.end_export(state)
+    return rows * cols
+
+class ExportImageDialog(QDialog):
+    """导出图片选项：导出范围（整个画布、选中元素、当前视图或命名区域）和DPI"""
+    def __init__(self, regions, dpi, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("导出图片")
+        self.regions = [(name, rect) for name, rect in regions if not rect.isEmpty()]
+        
+        layout = QFormLayout(self)
+        self.region_combo = QComboBox()
+        for name, _ in self.regions:
+            self.region_combo.addItem(name)
+        self.region_combo.currentIndexChanged.connect(self.update_size)
+        layout.addRow("导出范围:", self.region_combo)
+        
+        self.dpi_spin = QSpinBox()
+        self.dpi_spin.setRange(36, 2400)
+        self.dpi_spin.setSuffix(" dpi")
+        self.dpi_spin.setValue(dpi)
+        self.dpi_spin.valueChanged.connect(self.update_size)
+        layout.addRow("分辨率:", self.dpi_spin)
+        
+        self.size_label = QLabel()
+        layout.addRow("输出尺寸:", self.size_label)
+        
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+        self.update_size()
+    
+    def region(self):
+        return self.regions[self.region_combo.currentIndex()][1]
+    
+    def scale(self):
+        return self.dpi_spin.value() / CANVAS_DPI
+    
+    def update_size(self):
+        size = (self.region().size() * self.scale()).toSize()
+        self.size_label.setText(f"{size.width()} x {size.height()} 像素")
+
 # --- Main Window ---
 
 class MainWindow(QMainWindow):
@@ -3628,6 +6692,8 @@ class MainWindow(QMainWindow):
         self.scene.setSceneRect(0, 0, 7054, 5021)
         self.scene.selectionChanged.connect(self.on_selection_changed)
         self.view = LayoutView(self.scene)
+        self.autosave_manager = AutosaveManager(lambda: self.scene, self.scene.config_manager, self)
+        self.export_job = None  # 正在后台进行的图片导出
         
         # 创建停靠面板
         # 右侧：层级 & 属性面板
@@ -3828,6 +6894,10 @@ class MainWindow(QMainWindow):
         btn_auto_connect.triggered.connect(self.auto_connect_selected)
         view_toolbar.addAction(btn_auto_connect)
         
+        btn_nearest_connect = QAction("就近连接", self)
+        btn_nearest_connect.triggered.connect(self.nearest_connect_selected)
+        view_toolbar.addAction(btn_nearest_connect)
+        
         btn_clear_connections = QAction("清除连接", self)
         btn_clear_connections.triggered.connect(self.clear_all_connections)
         view_toolbar.addAction(btn_clear_connections)
@@ -3877,11 +6947,23 @@ class MainWindow(QMainWindow):
         open_action.triggered.connect(self.load_proj)
         file_menu.addAction(open_action)
         
+        browse_action = QAction('浏览工程...', self)
+        browse_action.triggered.connect(self.browse_projects)
+        file_menu.addAction(browse_action)
+        
         save_action = QAction('保存工程...', self)
         save_action.setShortcut('Ctrl+S')
         save_action.triggered.connect(self.save_proj)
         file_menu.addAction(save_action)
         
+        autosave_settings_action = QAction('自动保存设置...', self)
+        autosave_settings_action.triggered.connect(self.set_autosave_options)
+        file_menu.addAction(autosave_settings_action)
+        
+        undo_settings_action = QAction('撤销历史设置...', self)
+        undo_settings_action.triggered.connect(self.set_undo_budget)
+        file_menu.addAction(undo_settings_action)
+        
         file_menu.addSeparator()
         
         export_action = QAction('导出图片...', self)
@@ -3889,6 +6971,14 @@ class MainWindow(QMainWindow):
         export_action.triggered.connect(self.export_image)
         file_menu.addAction(export_action)
         
+        export_pdf_action = QAction('导出PDF...', self)
+        export_pdf_action.triggered.connect(self.export_pdf)
+        file_menu.addAction(export_pdf_action)
+        
+        save_region_action = QAction('保存选中范围为导出区域...', self)
+        save_region_action.triggered.connect(self.save_export_region)
+        file_menu.addAction(save_region_action)
+        
         file_menu.addSeparator()
         
         # 设置默认字体
@@ -3943,6 +7033,11 @@ class MainWindow(QMainWindow):
         zoom_selection_action.triggered.connect(self.zoom_to_selection)
         view_menu.addAction(zoom_selection_action)
         
+        virtualize_action = QAction('虚拟化显示（大型工程）', self)
+        virtualize_action.setCheckable(True)
+        virtualize_action.toggled.connect(self.toggle_virtualization)
+        view_menu.addAction(virtualize_action)
+        
         view_menu.addSeparator()
         
         # 背景设置
@@ -3984,6 +7079,15 @@ class MainWindow(QMainWindow):
         set_all_line_width_action.triggered.connect(self.set_all_connector_width)
         connector_menu.addAction(set_all_line_width_action)
         
+        nearest_connect_settings_action = QAction('就近连接设置...', self)
+        nearest_connect_settings_action.triggered.connect(self.set_nearest_connect_options)
+        connector_menu.addAction(nearest_connect_settings_action)
+        
+        obstacle_routing_action = QAction('绕开元素走线', self)
+        obstacle_routing_action.setCheckable(True)
+        obstacle_routing_action.toggled.connect(lambda checked: self.scene.set_obstacle_routing(checked))
+        connector_menu.addAction(obstacle_routing_action)
+        
         connector_menu.addSeparator()
         
         # 预设粗细选项
@@ -4043,9 +7147,11 @@ class MainWindow(QMainWindow):
     
     def undo(self):
         self.scene.undo()
+        self.update_font_controls()
     
     def redo(self):
         self.scene.redo()
+        self.update_font_controls()
     
     def align_top(self):
         self.scene.align_top()
@@ -4088,6 +7194,96 @@ class MainWindow(QMainWindow):
     def auto_connect_selected(self):
         self.scene.auto_connect_selected_items()
     
+    def nearest_connect_selected(self):
+        self.scene.connect_nearest()
+    
+    def set_nearest_connect_options(self):
+        """设置就近连接的距离和方向"""
+        config = self.scene.config_manager
+        distance, ok = QInputDialog.getInt(
+            self,
+            "就近连接设置",
+            "最大连接距离 (像素):",
+            config.get('auto_connect_max_distance', 300),
+            10,
+            5000
+        )
+        if not ok:
+            return
+        directions = {'文字在图片下方': 'below', '文字在图片上方': 'above', '不限方向': 'any'}
+        names = list(directions)
+        current = config.get('auto_connect_direction', 'below')
+        current_index = list(directions.values()).index(current) if current in directions.values() else 0
+        name, ok = QInputDialog.getItem(self, "就近连接设置", "连接方向:", names, current_index, False)
+        if not ok:
+            return
+        config.set('auto_connect_max_distance', distance)
+        config.set('auto_connect_direction', directions[name])
+        print(f"就近连接设置: 距离 {distance}px, 方向 {name}")
+    
+    def toggle_virtualization(self, enabled):
+        """切换虚拟化显示：只为可见区域附近的元素创建字形和图片"""
+        self.scene.set_virtualized(enabled, self.view.visible_scene_rect())
+        print("虚拟化显示已开启" if enabled else "虚拟化显示已关闭")
+    
+    def set_autosave_options(self):
+        """设置自动保存间隔"""
+        config = self.scene.config_manager
+        interval, ok = QInputDialog.getInt(
+            self,
+            "自动保存设置",
+            "自动保存间隔 (秒，0 表示关闭):",
+            config.get('autosave_interval', 60),
+            0,
+            3600
+        )
+        if not ok:
+            return
+        config.set('autosave_interval', interval)
+        self.autosave_manager.apply_config()
+        print(f"自动保存间隔: {interval} 秒" if interval else "自动保存已关闭")
+    
+    def set_undo_budget(self):
+        """设置撤销历史的内存预算"""
+        config = self.scene.config_manager
+        budget, ok = QInputDialog.getInt(
+            self,
+            "撤销历史设置",
+            "撤销历史内存上限 (MB):",
+            config.get('undo_budget_mb', 64),
+            1,
+            4096
+        )
+        if not ok:
+            return
+        config.set('undo_budget_mb', budget)
+        self.scene.undo_stack.set_max_bytes(budget * 1024 * 1024)
+        stack = self.scene.undo_stack
+        print(f"撤销历史上限: {budget} MB（当前 {len(stack.done)} 步，约 {stack.total_bytes / 1024 / 1024:.1f} MB）")
+    
+    def offer_autosave_recovery(self):
+        """启动后调用：上次没有正常退出时提示打开保留下来的自动保存文件"""
+        path = self.autosave_manager.begin_session()
+        if path is None:
+            return
+        reply = QMessageBox.question(
+            self,
+            "恢复工程",
+            f"上次没有正常退出，是否打开自动保存的工程？\n{path}",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if reply == QMessageBox.StandardButton.Yes:
+            self.open_project(path)
+        else:
+            print(f"自动保存的工程保留在: {path}")
+    
+    def closeEvent(self, event):
+        self.autosave_manager.shutdown()
+        if self.export_job is not None:
+            self.export_job.cancel()
+            self.export_job.thread.join()
+        super().closeEvent(event)
+    
     def clear_all_connections(self):
         self.scene.remove_all_image_text_connections()
     
@@ -4106,46 +7302,37 @@ class MainWindow(QMainWindow):
     def save_selected_as_group(self):
         self.scene.save_group_as_asset()
     
-    def change_selected_font(self, font):
+    def set_selected_text_properties(self, values, merge_key=None):
+        """把选中文字的属性修改（属性名 -> 新值）作为一步可撤销命令执行；
+        微调框传入自身作为 merge_key，同一微调框的连续调整合并为一步"""
         selected_items = [item for item in self.scene.selectedItems() if isinstance(item, VTextItem)]
-        for item in selected_items:
-            item.font_family = font.family()
-            item.rebuild()
+        command = SetPropertyCommand.for_items(self.scene, selected_items, values, merge_key)
+        if command is not None:
+            self.scene.undo_stack.push(command)
+    
+    def change_selected_font(self, font):
+        self.set_selected_text_properties({'font_family': font.family()})
     
     def change_selected_font_size(self, size):
-        selected_items = [item for item in self.scene.selectedItems() if isinstance(item, VTextItem)]
-        for item in selected_items:
-            item.font_size = size
-            item.rebuild()
+        self.set_selected_text_properties({'font_size': size}, self.font_size_spin)
     
     def change_selected_color(self):
         selected_items = [item for item in self.scene.selectedItems() if isinstance(item, VTextItem)]
         if not selected_items: return
         color = QColorDialog.getColor(selected_items[0].text_color, self, "选择文字颜色")
         if color.isValid():
-            for item in selected_items:
-                item.text_color = color
-                item.rebuild()
+            self.set_selected_text_properties({'text_color': color})
             self.color_button.setStyleSheet(f"background-color: {color.name()}; border: 1px solid gray;")
     
     def toggle_manual_line_break(self, enabled):
-        selected_items = [item for item in self.scene.selectedItems() if isinstance(item, VTextItem)]
-        for item in selected_items:
-            item.manual_line_break = enabled
-            item.rebuild()
+        self.set_selected_text_properties({'manual_line_break': enabled})
     
     def change_chars_per_column(self, chars_count):
-        selected_items = [item for item in self.scene.selectedItems() if isinstance(item, VTextItem)]
-        for item in selected_items:
-            item.chars_per_column = chars_count
-            item.rebuild()
+        self.set_selected_text_properties({'chars_per_column': chars_count}, self.chars_per_column_spin)
     
     def change_column_spacing(self, spacing):
         """改变选中文字的列间距"""
-        selected_items = [item for item in self.scene.selectedItems() if isinstance(item, VTextItem)]
-        for item in selected_items:
-            item.column_spacing = spacing
-            item.rebuild()
+        self.set_selected_text_properties({'column_spacing': spacing}, self.column_spacing_spin)
     
     def update_font_controls(self):
         selected_items = [item for item in self.scene.selectedItems() if isinstance(item, VTextItem)]
@@ -4206,7 +7393,8 @@ class MainWindow(QMainWindow):
         h, ok2 = QInputDialog.getInt(self, "画布高度", "高度:", int(current_rect.height()), 100, 10000)
         if ok1 and ok2: self.scene.setSceneRect(0, 0, w, h)
 
-    def refresh_ui(self):
+    def refresh_ui(self, route_connectors=True):
+        """刷新元素树；route_connectors 为False时不重新计算连线（刚由加载器统一算过）"""
         try:
             self.tree_widget.clear()
             def add_node(item, parent_node):
@@ -4219,45 +7407,161 @@ class MainWindow(QMainWindow):
                 if isinstance(item, BaseElement) and item.parentItem() is None:
                     add_node(item, self.tree_widget)
             self.tree_widget.expandAll()
-            self.scene.update_all_connectors()
+            if route_connectors:
+                self.scene.update_all_connectors()
         except: pass
 
     def export_image(self):
+        if self.export_job is not None:
+            print("上一次导出尚未完成")
+            return
+        config = self.scene.config_manager
+        canvas = self.scene.sceneRect()
+        pad = EXPORT_SELECTION_PADDING
+        regions = [
+            ("整个画布", canvas),
+            ("选中元素", self.scene.selected_elements_rect().adjusted(-pad, -pad, pad, pad).intersected(canvas)),
+            ("当前视图", self.view.visible_scene_rect().intersected(canvas)),
+        ]
+        for name, r in config.get('export_regions', {}).items():
+            regions.append((f"区域: {name}", QRectF(*r).intersected(canvas)))
+        options = ExportImageDialog(regions, config.get('export_dpi', CANVAS_DPI), self)
+        if options.exec() != QDialog.DialogCode.Accepted:
+            return
+        config.set('export_dpi', options.dpi_spin.value())
+        
         path, _ = QFileDialog.getSaveFileName(self, "Export Image", "", "PNG (*.png)")
-        if path:
-            # 保存当前设置
-            original_show_grid = self.scene.show_grid
-            original_show_connectors = self.scene.show_connectors
-            original_show_connection_points = self.scene.show_connection_points
-            
-            # 导出时的设置：隐藏网格、父子连线和连接点，但保持图文连接线可见
-            self.scene.show_grid = False
-            self.scene.set_connectors_visible(False)  # 隐藏父子关系连线
-            self.scene.set_connection_points_visible(False)  # 隐藏连接点
-            # 图文连接器保持可见，不隐藏
-            
-            try:
-                rect = self.scene.sceneRect()
-                img = QImage(rect.size().toSize(), QImage.Format.Format_ARGB32)
-                img.fill(Qt.GlobalColor.white)
-                p = QPainter(img)
-                self.scene.render(p)
-                p.end()
-                img.save(path)
-                print(f"图片已导出到: {path}")
-            finally:
-                # 恢复原始设置
-                self.scene.show_grid = original_show_grid
-                self.scene.set_connectors_visible(original_show_connectors)
-                self.scene.set_connection_points_visible(original_show_connection_points)
+        if not path:
+            return
+        # GUI线程只做绘制数据快照，图片解码、绘制和PNG编码都在后台进行，期间可以继续编辑
+        job = ExportJob(TiledImageExporter(self.scene, options.scale(), options.region()), path, self)
+        self.export_job = job
+        progress = QProgressDialog("正在导出图片...", "取消", 0, 0, self)
+        progress.setWindowTitle("导出图片")
+        progress.setWindowModality(Qt.WindowModality.NonModal)
+        progress.setMinimumDuration(300)
+        
+        def on_progress(done, total):
+            progress.setMaximum(total)
+            progress.setValue(done)
+        
+        def cleanup():
+            progress.canceled.disconnect(job.cancel)
+            progress.close()
+            job.deleteLater()
+            self.export_job = None
+        
+        def on_done(ok):
+            cleanup()
+            print(f"图片已导出到: {path}" if ok else "导出已取消")
+        
+        def on_failed(message):
+            cleanup()
+            QMessageBox.warning(self, "导出失败", f"无法导出图片:\n{message}")
+        
+        job.progress.connect(on_progress)
+        job.finished.connect(on_done)
+        job.failed.connect(on_failed)
+        progress.canceled.connect(job.cancel)
+        job.start()
 
+    def save_export_region(self):
+        """把选中元素的包围范围保存为命名导出区域，之后导出图片时可直接选择"""
+        rect = self.scene.selected_elements_rect()
+        if rect.isEmpty():
+            QMessageBox.information(self, "导出区域", "请先选择要导出的元素")
+            return
+        name, ok = QInputDialog.getText(self, "导出区域", "区域名称:")
+        if not ok or not name.strip():
+            return
+        pad = EXPORT_SELECTION_PADDING
+        rect = rect.adjusted(-pad, -pad, pad, pad)
+        config = self.scene.config_manager
+        regions = dict(config.get('export_regions', {}))
+        regions[name.strip()] = [rect.x(), rect.y(), rect.width(), rect.height()]
+        config.set('export_regions', regions)
+        print(f"导出区域已保存: {name.strip()}")
+    
+    def export_pdf(self):
+        """导出矢量PDF：整页输出，或按所选纸张分页拼贴为海报"""
+        path, _ = QFileDialog.getSaveFileName(self, "Export PDF", "", "PDF (*.pdf)")
+        if not path:
+            return
+        layouts = {
+            "整页（画布尺寸）": None,
+            "A4 分页拼贴": QPageSize.PageSizeId.A4,
+            "A3 分页拼贴": QPageSize.PageSizeId.A3,
+            "A2 分页拼贴": QPageSize.PageSizeId.A2,
+        }
+        layout, ok = QInputDialog.getItem(self, "导出PDF", "页面布局:", list(layouts), 0, False)
+        if not ok:
+            return
+        pages = export_pdf(self.scene, path, layouts[layout])
+        print(f"PDF已导出到: {path} ({pages} 页)")
+    
     def save_proj(self):
-        path, _ = QFileDialog.getSaveFileName(self, "Save Project", "", "VLayout (*.vlayout)")
+        path, _ = QFileDialog.getSaveFileName(self, "Save Project", "", "VLayout (*.vlayout);;VLayout Binary (*.vlayoutb);;VLayout Bundle (*.vlayoutz)")
         if path: ProjectData.save(self.scene, path)
 
     def load_proj(self):
-        path, _ = QFileDialog.getOpenFileName(self, "Load Project", "", "VLayout (*.vlayout)")
-        if path: ProjectData.load(self.scene, path)
+        path, _ = QFileDialog.getOpenFileName(self, "Load Project", "", "VLayout (*.vlayout *.vlayoutb *.vlayoutz *.vlayout.gz)")
+        if path:
+            self.open_project(path)
+    
+    def browse_projects(self):
+        """浏览文件夹中的工程（只读取预览图和统计信息）并打开选中的工程"""
+        folder = QFileDialog.getExistingDirectory(self, "选择工程文件夹")
+        if not folder:
+            return
+        dialog = ProjectBrowserDialog(folder, self)
+        if dialog.exec() == QDialog.DialogCode.Accepted and dialog.selected_path:
+            self.open_project(dialog.selected_path)
+    
+    def open_project(self, path):
+        # 在新场景中离屏构建，完成后再替换当前场景
+        new_scene = LayoutScene(asset_manager=self.scene.asset_manager, config_manager=self.scene.config_manager)
+        new_scene.inherit_settings(self.scene)
+        loader = ProjectLoader(new_scene, path, self)
+        progress = QProgressDialog("正在加载工程...", "取消", 0, 0, self)
+        progress.setWindowTitle("加载工程")
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(300)
+        
+        def on_progress(done, total):
+            progress.setMaximum(total)
+            progress.setValue(done)
+        
+        def on_done(ok=False):
+            progress.canceled.disconnect(loader.cancel)
+            progress.close()
+            loader.deleteLater()
+            if ok:
+                self.replace_scene(new_scene)
+        
+        def on_failed(message):
+            on_done()
+            QMessageBox.warning(self, "加载失败", f"无法加载工程文件:\n{message}")
+        
+        loader.progress.connect(on_progress)
+        loader.finished.connect(on_done)
+        loader.failed.connect(on_failed)
+        progress.canceled.connect(loader.cancel)
+        loader.start()
+    
+    def replace_scene(self, new_scene):
+        """一次性把视图切换到新场景，旧场景延迟销毁"""
+        old_scene = self.scene
+        old_scene.selectionChanged.disconnect(self.on_selection_changed)
+        self.scene = new_scene
+        self.scene.selectionChanged.connect(self.on_selection_changed)
+        self.view.setScene(new_scene)
+        self.view.update_visible_elements()
+        self.refresh_ui(route_connectors=False)  # 加载器刚计算过全部连线
+        
+        def teardown():
+            old_scene.clear()
+            old_scene.deleteLater()
+        QTimer.singleShot(0, teardown)
     
     def set_background_image(self):
         """设置默认背景图片"""
@@ -4631,7 +7935,126 @@ class MainWindow(QMainWindow):
         button.style().unpolish(button)
         button.style().polish(button)
 
+# --- Command Line ---
+
+_render_app = None  # 渲染子进程中的QApplication
+
+
+def init_render_worker():
+    """渲染进程初始化：使用离屏平台创建QApplication"""
+    global _render_app
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    _render_app = QApplication.instance() or QApplication([])
+
+
+def render_output_names(paths):
+    """为每个输入生成输出文件名：默认为去掉扩展名的文件名；重名时依次加上扩展名、所在目录名区分，
+    仍然重名（不区分大小写）的为None"""
+    def split(path):
+        name = os.path.basename(path)
+        for ext in PROJECT_EXTENSIONS[::-1]:  # 先匹配较长的 .vlayout.gz
+            if name.lower().endswith(ext):
+                return name[:-len(ext)], ext[1:].replace('.', '_')
+        stem, ext = os.path.splitext(name)
+        return stem, ext[1:]
+    
+    parts = {path: split(path) for path in paths}
+    candidates = (
+        lambda path: parts[path][0],
+        lambda path: '_'.join(filter(None, parts[path])),
+        lambda path: '_'.join(filter(None, (os.path.basename(os.path.dirname(os.path.realpath(path))),) + parts[path])),
+    )
+    names = {}
+    remaining = list(paths)
+    for make in candidates:
+        taken = {name.lower() for name in names.values()}
+        counts = Counter(make(path).lower() for path in remaining)
+        unresolved = []
+        for path in remaining:
+            name = make(path) + '.png'
+            if counts[make(path).lower()] == 1 and name.lower() not in taken:
+                names[path] = name
+            else:
+                unresolved.append(path)
+        remaining = unresolved
+    for path in remaining:
+        names[path] = None
+    return names
+
+
+def render_project_file(path, out_path, scale):
+    """加载一个工程并按导出设置渲染为PNG，返回 (输入路径, 输出路径, 耗时, 错误信息或None)"""
+    start = time.perf_counter()
+    try:
+        if not ProjectData.is_project_file(path):
+            return path, out_path, time.perf_counter() - start, "不是工程文件"
+        init_render_worker()
+        scene = LayoutScene(config_manager=ConfigManager())
+        # 使用保存时记录的画布尺寸，旧文件没有记录时使用主窗口的默认画布
+        canvas = ProjectData.read_header(path).get('stats', {}).get('canvas') or (7054, 5021)
+        scene.setSceneRect(0, 0, canvas[0], canvas[1])
+        ProjectData.load(scene, path)
+        TiledImageExporter(scene, scale).write(out_path, jobs=1)  # 进程池已经并行，每个进程只用一个编码线程
+        scene.clear()
+        return path, out_path, time.perf_counter() - start, None
+    except Exception as e:
+        return path, out_path, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def run_render_cli(argv):
+    """命令行批量渲染：python pb.py render in/*.vlayout -o out/ --scale 2 -j 8"""
+    parser = argparse.ArgumentParser(prog='pb.py render', description='批量把工程文件渲染为PNG（无需图形界面）')
+    parser.add_argument('inputs', nargs='+', help='工程文件或通配符')
+    parser.add_argument('-o', '--output', default='.', help='输出目录')
+    parser.add_argument('--scale', type=float, default=1.0, help='渲染缩放倍数')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='并行进程数')
+    args = parser.parse_args(argv)
+    
+    paths = {}  # 真实路径 -> 输入路径，重叠的通配符和指向同一文件的不同写法只渲染一次
+    for pattern in args.inputs:  # Windows 的命令行不会展开通配符
+        matches = sorted(path for path in glob.glob(pattern) if not os.path.isdir(path))
+        for path in matches if matches else [pattern]:
+            paths.setdefault(os.path.normcase(os.path.realpath(path)), path)
+    paths = list(paths.values())
+    os.makedirs(args.output, exist_ok=True)
+    
+    start = time.perf_counter()
+    results = []
+    names = render_output_names(paths)
+    for path in paths:
+        if names[path] is None:
+            results.append((path, None, 0.0, "输出文件名与其他输入冲突"))
+            print(f"[失败] {path}: 输出文件名与其他输入冲突", flush=True)
+    with ProcessPoolExecutor(max_workers=max(args.jobs, 1), initializer=init_render_worker) as executor:
+        futures = {executor.submit(render_project_file, path, os.path.join(args.output, names[path]), args.scale): path
+                   for path in paths if names[path] is not None}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:  # 子进程崩溃等
+                result = (futures[future], None, 0.0, f"{type(e).__name__}: {e}")
+            results.append(result)
+            path, out_path, seconds, error = result
+            if error:
+                print(f"[失败] {path} ({seconds:.2f}s): {error}", flush=True)
+            else:
+                print(f"[完成] {path} -> {out_path} ({seconds:.2f}s)", flush=True)
+    
+    failed = [r for r in results if r[3]]
+    print(f"\n共 {len(results)} 个工程: 成功 {len(results) - len(failed)}, 失败 {len(failed)}, "
+          f"总耗时 {time.perf_counter() - start:.1f}s")
+    if results:
+        slowest = max(results, key=lambda r: r[2])
+        print(f"最慢: {slowest[0]} ({slowest[2]:.2f}s)")
+    for path, _, _, error in failed:
+        print(f"  {path}: {error}")
+    return 1 if failed else 0
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'render':
+        sys.exit(run_render_cli(sys.argv[2:]))
+    
     app = QApplication(sys.argv)
     
     # 设置应用属性以支持更好的视觉效果 (PyQt6兼容)
@@ -4651,4 +8074,5 @@ if __name__ == "__main__":
     
     w = MainWindow()
     w.show()
+    QTimer.singleShot(0, w.offer_autosave_recovery)
     sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt6.QtGui import QColor, QImage
+from PyQt6.QtWidgets import QApplication
+
+import pb
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def scene(qapp, tmp_path, monkeypatch):
+    """在临时目录中创建场景（配置文件和素材库目录不落到仓库里）"""
+    monkeypatch.chdir(tmp_path)
+    scene = pb.LayoutScene(config_manager=pb.ConfigManager())
+    scene.setSceneRect(0, 0, 2000, 2000)
+    yield scene
+    scene.clear()
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = str(tmp_path / 'red.png')
+    image = QImage(200, 100, QImage.Format.Format_RGB32)
+    image.fill(QColor(255, 0, 0))
+    image.save(path)
+    return path
@@ -0,0 +1,36 @@
+import random
+
+import pytest
+
+import pb
+
+STYLES = [pb.CURVE_STYLE_GENERIC, pb.CURVE_STYLE_IMAGE_TEXT, pb.CURVE_STYLE_PARENT_CHILD]
+
+
+def endpoint_pairs():
+    rng = random.Random(5)
+    starts = [(rng.uniform(-500, 500), rng.uniform(-500, 500)) for _ in range(200)]
+    ends = [(rng.uniform(-500, 500), rng.uniform(-500, 500)) for _ in range(200)]
+    # 水平、垂直、等长和重合的边界情况
+    starts += [(0.0, 0.0), (0.0, 0.0), (0.0, 0.0), (10.0, 10.0), (0.0, 0.0)]
+    ends += [(100.0, 0.0), (0.0, -100.0), (50.0, -50.0), (10.0, 10.0), (-30.0, 30.0)]
+    return starts, ends
+
+
+@pytest.mark.parametrize('style', STYLES)
+def test_curve_controls_numpy_matches_scalar(style, monkeypatch):
+    pytest.importorskip('numpy')
+    starts, ends = endpoint_pairs()
+    vectorized = pb.compute_curve_controls(starts, ends, *style)
+    monkeypatch.setattr(pb, 'np', None)
+    scalar = pb.compute_curve_controls(starts, ends, *style)
+    expected = [pb.curve_controls(x1, y1, x2, y2, *style) for (x1, y1), (x2, y2) in zip(starts, ends)]
+
+    assert scalar == expected
+    assert len(vectorized) == len(expected)
+    for got, want in zip(vectorized, expected):
+        assert got == (pytest.approx(want[0]), pytest.approx(want[1]))
+
+
+def test_curve_controls_empty():
+    assert pb.compute_curve_controls([], [], *pb.CURVE_STYLE_GENERIC) == []
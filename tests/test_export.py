@@ -0,0 +1,112 @@
+import random
+import zlib
+
+from PyQt6.QtCore import QRectF
+from PyQt6.QtGui import QImage, QPainter
+
+import pb
+
+
+def test_adler32_combine_matches_zlib():
+    rng = random.Random(3)
+    for _ in range(100):
+        first = rng.randbytes(rng.randint(0, 5000))
+        second = rng.randbytes(rng.choice([0, 1, 65521, 65522, rng.randint(0, 200000)]))
+        combined = pb.adler32_combine(zlib.adler32(first), zlib.adler32(second), len(second))
+        assert combined == zlib.adler32(first + second)
+
+
+def test_banded_export_matches_single_band(scene, image_path, tmp_path, monkeypatch):
+    """条带边界不影响输出：多条带并行导出与单条带导出逐像素一致"""
+    scene.setSceneRect(0, 0, 400, 300)
+    text = pb.VTextItem('竖排文字测试', 24, 200)
+    text.setPos(40, 20)
+    scene.addItem(text)
+    image = pb.VImageItem(image_path, 150)
+    image.setPos(200, 90)
+    scene.addItem(image)
+    scene.add_image_text_connector(image, text)
+
+    single = str(tmp_path / 'single.png')
+    pb.TiledImageExporter(scene).write(single)
+    monkeypatch.setattr(pb, 'EXPORT_BAND_BYTES', 400 * 4 * 16)
+    exporter = pb.TiledImageExporter(scene)
+    assert exporter.band_count > 10
+    banded = str(tmp_path / 'banded.png')
+    assert exporter.write(banded, jobs=4)
+
+    expected, actual = QImage(single), QImage(banded)
+    assert not actual.isNull() and actual.size() == expected.size()
+    assert actual == expected
+    assert expected.pixelColor(image.sceneBoundingRect().center().toPoint()).red() == 255
+
+
+def test_render_output_names_disambiguate_collisions(tmp_path):
+    paths = [str(tmp_path / 'a' / 'p.vlayout'), str(tmp_path / 'b' / 'p.vlayout'),
+             str(tmp_path / 'p.vlayoutb'), str(tmp_path / 'p.vlayoutz'), str(tmp_path / 'q.vlayout.gz')]
+    names = pb.render_output_names(paths)
+    assert names[paths[4]] == 'q.png'
+    assert names[paths[2]] == 'p_vlayoutb.png' and names[paths[3]] == 'p_vlayoutz.png'
+    assert names[paths[0]] == 'a_p_vlayout.png' and names[paths[1]] == 'b_p_vlayout.png'
+    assert len({name.lower() for name in names.values()}) == len(paths)
+
+
+def test_is_project_file_rejects_other_json(tmp_path):
+    project = tmp_path / 'p.vlayout'
+    project.write_text('{"version": "2.0", "items": []}', encoding='utf-8')
+    legacy = tmp_path / 'old.vlayout'
+    legacy.write_text('[]', encoding='utf-8')
+    journal = tmp_path / 'p.vlayout.journal'
+    journal.write_text('{"seq": 1, "put": []}\n', encoding='utf-8')
+    binary = tmp_path / 'p.vlayoutb'
+    binary.write_bytes(pb.BinaryProjectCodec.encode({'items': [], 'connectors': [], 'image_text_connectors': []}))
+    garbage = tmp_path / 'x.png'
+    garbage.write_bytes(b'\x89PNG\r\n\x1a\n\xff\xfe')
+
+    assert pb.ProjectData.is_project_file(str(project))
+    assert pb.ProjectData.is_project_file(str(legacy))
+    assert pb.ProjectData.is_project_file(str(binary))
+    assert not pb.ProjectData.is_project_file(str(journal))
+    assert not pb.ProjectData.is_project_file(str(garbage))
+
+
+def render_scene(scene):
+    """按矢量导出的方式（场景绘制）渲染整张画布"""
+    rect = scene.sceneRect()
+    image = QImage(int(rect.width()), int(rect.height()), QImage.Format.Format_ARGB32)
+    image.fill(0)
+    state = scene.begin_export()
+    painter = QPainter(image)
+    try:
+        scene.render(painter, QRectF(0, 0, rect.width(), rect.height()), rect)
+    finally:
+        painter.end()
+        scene.end_export(state)
+    return image
+
+
+def test_export_ignores_selection_and_connection_preview(scene, image_path, tmp_path):
+    scene.setSceneRect(0, 0, 400, 300)
+    text = pb.VTextItem('竖排文字测试', 24, 200)
+    text.setPos(260, 20)
+    scene.addItem(text)
+    image = pb.VImageItem(image_path, 150)
+    image.setPos(40, 150)
+    scene.addItem(image)
+    scene.add_image_text_connector(image, text)
+    clean = str(tmp_path / 'clean.png')
+    pb.TiledImageExporter(scene).write(clean)
+    clean_render = render_scene(scene)
+
+    # 编辑中的状态：选中连接线和元素，正在拖拽连线并吸附到文字的连接点
+    for item in [text] + scene.image_text_connectors:
+        item.setSelected(True)
+    scene.start_connection_from_point(image.connection_point)
+    scene.update_connection_preview(text.connection_point.get_scene_center())
+    assert scene.connection_preview is not None and scene.connection_snap_target is text.connection_point
+
+    editing = str(tmp_path / 'editing.png')
+    pb.TiledImageExporter(scene).write(editing)
+    assert QImage(editing) == QImage(clean)
+    assert render_scene(scene) == clean_render
+    scene.end_connection_mode()
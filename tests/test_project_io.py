@@ -0,0 +1,345 @@
+import io
+import json
+import os
+
+import pytest
+from PyQt6.QtCore import QPointF
+
+import pb
+
+
+def sample_project():
+    return {
+        'version': '2.0',
+        'stats': {'texts': 1, 'images': 1},
+        'items': [
+            {'id': 1, 'type': 'VTextItem', 'x': 10.5, 'y': -3.0, 'scene_x': 10.5, 'scene_y': -3.0,
+             'parent_id': -1, 'z': 0.0, 'text': '竖排文字\n第二列', 'font_size': 24, 'font_family': 'SimSun',
+             'text_color': '#000000', 'auto_height': True, 'manual_line_break': False},
+            {'id': 2, 'type': 'VImageItem', 'x': 0.0, 'y': 0.0, 'scene_x': 100.0, 'scene_y': 200.0,
+             'parent_id': 1, 'z': 1.0, 'path': 'a.png', 'width': 200.0, 'extra': {'note': [1, 2]}},
+        ],
+        'connectors': [{'parent_id': 1, 'child_id': 2}],
+        'image_text_connectors': [{'type': 'image_text', 'image_id': 2, 'text_id': 1},
+                                  {'type': 'generic', 'item1_id': 1, 'item2_id': 2,
+                                   'connection_type': 'text-text', 'line_width': 2.5}],
+    }
+
+
+def test_binary_codec_round_trip():
+    project = sample_project()
+    data = pb.BinaryProjectCodec.encode(project)
+    assert pb.BinaryProjectCodec.is_binary(data)
+    assert pb.BinaryProjectCodec.decode(data) == project
+
+
+def test_binary_codec_keeps_values_outside_field_types():
+    """类型不符或不在字段表中的值走额外字段，仍可无损还原"""
+    project = {'items': [{'id': 'a', 'x': None, 'auto_height': 1, 'text': 5, 'big': 2 ** 60}, {}],
+               'connectors': [], 'image_text_connectors': []}
+    decoded = pb.BinaryProjectCodec.decode(pb.BinaryProjectCodec.encode(project))
+    assert json.dumps(decoded, sort_keys=True) == json.dumps(project, sort_keys=True)
+
+
+def test_scene_save_load_round_trip(scene, image_path, tmp_path):
+    text = pb.VTextItem('你好世界', 24, 300)
+    text.setPos(500, 100)
+    scene.addItem(text)
+    image = pb.VImageItem(image_path, 200)
+    image.setPos(100, 300)
+    scene.addItem(image)
+    scene.add_image_text_connector(image, text)
+    scene.add_connector(text, image)
+    expected = pb.ProjectData.serialize(scene)
+
+    for ext in ('.vlayout', '.vlayoutb'):
+        path = str(tmp_path / ('p' + ext))
+        pb.ProjectData.save(scene, path)
+        loaded = pb.LayoutScene(config_manager=scene.config_manager)
+        pb.ProjectData.load(loaded, path)
+        assert pb.ProjectData.serialize(loaded)['items'] == expected['items']
+        assert len(loaded.connectors) == 1
+        assert len(loaded.image_text_connectors) == 1
+        loaded.clear()
+
+
+def bundle_project(paths):
+    return {'version': '2.0', 'connectors': [], 'image_text_connectors': [],
+            'items': [{'id': index, 'type': 'VImageItem', 'x': 0.0, 'y': 0.0, 'parent_id': -1, 'path': path,
+                       'width': 100.0} for index, path in enumerate(paths, 1)]}
+
+
+@pytest.fixture
+def bundle_images(tmp_path, image_path):
+    """两份内容相同的图片（不同路径）和一张不同的图片"""
+    copy = str(tmp_path / 'copy.png')
+    with open(image_path, 'rb') as src, open(copy, 'wb') as dst:
+        dst.write(src.read())
+    other = str(tmp_path / 'blue.png')
+    image = pb.QImage(30, 60, pb.QImage.Format.Format_RGB32)
+    image.fill(pb.QColor(0, 0, 255))
+    image.save(other)
+    yield image_path, copy, other
+    for bundle in list(pb.ProjectBundle._open.values()):
+        bundle.close()
+
+
+def test_bundle_round_trip_stores_duplicate_images_once(tmp_path, bundle_images):
+    image_path, copy, other = bundle_images
+    path = str(tmp_path / ('p' + pb.BUNDLE_PROJECT_EXT))
+    pb.ProjectData.write(bundle_project([image_path, copy, other, image_path]), path)
+
+    bundle = pb.ProjectBundle.get(path)
+    assert len([name for name in bundle.names() if name.startswith('images/')]) == 2
+    loaded = pb.ProjectData.read(path)
+    paths = [d['path'] for d in loaded['items']]
+    assert paths[0] == paths[1] == paths[3] != paths[2]
+    assert all(p.startswith(pb.BUNDLE_IMAGE_PREFIX) for p in paths)
+    with open(image_path, 'rb') as f:
+        assert pb.ProjectBundle.read_image_bytes(paths[0]) == f.read()
+    assert pb.ProjectBundle.load_pixmap(paths[2]).size() == pb.QSize(30, 60)
+
+
+def test_bundle_resave_copies_entries_from_old_bundle(tmp_path, bundle_images):
+    image_path, copy, other = bundle_images
+    path = str(tmp_path / ('p' + pb.BUNDLE_PROJECT_EXT))
+    pb.ProjectData.write(bundle_project([image_path, other]), path)
+    loaded = pb.ProjectData.read(path)
+    expected = {name: bytes(pb.ProjectBundle.get(path).read(name))
+                for name in pb.ProjectBundle.get(path).names() if name.startswith('images/')}
+
+    # 原图片已不存在，重新保存只能从旧工程包复制条目
+    for source in bundle_images:
+        os.remove(source)
+    loaded['items'].append(dict(loaded['items'][0], id=3))
+    pb.ProjectData.write(loaded, path)
+
+    resaved = pb.ProjectData.read(path)
+    assert [d['path'] for d in resaved['items']] == [d['path'] for d in loaded['items']]
+    bundle = pb.ProjectBundle.get(path)
+    assert {name: bytes(bundle.read(name)) for name in bundle.names() if name.startswith('images/')} == expected
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_bundle_virtual_paths_resolve(tmp_path, bundle_images):
+    image_path, _, other = bundle_images
+    path = str(tmp_path / ('p' + pb.BUNDLE_PROJECT_EXT))
+    pb.ProjectData.write(bundle_project([other]), path)
+    virtual = pb.ProjectData.read(path)['items'][0]['path']
+
+    bundle_path, name = pb.ProjectBundle.split_virtual_path(virtual)
+    assert bundle_path == os.path.abspath(path) and name.startswith('images/') and name.endswith('.png')
+    assert pb.ProjectBundle.virtual_path(path, name) == virtual
+    assert pb.ProjectBundle.split_virtual_path(image_path) is None
+    assert pb.ProjectBundle.image_size(virtual) == pb.QSize(30, 60)
+    assert pb.ProjectBundle.image_loader(virtual)().size() == pb.QSize(30, 60)
+    assert pb.ProjectBundle.image_loader(virtual, pb.QSize(15, 30))().size() == pb.QSize(15, 30)
+    copied = str(tmp_path / 'out.png')
+    pb.ProjectBundle.copy_image(virtual, copied)
+    assert pb.QImage(copied).size() == pb.QSize(30, 60)
+    # 条目不存在时返回空图片而不是抛出异常
+    assert pb.ProjectBundle.load_pixmap(pb.ProjectBundle.virtual_path(path, 'images/missing.png')).isNull()
+
+
+def edited(project):
+    project = json.loads(json.dumps(project))
+    project['items'][0]['text'] = '改了'
+    project['items'].append({'id': 3, 'type': 'VTextItem', 'x': 1.0, 'y': 2.0, 'parent_id': -1, 'text': '新'})
+    project['connectors'] = []
+    project['stats'] = {'texts': 2, 'images': 1}
+    return project
+
+
+def test_journal_appends_delta_and_replays(tmp_path):
+    path = str(tmp_path / 'j.vlayout')
+    journal = pb.ProjectJournal(path)
+    journal.save(sample_project())
+    previews = []
+    journal.save(edited(sample_project()), preview=lambda: previews.append(1) or 'png')
+
+    assert previews == []  # 增量保存不生成预览图
+    with open(journal.journal_path, encoding='utf-8') as f:
+        lines = f.readlines()
+    assert len(lines) == 1
+    delta = json.loads(lines[0])
+    assert delta['seq'] == 1 and delta['connectors_del'] == [{'parent_id': 1, 'child_id': 2}]
+    assert 'preview' not in delta.get('meta', {})
+
+    replayed = pb.ProjectJournal(path).load(pb.ProjectData.read(path))
+    expected = edited(sample_project())
+    assert {d['id']: d for d in replayed['items']} == {d['id']: d for d in expected['items']}
+    assert replayed['connectors'] == []
+    assert pb.ProjectJournal.read_stats(journal.journal_path) == expected['stats']
+
+
+def test_journal_ignores_torn_last_line(tmp_path):
+    path = str(tmp_path / 'j.vlayout')
+    journal = pb.ProjectJournal(path)
+    journal.save(sample_project())
+    journal.save(edited(sample_project()))
+    with open(journal.journal_path, 'a', encoding='utf-8') as f:
+        f.write('{"seq": 2, "put": [')
+
+    replayed = pb.ProjectJournal(path).load(pb.ProjectData.read(path))
+    assert [d['text'] for d in replayed['items'] if d['id'] == 1] == ['改了']
+
+
+def test_journal_compaction_folds_deltas_into_base(tmp_path, monkeypatch):
+    monkeypatch.setattr(pb.ProjectJournal, 'COMPACT_MIN_BYTES', 0)
+    monkeypatch.setattr(pb.ProjectJournal, 'COMPACT_RATIO', 0)
+    path = str(tmp_path / 'j.vlayout')
+    journal = pb.ProjectJournal(path)
+    journal.save(sample_project())
+    journal.save(edited(sample_project()), preview=lambda: 'png')
+    journal.compaction.result()
+
+    base = pb.ProjectData.read(path)
+    assert base['journal_seq'] == 1 and base['preview'] == 'png'
+    with open(journal.journal_path, encoding='utf-8') as f:
+        assert f.read() == ''
+    replayed = pb.ProjectJournal(path).load(base)
+    assert sorted(d['id'] for d in replayed['items']) == [1, 2, 3]
+
+    # 压缩后继续增量保存，重放时跳过已合并的序号
+    newer = edited(sample_project())
+    newer['items'][0]['text'] = '再改'
+    journal.save(newer)
+    journal.compaction.result()
+    replayed = pb.ProjectJournal(path).load(pb.ProjectData.read(path))
+    assert [d['text'] for d in replayed['items'] if d['id'] == 1] == ['再改']
+
+
+def test_journal_failed_compaction_falls_back_to_full_save(tmp_path, monkeypatch):
+    """后台压缩失败后下次保存整体写出基础快照，不再在可能不一致的日志上追加"""
+    monkeypatch.setattr(pb.ProjectJournal, 'COMPACT_MIN_BYTES', 0)
+    monkeypatch.setattr(pb.ProjectJournal, 'COMPACT_RATIO', 0)
+
+    def broken(self, snapshot):
+        raise OSError('磁盘已满')
+    monkeypatch.setattr(pb.ProjectJournal, 'compact', broken)
+    path = str(tmp_path / 'j.vlayout')
+    journal = pb.ProjectJournal(path)
+    journal.save(sample_project())
+    journal.save(edited(sample_project()))
+    assert isinstance(journal.compaction.exception(), OSError)
+    pb.ProjectJournal.executor().submit(lambda: None).result()  # 单线程执行器：此时回调已执行完
+    assert journal.base_mtime is None
+
+    newer = edited(sample_project())
+    newer['items'][0]['text'] = '再改'
+    journal.save(newer)
+    assert not os.path.exists(journal.journal_path)
+    assert [d['text'] for d in pb.ProjectData.read(path)['items'] if d['id'] == 1] == ['再改']
+
+
+def test_json_record_reader_streams_across_chunks(monkeypatch):
+    """数据块边界落在多字节字符和记录中间时结果与整体解析一致"""
+    monkeypatch.setattr(pb.JsonRecordReader, 'CHUNK', 7)
+    project = sample_project()
+    raw = json.dumps(project, indent=2, ensure_ascii=False).encode('utf-8')
+
+    header = pb.JsonRecordReader(io.BytesIO(raw)).read_header()
+    assert header == {'version': '2.0', 'stats': project['stats']}
+
+    reader = pb.JsonRecordReader(io.BytesIO(raw))
+    records = list(reader.records())
+    expected = [(section, d) for section in pb.JsonRecordReader.SECTIONS for d in project[section]]
+    assert records == expected
+    assert reader.bytes_read == len(raw)
+
+
+def test_json_record_reader_reads_legacy_list():
+    items = sample_project()['items']
+    reader = pb.JsonRecordReader(io.BytesIO(json.dumps(items).encode('utf-8')))
+    assert reader.read_header() == {}
+    reader = pb.JsonRecordReader(io.BytesIO(json.dumps(items).encode('utf-8')))
+    assert list(reader.records()) == [('items', d) for d in items]
+
+
+def open_handles(path):
+    """本进程中指向 path 的文件描述符数（含内存映射复制的描述符）"""
+    fd_dir = '/proc/self/fd'
+    count = 0
+    for name in os.listdir(fd_dir):
+        try:
+            if os.readlink(os.path.join(fd_dir, name)) == path:
+                count += 1
+        except OSError:
+            pass
+    return count
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='需要 /proc 统计打开的文件')
+@pytest.mark.parametrize('outcome', ['cancel', 'finish'])
+def test_project_loader_closes_stream(scene, image_path, tmp_path, outcome):
+    text = pb.VTextItem('文字', 24, 300)
+    scene.addItem(text)
+    image = pb.VImageItem(image_path, 100)
+    image.setPos(300, 300)
+    scene.addItem(image)
+    scene.add_connector(text, image)
+    path = str(tmp_path / 'p.vlayout')
+    pb.ProjectData.write(pb.ProjectData.serialize(scene), path)
+
+    target = pb.LayoutScene(config_manager=scene.config_manager)
+    loader = pb.ProjectLoader(target, path)
+    results = []
+    loader.finished.connect(results.append)
+    loader.failed.connect(results.append)
+    loader.start()
+    if outcome == 'cancel':
+        next(loader.records)  # 打开文件并映射
+        assert open_handles(path) > 0
+        loader.cancel()
+        assert results == [False]
+    else:
+        while not results:
+            loader.process_chunk()
+        assert results == [True] and len(target.connectors) == 1
+    assert loader.records is None
+    assert open_handles(path) == 0
+
+
+def wait_until(qapp, condition, timeout=5.0):
+    deadline = pb.time.monotonic() + timeout
+    while not condition():
+        assert pb.time.monotonic() < deadline
+        qapp.processEvents()
+
+
+def test_autosave_path_follows_config_dir_and_recovers_after_crash(qapp, scene, tmp_path, monkeypatch):
+    text = pb.VTextItem('自动保存', 24, 300)
+    scene.addItem(text)
+    manager = pb.AutosaveManager(lambda: scene, scene.config_manager)
+    assert manager.begin_session() is None
+    elsewhere = tmp_path / 'elsewhere'
+    elsewhere.mkdir()
+    monkeypatch.chdir(elsewhere)  # 工作目录变化不影响自动保存位置
+    path = str(tmp_path / pb.AUTOSAVE_FILE)
+    assert manager.autosave_path() == path
+
+    results = []
+    manager.written.connect(lambda *args: results.append(args))
+    manager.autosave()
+    wait_until(qapp, lambda: results and manager.pending.done())
+    assert results == [(path, '')] and manager.last_snapshot is not None
+    assert pb.ProjectData.read(path)['items'][0]['text'] == '自动保存'
+
+    # 写入失败时在GUI线程中清除快照，下次重新写入
+    scene.config_manager.config['autosave_path'] = str(tmp_path / 'missing' / 'a.vlayout.gz')
+    text.setPos(50, 50)
+    manager.autosave()
+    wait_until(qapp, lambda: manager.last_snapshot is None)
+    assert results[-1][1]
+    scene.config_manager.config['autosave_path'] = pb.AUTOSAVE_FILE
+
+    # 没有正常退出：下次启动时保留上次的自动保存文件
+    restarted = pb.AutosaveManager(lambda: scene, scene.config_manager)
+    recovered = restarted.begin_session()
+    assert recovered == str(tmp_path / (pb.AutosaveManager.RECOVERED_PREFIX + pb.AUTOSAVE_FILE))
+    assert not os.path.exists(path)
+    assert pb.ProjectData.read(recovered)['items'][0]['text'] == '自动保存'
+
+    restarted.shutdown()
+    manager.shutdown()
+    assert pb.AutosaveManager(lambda: scene, scene.config_manager).begin_session() is None
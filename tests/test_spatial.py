@@ -0,0 +1,153 @@
+import random
+
+import pytest
+from PyQt6.QtCore import QPointF, QRectF
+
+import pb
+
+
+def random_rects(count, seed):
+    rng = random.Random(seed)
+    rects = {}
+    for index in range(count):
+        x, y = rng.uniform(-2000, 2000), rng.uniform(-2000, 2000)
+        rects[index] = QRectF(x, y, rng.uniform(0, 600), rng.uniform(0, 600))
+    return rects
+
+
+def brute_distance(rect, x, y):
+    dx = max(rect.left() - x, 0.0, x - rect.right())
+    dy = max(rect.top() - y, 0.0, y - rect.bottom())
+    return (dx * dx + dy * dy) ** 0.5
+
+
+def test_spatial_grid_queries_match_brute_force():
+    rects = random_rects(300, 1)
+    grid = pb.SpatialGrid(cell_size=128)
+    for obj, rect in rects.items():
+        grid.insert(obj, rect)
+    # 移动和删除一部分对象
+    for obj in range(0, 300, 7):
+        rects[obj] = rects[obj].translated(900, -450)
+        grid.update(obj, rects[obj])
+    for obj in range(3, 300, 11):
+        grid.remove(obj)
+        del rects[obj]
+    assert len(grid) == len(rects)
+
+    rng = random.Random(2)
+    for _ in range(50):
+        query = QRectF(rng.uniform(-2500, 2500), rng.uniform(-2500, 2500), rng.uniform(0, 900), rng.uniform(0, 900))
+        expected = {obj for obj, rect in rects.items()
+                    if rect.left() <= query.right() and rect.right() >= query.left()
+                    and rect.top() <= query.bottom() and rect.bottom() >= query.top()}
+        assert grid.query_rect(query) == expected
+
+        x, y = rng.uniform(-3000, 3000), rng.uniform(-3000, 3000)
+        assert set(grid.query_point(x, y)) == {obj for obj, rect in rects.items() if brute_distance(rect, x, y) == 0}
+        distances = sorted(brute_distance(rect, x, y) for rect in rects.values())
+        assert [d for d, _ in grid.nearest(x, y, k=5)] == pytest.approx(distances[:5])
+        limited = grid.nearest(x, y, k=50, max_distance=300, predicate=lambda obj: obj % 2 == 0)
+        assert sorted(obj for _, obj in limited) == sorted(
+            obj for obj, rect in rects.items() if obj % 2 == 0 and brute_distance(rect, x, y) <= 300)
+
+
+def path_points(path):
+    return [QPointF(path.elementAt(i).x, path.elementAt(i).y) for i in range(path.elementCount())]
+
+
+def test_router_detours_around_obstacles_and_forgets_removed_connectors(scene, image_path):
+    text = pb.VTextItem('文字', 24, 300)
+    text.setPos(300, 100)
+    scene.addItem(text)
+    image = pb.VImageItem(image_path, 100)
+    image.setPos(300, 1000)
+    scene.addItem(image)
+    blocker = pb.VImageItem(image_path, 200)
+    blocker.setPos(250, 650)
+    scene.addItem(blocker)
+
+    scene.set_obstacle_routing(True)
+    scene.add_image_text_connector(image, text)
+    conn = scene.image_text_connectors[-1]
+    points = path_points(conn.path())
+    assert points[0] == image.anchor_top() and points[-1] == text.anchor_bottom()
+    assert len(points) > 2
+    obstacle = blocker.sceneBoundingRect()
+    for a, b in zip(points, points[1:]):
+        assert abs(a.x() - b.x()) < 1e-6 or abs(a.y() - b.y()) < 1e-6  # 正交折线
+        segment = QRectF(a, b).normalized().adjusted(-0.5, -0.5, 0.5, 0.5)
+        assert not segment.intersects(obstacle)
+
+    # 端点不变时直接返回缓存的路由
+    cached = scene.router.cache[conn][1]
+    scene.route_around_obstacles(conn)
+    assert scene.router.cache[conn][1] is cached
+    assert conn in scene.router.connectors_crossing(obstacle.adjusted(-200, -200, 200, 200))
+
+    scene.remove_image_text_connectors(image)
+    assert conn not in scene.router.cache and conn not in scene.router.corridors
+
+
+def brute_force_pairs(images, texts, max_distance, direction):
+    """就近连接的参考实现：逐对计算距离"""
+    def matches(img, text):
+        img_y, text_y = img.anchor_center().y(), text.anchor_center().y()
+        return {'below': text_y > img_y, 'above': text_y < img_y}.get(direction, True)
+
+    def closest(probe, candidates, rect_of):
+        best = None
+        for candidate in candidates:
+            dist = brute_distance(rect_of(candidate), probe.x(), probe.y())
+            if dist <= max_distance and (best is None or dist < best[0]):
+                best = (dist, candidate)
+        return best and best[1]
+
+    probes = {'below': ('anchor_bottom', 'anchor_top'), 'above': ('anchor_top', 'anchor_bottom')}
+    image_probe, text_probe = probes.get(direction, ('anchor_center', 'anchor_center'))
+    pairs = set()
+    paired = set()
+    for img in images:
+        text = closest(getattr(img, image_probe)(), [t for t in texts if matches(img, t)],
+                       lambda t: t.sceneBoundingRect())
+        if text is not None:
+            pairs.add(frozenset((img, text)))
+            paired.add(text)
+    for text in texts:  # 没被图片选中的文字再找最近的图片
+        if text in paired:
+            continue
+        img = closest(getattr(text, text_probe)(), [i for i in images if matches(i, text)],
+                      lambda i: i.sceneBoundingRect())
+        if img is not None:
+            pairs.add(frozenset((img, text)))
+    return pairs
+
+
+@pytest.mark.parametrize('direction', ['below', 'above', 'any'])
+@pytest.mark.parametrize('max_distance', [150, 600])
+def test_connect_nearest_matches_brute_force(scene, image_path, direction, max_distance):
+    rng = random.Random(f'{direction}-{max_distance}')
+    images = []
+    for _ in range(25):
+        img = pb.VImageItem(image_path, rng.uniform(40, 160))
+        img.setPos(rng.uniform(0, 1800), rng.uniform(0, 1800))
+        scene.addItem(img)
+        images.append(img)
+    texts = []
+    for _ in range(40):
+        text = pb.VTextItem('文字', 20, 120)
+        text.setPos(rng.uniform(0, 1800), rng.uniform(0, 1800))
+        scene.addItem(text)
+        texts.append(text)
+    expected = brute_force_pairs(images, texts, max_distance, direction)
+
+    # 已有的连接不重复创建
+    existing = sorted(expected, key=lambda pair: id(pair))[:2]
+    for pair in existing:
+        img, = (item for item in pair if isinstance(item, pb.VImageItem))
+        text, = (item for item in pair if isinstance(item, pb.VTextItem))
+        scene.add_image_text_connector(img, text)
+
+    created = scene.connect_nearest(images + texts, max_distance=max_distance, direction=direction)
+    assert created == len(expected) - len(existing)
+    assert {frozenset((c.image_item, c.text_item)) for c in scene.image_text_connectors} == expected
@@ -0,0 +1,263 @@
+import pytest
+from PyQt6.QtCore import QEvent, Qt
+from PyQt6.QtGui import QKeyEvent
+
+import pb
+
+
+class SizedCommand(pb.UndoCommand):
+    """固定占用的测试命令，记录执行和撤销次序"""
+    def __init__(self, scene, size, log, name):
+        super().__init__(scene)
+        self.size = size
+        self.log = log
+        self.name = name
+
+    def execute(self):
+        self.log.append(('do', self.name))
+
+    def undo(self):
+        self.log.append(('undo', self.name))
+
+    def footprint(self):
+        return self.size
+
+
+def test_undo_stack_trims_oldest_commands_by_bytes(scene):
+    stack = pb.UndoStack(max_bytes=1000)
+    log = []
+    for name in 'abcde':
+        stack.push(SizedCommand(scene, 300, log, name))
+    assert [c.name for c in stack.done] == ['c', 'd', 'e']
+    assert stack.total_bytes == 900
+
+    # 单条超出预算的命令仍然保留
+    stack.push(SizedCommand(scene, 5000, log, 'big'))
+    assert [c.name for c in stack.done] == ['big']
+    assert stack.total_bytes == 5000
+
+
+def test_undo_stack_budget_covers_redo_history(scene):
+    stack = pb.UndoStack(max_bytes=10000)
+    log = []
+    for name in 'abcd':
+        stack.push(SizedCommand(scene, 1000, log, name))
+    for _ in range(3):
+        stack.undo()
+    assert stack.total_bytes == 4000
+
+    stack.set_max_bytes(3000)
+    assert [c.name for c in stack.done] == ['a']
+    assert [c.name for c in stack.undone] == ['c', 'b']  # 最远的重做 d 被淘汰
+    assert stack.total_bytes == 3000
+    assert stack.redo() and stack.redo() and not stack.redo()
+    assert log[-2:] == [('do', 'b'), ('do', 'c')]
+
+    # 新命令使重做历史失效并释放其占用
+    stack.undo()
+    stack.push(SizedCommand(scene, 100, log, 'e'))
+    assert not stack.undone and stack.total_bytes == 2100
+
+
+def test_macro_is_one_undo_step(scene):
+    stack = pb.UndoStack()
+    log = []
+    stack.begin_macro(scene)
+    stack.push(SizedCommand(scene, 10, log, 'a'))
+    stack.begin_macro(scene)  # 嵌套的组合命令并入外层
+    stack.push(SizedCommand(scene, 10, log, 'b'))
+    stack.end_macro()
+    stack.end_macro()
+    assert len(stack.done) == 1
+    assert stack.done[0].bytes == pb.UNDO_COMMAND_BYTES + 20
+
+    stack.undo()
+    assert log[-2:] == [('undo', 'b'), ('undo', 'a')]
+    stack.redo()
+    assert log[-2:] == [('do', 'a'), ('do', 'b')]
+
+
+def test_property_edits_merge_only_from_same_source(scene):
+    text = pb.VTextItem('文字', 24, 300)
+    scene.add_item_with_undo(text)
+    stack = scene.undo_stack
+    base = len(stack.done)
+
+    spin = object()
+    for size in (25, 26, 27):
+        stack.push(pb.SetPropertyCommand.for_items(scene, [text], {'font_size': size}, spin))
+    assert len(stack.done) == base + 1
+    stack.push(pb.SetPropertyCommand.for_items(scene, [text], {'font_size': 28}, object()))
+    text.set_properties({'font_size': 29})
+    text.set_properties({'font_size': 30})
+    assert len(stack.done) == base + 4
+
+    stack.done[-1].time -= pb.PROPERTY_MERGE_WINDOW + 1
+    stack.push(pb.SetPropertyCommand.for_items(scene, [text], {'font_size': 31}, spin))
+    assert len(stack.done) == base + 5
+
+    for _ in range(5):
+        scene.undo()
+    assert text.font_size == 24
+
+
+@pytest.fixture
+def family(scene, image_path):
+    """父文字、子图片（父子连接器）和一条图文连接器"""
+    parent = pb.VTextItem('父', 24, 300)
+    parent.setPos(100, 100)
+    scene.add_item_with_undo(parent)
+    child = pb.VImageItem(image_path, 100)
+    child.setPos(400, 400)
+    scene.add_item_with_undo(child)
+    scene.undo_stack.push(pb.SetParentCommand(scene, child, parent))
+    scene.add_image_text_connector(child, parent)
+    return parent, child
+
+
+def test_delete_undo_reattaches_original_objects(scene, family):
+    parent, child = family
+    connectors = list(scene.connectors) + list(scene.image_text_connectors)
+    assert len(connectors) == 2
+
+    scene.delete_item(child)
+    assert child.scene() is None
+    assert not scene.connectors and not scene.image_text_connectors
+    scene.undo()
+    assert child.scene() is scene and child.parentItem() is parent
+    assert set(scene.connectors + scene.image_text_connectors) == set(connectors)
+    assert child in scene.elements_in_rect(child.sceneBoundingRect())
+
+
+@pytest.mark.parametrize('order', [(0, 1), (1, 0)])
+def test_deleting_parent_and_child_restores_hierarchy(scene, family, order):
+    parent, child = family
+    position = child.scenePos()
+    stack = scene.undo_stack
+    stack.begin_macro(scene)
+    for index in order:
+        scene.delete_item(family[index])
+    stack.end_macro()
+    assert parent.scene() is None and child.scene() is None
+
+    for _ in range(2):
+        scene.undo()
+        assert child.parentItem() is parent and child.scene() is scene
+        assert child.scenePos() == position
+        assert len(scene.connectors) == 1 and len(scene.image_text_connectors) == 1
+        scene.redo()
+        assert parent.scene() is None and not scene.connectors
+
+
+def test_delete_key_skips_children_of_selected_parents(scene, family):
+    parent, child = family
+    parent.setSelected(True)
+    child.setSelected(True)
+    scene.keyPressEvent(QKeyEvent(QEvent.Type.KeyPress, Qt.Key.Key_Delete, Qt.KeyboardModifier.NoModifier))
+
+    command = scene.undo_stack.done[-1]
+    assert isinstance(command, pb.DeleteItemCommand) and command.item is parent
+    scene.undo()
+    assert child.parentItem() is parent and len(scene.connectors) == 1
+
+
+def test_detach_element_ignores_items_outside_scene(scene, family):
+    parent, child = family
+    record = scene.detach_element(parent)
+    assert scene.detach_element(child) is None
+    scene.reattach_element(parent, record)
+    assert child.parentItem() is parent and child.scene() is scene
+
+
+def test_undone_add_is_charged_for_detached_item(scene, image_path):
+    stack = scene.undo_stack
+    image = pb.VImageItem(image_path, 200)
+    scene.add_item_with_undo(image)
+    command = stack.done[-1]
+    assert command.bytes == pb.UNDO_COMMAND_BYTES
+
+    scene.undo()
+    assert command.bytes == pb.UNDO_COMMAND_BYTES + pb.estimate_item_bytes(image)
+    assert command.bytes > 200 * 100 * pb.UNDO_PIXEL_BYTES
+    assert stack.total_bytes == sum(c.bytes for c in list(stack.done) + list(stack.undone))
+
+    scene.redo()
+    assert command.bytes == pb.UNDO_COMMAND_BYTES
+    scene.delete_item(image)
+    delete = stack.done[-1]
+    assert delete.bytes > pb.UNDO_COMMAND_BYTES
+    scene.undo()
+    assert delete.bytes == pb.UNDO_COMMAND_BYTES
+
+
+def test_undone_adds_respect_byte_budget(scene, image_path):
+    stack = scene.undo_stack
+    images = []
+    for index in range(6):
+        image = pb.VImageItem(image_path, 200)
+        image.setPos(index * 250, 0)
+        scene.add_item_with_undo(image)
+        images.append(image)
+    stack.set_max_bytes(3 * pb.estimate_item_bytes(images[0]))
+    for _ in images:
+        scene.undo()
+    assert stack.total_bytes <= stack.max_bytes
+    assert len(stack.undone) < len(images)
+
+
+@pytest.fixture
+def selection(scene, family, image_path):
+    """选中父文字、它的子图片和另一张独立图片"""
+    parent, child = family
+    other = pb.VImageItem(image_path, 100)
+    other.setPos(900, 100)
+    scene.add_item_with_undo(other)
+    for item in (parent, child, other):
+        item.setSelected(True)
+    return parent, child, other
+
+
+def test_drag_records_one_move_command(scene, selection):
+    parent, child, other = selection
+    stack = scene.undo_stack
+    before = len(stack.done)
+    starts = {item: item.scenePos() for item in selection}
+
+    scene.begin_drag_move(parent)
+    for step in range(1, 6):  # 拖动过程中的多次鼠标移动
+        for item in (parent, other):
+            item.setPos(starts[item] + pb.QPointF(40 * step, 30 * step))
+    scene.finish_drag_move()
+
+    assert len(stack.done) == before + 1
+    command = stack.done[-1]
+    assert isinstance(command, pb.MoveItemsCommand)
+    assert set(command.moves) == {parent, other}  # 子元素随父元素移动，不单独记录
+    assert child.scenePos() == starts[child] + pb.QPointF(200, 150)
+
+    scene.undo()
+    assert {item: item.scenePos() for item in selection} == starts
+
+
+def test_consecutive_nudges_merge_into_one_step(scene, selection):
+    parent, child, other = selection
+    stack = scene.undo_stack
+    before = len(stack.done)
+    starts = {item: item.scenePos() for item in selection}
+
+    for _ in range(5):
+        scene.nudge_selected(1, 0)
+    scene.nudge_selected(0, -10)
+    assert len(stack.done) == before + 1
+    assert parent.scenePos() == starts[parent] + pb.QPointF(5, -10)
+
+    # 大幅移动不与微调合并
+    scene.nudge_selected(50, 0)
+    assert len(stack.done) == before + 2
+
+    scene.undo()
+    scene.undo()
+    assert {item: item.scenePos() for item in selection} == starts
+    scene.redo()
+    assert other.scenePos() == starts[other] + pb.QPointF(5, -10)
+    assert child.scenePos() == starts[child] + pb.QPointF(5, -10)
@@ -0,0 +1,86 @@
+from PyQt6.QtCore import QRectF
+from PyQt6.QtGui import QImage
+from PyQt6.QtWidgets import QGraphicsSimpleTextItem
+
+import pb
+
+TEXT = '竖排文字，含标点。\n《书名》——第二列'
+OFFSCREEN = QRectF(50000, 50000, 10, 10)
+
+
+def glyphs(text):
+    return [(g.text(), g.pos(), g.rotation(), g.font().key())
+            for g in text.childItems() if isinstance(g, QGraphicsSimpleTextItem)]
+
+
+def test_dematerialize_cycle_reproduces_glyph_layout(scene, image_path):
+    text = pb.VTextItem(TEXT, 24, 150)
+    text.setPos(300, 100)
+    scene.addItem(text)
+    expected = glyphs(text)
+    rect = text.sceneBoundingRect()
+    assert len(expected) > 10 and any(rotation == 90 for _, _, rotation, _ in expected)
+
+    text.dematerialize()
+    assert not text.materialized and glyphs(text) == []
+    assert text.sceneBoundingRect() == rect
+    text.materialize()
+    assert glyphs(text) == expected
+
+    # 加载工程时先只排版，之后按需创建的字形与直接创建的一致
+    lazy = pb.VTextItem(TEXT, 24, 150, materialized=False)
+    lazy.setPos(300, 100)
+    scene.addItem(lazy)
+    assert glyphs(lazy) == [] and lazy.sceneBoundingRect() == rect
+    lazy.materialize()
+    assert glyphs(lazy) == expected
+
+    image = pb.VImageItem(image_path, 150)
+    scene.addItem(image)
+    size = image.p_item.pixmap().size()
+    image.dematerialize()
+    assert image.p_item is None and image.boundingRect().width() == 150
+    image.materialize()
+    assert image.p_item.pixmap().size() == size
+
+
+def test_scene_virtualization_follows_visible_region(scene, image_path):
+    text = pb.VTextItem(TEXT, 24, 150)
+    text.setPos(300, 100)
+    scene.addItem(text)
+    image = pb.VImageItem(image_path, 150)
+    image.setPos(1500, 1500)
+    scene.addItem(image)
+
+    scene.set_virtualized(True, text.sceneBoundingRect())
+    assert text.materialized and not image.materialized
+    scene.update_materialized(image.sceneBoundingRect())
+    assert image.materialized
+    scene.set_virtualized(False)
+    assert text.materialized and image.materialized
+
+
+def test_export_draws_dematerialized_items(scene, image_path, tmp_path):
+    scene.setSceneRect(0, 0, 400, 300)
+    text = pb.VTextItem(TEXT, 24, 150)
+    text.setPos(260, 20)
+    scene.addItem(text)
+    image = pb.VImageItem(image_path, 150)
+    image.setPos(40, 90)
+    scene.addItem(image)
+    scene.add_image_text_connector(image, text)
+    reference = str(tmp_path / 'reference.png')
+    pb.TiledImageExporter(scene).write(reference)
+
+    scene.set_virtualized(True, OFFSCREEN)
+    assert not text.materialized and not image.materialized
+    virtual = str(tmp_path / 'virtual.png')
+    assert pb.TiledImageExporter(scene).write(virtual)
+    assert QImage(virtual) == QImage(reference)
+    assert not text.materialized  # 图片导出直接按排版结果绘制，不创建字形
+
+    pdf = str(tmp_path / 'out.pdf')
+    assert pb.export_pdf(scene, pdf) == 1
+    assert text.materialized and image.materialized  # 矢量导出通过场景绘制，先创建全部字形和图片
+    with open(pdf, 'rb') as f:
+        assert f.read(5) == b'%PDF-'